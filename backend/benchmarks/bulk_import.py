@@ -0,0 +1,86 @@
+"""Benchmark certificate bulk-import throughput: one insert_one per row vs the batched import path.
+
+Validation, certificate construction and the inserts are timed together, as the endpoint runs them:
+    python benchmarks/bulk_import.py [num_rows]
+Needs a running MongoDB (MONGO_URL); the benchmark database is dropped afterwards.
+"""
+import asyncio
+import os
+import sys
+import time
+from pathlib import Path
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "cme_benchmark")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import server  # noqa: E402
+
+CREDIT_TYPES = ["ama_cat1", "ama_cat2", "moc", "ethics", "pain_mgmt"]
+
+
+def synthetic_rows(n, prefix):
+    return [
+        {
+            "title": f"{prefix} Activity {i}",
+            "provider": f"Provider {i % 40}",
+            "credits": "1.5",
+            "credit_types": CREDIT_TYPES[i % len(CREDIT_TYPES)],
+            "completion_date": f"2025-{(i % 12) + 1:02d}-{(i % 28) + 1:02d}",
+            "certificate_number": f"CN-{i}",
+        }
+        for i in range(n)
+    ]
+
+
+async def import_row_by_row(user_id, rows):
+    """The previous implementation: validate, build and insert_one per row"""
+    for row in rows:
+        credit_types = [t.strip() for t in row["credit_types"].split(",") if t.strip()]
+        cert = server.Certificate(
+            user_id=user_id,
+            title=row["title"],
+            provider=row["provider"],
+            credits=float(row["credits"]),
+            credit_types=credit_types,
+            credit_type=credit_types[0],
+            completion_date=row["completion_date"],
+            certificate_number=row["certificate_number"]
+        )
+        cert_dict = cert.model_dump()
+        cert_dict["created_at"] = cert_dict["created_at"].isoformat()
+        cert_dict["updated_at"] = cert_dict["updated_at"].isoformat()
+        await server.db.certificates.insert_one(cert_dict)
+        await server.upsert_ledger_entry("certificate", cert_dict)
+
+
+async def main(n):
+    await server.db.certificates.drop()
+    await server.db.credit_ledger.drop()
+    await server.create_indexes()
+
+    rows = synthetic_rows(n, "Legacy")
+    started = time.perf_counter()
+    await import_row_by_row("bench_user", rows)
+    legacy = time.perf_counter() - started
+
+    rows = synthetic_rows(n, "Batched")
+    started = time.perf_counter()
+    result = await server.import_certificate_rows("bench_user", rows)
+    batched = time.perf_counter() - started
+    assert len(result["imported"]) == n, result["errors"][:5]
+
+    started = time.perf_counter()
+    result = await server.import_certificate_rows("bench_user", rows)
+    reimport = time.perf_counter() - started
+
+    print(f"rows:                 {n}")
+    print(f"row by row:           {n / legacy:,.0f} rows/s ({legacy:.2f} s)")
+    print(f"batched insert_many:  {n / batched:,.0f} rows/s ({batched:.2f} s)")
+    print(f"re-import (all dups): {n / reimport:,.0f} rows/s, {result['duplicate_count']} duplicates rejected")
+
+    await server.client.drop_database(os.environ["DB_NAME"])
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 5000))
@@ -0,0 +1,71 @@
+"""Benchmark credit type matching: the old per-call map scan vs the compiled matcher.
+
+Reports throughput and accuracy on the labeled corpus in tests/credit_type_corpus.json:
+    python benchmarks/credit_type_matcher.py [iterations]
+No database is needed.
+"""
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "cme_benchmark")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import server  # noqa: E402
+
+CORPUS = Path(__file__).resolve().parent.parent / "tests" / "credit_type_corpus.json"
+
+
+def legacy_match(text):
+    """The previous implementation: rebuild the map, first substring hit wins, else ama_cat1"""
+    credit_type_map = {
+        "ama pra category 1": "ama_cat1", "ama category 1": "ama_cat1",
+        "category 1 credit": "ama_cat1", "category 1": "ama_cat1",
+        "ama pra category 2": "ama_cat2", "category 2": "ama_cat2",
+        "aoa category 1-a": "aoa_1a", "aoa 1a": "aoa_1a",
+        "aoa category 1-b": "aoa_1b", "aoa 1b": "aoa_1b",
+        "aanp contact": "aanp_contact", "aanp": "aanp_contact",
+        "aapa category 1": "aapa_cat1", "aapa": "aapa_cat1",
+        "ancc contact": "ancc_contact", "ancc": "ancc_contact", "contact hours": "ancc_contact",
+        "pharmacology": "pharmacology", "pharmacotherapeutics": "pharmacology",
+        "moc": "moc", "maintenance of certification": "moc",
+        "self-assessment": "self_assessment", "self assessment": "self_assessment",
+        "ethics": "ethics", "medical ethics": "ethics",
+        "pain management": "pain_mgmt", "opioid": "pain_mgmt",
+        "cne": "cne", "continuing nursing": "cne",
+    }
+    normalized = text.lower().strip()
+    if not normalized:
+        return []
+    for key, value in credit_type_map.items():
+        if key in normalized:
+            return [value]
+    return ["ama_cat1"]
+
+
+def compiled_match(text):
+    return server.matched_credit_type_ids(server.STANDARD_CREDIT_TYPE_MATCHER.match(text))
+
+
+def run(label, match, corpus, iterations):
+    correct = sum(1 for case in corpus if match(case["text"]) == case["expected"])
+    started = time.perf_counter()
+    for _ in range(iterations):
+        for case in corpus:
+            match(case["text"])
+    elapsed = time.perf_counter() - started
+    calls = iterations * len(corpus)
+    print(f"{label:<18}{calls / elapsed:>12,.0f} texts/s   {correct}/{len(corpus)} correct")
+
+
+def main(iterations):
+    corpus = json.loads(CORPUS.read_text())
+    run("legacy map scan", legacy_match, corpus, iterations)
+    run("compiled matcher", compiled_match, corpus, iterations)
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
@@ -0,0 +1,94 @@
+"""Compare query plans for the legacy credit_type/credit_types $or against the single multikey predicate.
+
+Seeds a throwaway database with synthetic certificates for many users, runs the credit_types
+migration, then explains a credit-type filtered certificate query both ways:
+    python benchmarks/credit_type_query_plans.py [num_certificates]
+Needs a running MongoDB (MONGO_URL); the benchmark database is dropped afterwards.
+"""
+import asyncio
+import os
+import sys
+from pathlib import Path
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "cme_benchmark")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import server  # noqa: E402
+
+CREDIT_TYPES = ["ama_cat1", "ama_cat2", "moc", "ethics", "pain_mgmt"]
+USERS = 50
+
+
+def synthetic_certificates(n):
+    for i in range(n):
+        credit_type = CREDIT_TYPES[i % len(CREDIT_TYPES)]
+        cert = {
+            "certificate_id": f"cert_{i:012d}",
+            "user_id": f"user_{i % USERS}",
+            "title": f"Synthetic Activity {i}",
+            "provider": f"Provider {i % 40}",
+            "credits": 1.0,
+            "completion_date": f"{2020 + i % 6}-{(i % 12) + 1:02d}-{(i % 28) + 1:02d}",
+        }
+        # Half the documents only carry the legacy field, as older data does
+        if i % 2:
+            cert["credit_type"] = credit_type
+        else:
+            cert["credit_types"] = [credit_type]
+        yield cert
+
+
+def summarize(explain):
+    stats = explain["executionStats"]
+    stages = []
+    stage = explain["queryPlanner"]["winningPlan"]
+    while stage:
+        stages.append(stage["stage"])
+        stage = stage.get("inputStage") or (stage.get("inputStages") or [None])[0]
+    return {
+        "plan": " <- ".join(stages),
+        "keys examined": stats["totalKeysExamined"],
+        "docs examined": stats["totalDocsExamined"],
+        "returned": stats["nReturned"],
+        "time (ms)": stats["executionTimeMillis"],
+    }
+
+
+async def explain(query):
+    cursor = server.db.certificates.find(query, {"_id": 0}).sort("completion_date", -1)
+    return summarize(await cursor.explain())
+
+
+async def main(n):
+    db = server.db
+    await db.certificates.drop()
+    await db.migrations.drop()
+    batch = []
+    for cert in synthetic_certificates(n):
+        batch.append(cert)
+        if len(batch) == 5000:
+            await db.certificates.insert_many(batch)
+            batch = []
+    if batch:
+        await db.certificates.insert_many(batch)
+    await server.create_indexes()
+
+    user_query = {"user_id": "user_7", "completion_date": {"$gte": "2023", "$lt": "2026"}}
+    legacy = {**user_query, "$or": [{"credit_types": {"$in": ["moc"]}}, {"credit_type": {"$in": ["moc"]}}]}
+    before = await explain(legacy)
+
+    await server.normalize_credit_types()
+    after = await explain({**user_query, **server.credit_types_predicate(["moc"])})
+
+    print(f"certificates: {n}")
+    for label, result in [("legacy $or", before), ("credit_types", after)]:
+        print(f"\n{label}")
+        for key, value in result.items():
+            print(f"  {key:<15}{value}")
+
+    await server.client.drop_database(os.environ["DB_NAME"])
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000))
@@ -0,0 +1,80 @@
+"""Benchmark the write-only Excel and PARS exporters on a synthetic 10k-row transcript.
+
+Each renderer runs in a fresh process so peak RSS is measured per renderer.
+The in-memory baseline mirrors the previous Workbook() + per-cell autosize code:
+    python benchmarks/excel_export.py [num_rows]
+"""
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "cme_benchmark")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import openpyxl  # noqa: E402
+
+import server  # noqa: E402
+
+
+def synthetic_certificates(n):
+    for i in range(n):
+        yield {
+            "certificate_id": f"cert_{i:012d}",
+            "title": f"Synthetic Activity {i} - Advances in Cardiology and Internal Medicine",
+            "provider": f"Provider {i % 40}",
+            "credits": 1.5,
+            "credit_types": ["ama_cat1"],
+            "credit_type": "ama_cat1",
+            "completion_date": f"2025-{(i % 12) + 1:02d}-{(i % 28) + 1:02d}",
+            "certificate_number": f"CN-{i}",
+            "subject": "Cardiology",
+        }
+
+
+def in_memory_pars(n, out):
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.append(server.PARS_HEADERS)
+    for cert in synthetic_certificates(n):
+        ws.append([cert.get(field or "title", "") for field in server.PARS_COLUMN_FIELDS])
+    for col in ws.columns:
+        max_length = max(len(str(cell.value)) for cell in col)
+        ws.column_dimensions[col[0].column_letter].width = min(max_length + 2, 50)
+    wb.save(out)
+
+
+def run(mode, n, results):
+    header = server.TranscriptHeader(user_name="Dr. Benchmark", year=2025, total_certificates=n, total_credits=1.5 * n)
+    started = time.perf_counter()
+    with tempfile.TemporaryFile() as out:
+        if mode == "excel (write-only)":
+            server.render_transcript_excel(header, synthetic_certificates(n), out)
+        elif mode == "pars (write-only)":
+            server.render_pars_workbook(header, [30] * 12, synthetic_certificates(n), out)
+        else:
+            in_memory_pars(n, out)
+        size = out.tell()
+    elapsed = time.perf_counter() - started
+    peak_kib = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    results.put((mode, elapsed, peak_kib, size))
+
+
+def main(n):
+    ctx = multiprocessing.get_context("spawn")
+    results = ctx.Queue()
+    print(f"{'renderer':<22}{'rows':>8}{'wall (s)':>10}{'peak RSS (MiB)':>16}{'size (KiB)':>12}")
+    for mode in ["excel (write-only)", "pars (write-only)", "pars (in-memory)"]:
+        proc = ctx.Process(target=run, args=(mode, n, results))
+        proc.start()
+        mode, elapsed, peak_kib, size = results.get()
+        proc.join()
+        print(f"{mode:<22}{n:>8}{elapsed:>10.2f}{peak_kib / 1024:>16.1f}{size / 1024:>12.0f}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
@@ -0,0 +1,55 @@
+"""Run a folder of certificate images through the OCR model cascade and report per-tier numbers.
+
+Each image goes through the configured cascade (OCR_CASCADE, OCR_ESCALATE_ON); the report shows
+attempts, mean latency, estimated cost and escalation rate per tier, and the estimated cost of
+sending every certificate straight to the last tier:
+    python benchmarks/ocr_cascade.py <image_dir>
+Needs EMERGENT_LLM_KEY; images must be PNG, JPEG, GIF or WebP.
+"""
+import asyncio
+import base64
+import os
+import sys
+from pathlib import Path
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "cme_benchmark")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import server  # noqa: E402
+
+IMAGE_SUFFIXES = {".png", ".jpg", ".jpeg", ".gif", ".webp"}
+
+
+async def main(image_dir):
+    api_key = os.environ.get("EMERGENT_LLM_KEY")
+    if not api_key:
+        sys.exit("EMERGENT_LLM_KEY is not set")
+    paths = sorted(p for p in Path(image_dir).iterdir() if p.suffix.lower() in IMAGE_SUFFIXES)
+    statuses = {}
+    for path in paths:
+        image_base64 = base64.b64encode(path.read_bytes()).decode()
+        try:
+            result = await server.run_ocr_cascade(path.stem, image_base64, api_key)
+            status = result["status"]
+            print(f"{path.name:<40}{result['model']:<28}{status}")
+        except Exception as e:
+            status = "error"
+            print(f"{path.name:<40}{'-':<28}error: {e}")
+        statuses[status] = statuses.get(status, 0) + 1
+
+    print(f"\ncertificates: {len(paths)}  " + "  ".join(f"{k}: {v}" for k, v in sorted(statuses.items())))
+    print(f"\n{'tier':<28}{'attempts':>9}{'accepted':>9}{'escalated':>10}{'errors':>8}{'mean ms':>9}{'cost $':>10}{'esc rate':>9}")
+    for row in server.ocr_cascade_report():
+        mean = f"{row['mean_latency_ms']:.0f}" if row["mean_latency_ms"] is not None else "-"
+        rate = f"{row['escalation_rate']:.0%}" if row["escalation_rate"] is not None else "-"
+        print(f"{row['tier']:<28}{row['attempts']:>9}{row['accepted']:>9}{row['escalated']:>10}{row['errors']:>8}{mean:>9}{row['cost']:>10.4f}{rate:>9}")
+    cascade_cost = sum(row["cost"] for row in server.ocr_cascade_report())
+    print(f"\ncascade cost:        ${cascade_cost:.4f}")
+    print(f"last tier only cost: ${len(paths) * server.OCR_CASCADE[-1]['cost']:.4f} (estimated)")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        sys.exit(__doc__)
+    asyncio.run(main(sys.argv[1]))
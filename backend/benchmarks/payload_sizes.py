@@ -0,0 +1,31 @@
+"""Report list payload sizes per endpoint for the full (detail) view vs the lean defaults.
+
+Runs against a live backend, like the tests:
+    REACT_APP_BACKEND_URL=... TEST_SESSION_TOKEN=... python benchmarks/payload_sizes.py
+"""
+import os
+import requests
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', '').rstrip('/')
+SESSION_TOKEN = os.environ.get('TEST_SESSION_TOKEN', 'test_session_1772029888767')
+
+ENDPOINTS = ["/api/certificates", "/api/self-reported", "/api/events", "/api/materials"]
+
+
+def main():
+    session = requests.Session()
+    session.headers.update({"Authorization": f"Bearer {SESSION_TOKEN}"})
+
+    print(f"{'endpoint':<24}{'detail (bytes)':>16}{'summary (bytes)':>17}{'export (bytes)':>16}{'saved':>8}")
+    for endpoint in ENDPOINTS:
+        sizes = {}
+        for view in ["detail", "summary", "export"]:
+            r = session.get(f"{BASE_URL}{endpoint}", params={"view": view})
+            r.raise_for_status()
+            sizes[view] = len(r.content)
+        saved = 1 - sizes["summary"] / sizes["detail"] if sizes["detail"] else 0
+        print(f"{endpoint:<24}{sizes['detail']:>16}{sizes['summary']:>17}{sizes['export']:>16}{saved:>8.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,24 +1,51 @@
 from fastapi import FastAPI, APIRouter, HTTPException, Request, Response, UploadFile, File, Depends, Query
-from fastapi.responses import StreamingResponse
+from fastapi.responses import StreamingResponse, JSONResponse, PlainTextResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorGridFSBucket
+from gridfs.errors import NoFile
+from pymongo import CursorType, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, CollectionInvalid, DuplicateKeyError
 import os
 import logging
 from pathlib import Path
-from pydantic import BaseModel, Field, ConfigDict
-from typing import List, Optional, Dict, Any
+from pydantic import BaseModel, Field, ConfigDict, TypeAdapter, ValidationError, field_validator
+from typing import List, Optional, Dict, Any, Iterable
 import uuid
 from datetime import datetime, timezone, timedelta
 import httpx
 import base64
+import hashlib
+import secrets
 import io
+import asyncio
+import queue
+import tempfile
+from contextlib import asynccontextmanager, nullcontext
 from reportlab.lib.pagesizes import letter
-from reportlab.pdfgen import canvas
 from reportlab.lib.units import inch
+from reportlab.pdfbase.pdfmetrics import stringWidth
+from reportlab.lib import colors
+from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, Flowable
+from xml.sax.saxutils import escape
+from jinja2 import Environment, FileSystemLoader, select_autoescape
 import openpyxl
 from openpyxl.styles import Font, Alignment, Border, Side
+from openpyxl.cell import Cell, WriteOnlyCell
+from openpyxl.utils import get_column_letter
+from PIL import Image, ImageOps
+import numpy as np
 import json
+import math
+import re
+import time
+import urllib.parse
+import zlib
+import csv
+import functools
+import itertools
+import shutil
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
@@ -50,6 +77,7 @@ class User(BaseModel):
     npi_number: Optional[str] = None  # National Provider Identifier
     npi_verified: bool = False  # Whether NPI has been validated
     npi_data: Optional[Dict[str, Any]] = None  # Data from NPPES registry
+    data_version: int = 0  # Bumped whenever the user's credits change; keys cached exports
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
@@ -75,6 +103,8 @@ class Certificate(BaseModel):
     expiration_date: Optional[str] = None
     certificate_number: Optional[str] = None
     image_url: Optional[str] = None
+    thumbnail_url: Optional[str] = None
+    preview_url: Optional[str] = None
     ocr_status: str = "none"  # none, processing, completed, failed
     ocr_data: Optional[Dict[str, Any]] = None
     eeds_imported: bool = False
@@ -280,9 +310,11 @@ class CourseMaterial(BaseModel):
     event_id: Optional[str] = None
     title: str
     material_type: str  # handout, slides, video, article, other
-    file_url: Optional[str] = None  # Base64 or external URL
+    file_url: Optional[str] = None  # /api/materials/{id}/content, or an external URL
     file_name: Optional[str] = None
     file_size: Optional[int] = None
+    content_type: Optional[str] = None
+    sha256: Optional[str] = None
     notes: Optional[str] = None
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
@@ -333,13 +365,18 @@ CME_TYPES = {
 
 # ============ AUTH HELPERS ============
 
-async def get_current_user(request: Request) -> User:
-    """Get current user from session token"""
+def get_session_token(request: Request) -> Optional[str]:
+    """Session token from the cookie, or from a Bearer Authorization header"""
     session_token = request.cookies.get("session_token")
     if not session_token:
         auth_header = request.headers.get("Authorization")
         if auth_header and auth_header.startswith("Bearer "):
             session_token = auth_header.split(" ")[1]
+    return session_token
+
+async def get_current_user(request: Request) -> User:
+    """Get current user from session token"""
+    session_token = get_session_token(request)
     
     if not session_token:
         raise HTTPException(status_code=401, detail="Not authenticated")
@@ -362,6 +399,321 @@ async def get_current_user(request: Request) -> User:
     
     return User(**user)
 
+# ============ RATE LIMITING ============
+
+def rate_limit_setting(route_class: str, burst: int, per_minute: float) -> Dict[str, float]:
+    """Token bucket size and refill rate for a route class, overridable from the environment"""
+    prefix = f"RATE_LIMIT_{route_class.upper()}"
+    burst = int(os.environ.get(f"{prefix}_BURST", str(burst)))
+    per_minute = float(os.environ.get(f"{prefix}_PER_MINUTE", str(per_minute)))
+    return {"capacity": burst, "refill_per_second": per_minute / 60}
+
+RATE_LIMITS = {
+    "upload": rate_limit_setting("upload", 10, 30),
+    "export": rate_limit_setting("export", 30, 30),
+    "npi": rate_limit_setting("npi", 5, 10),
+}
+# "memory" limits per worker process; "mongo" shares the buckets between workers
+RATE_LIMIT_BACKEND = os.environ.get("RATE_LIMIT_BACKEND", "memory")
+RATE_LIMIT_PRUNE_INTERVAL = 60  # Seconds between sweeps of idle in-memory buckets
+
+# Limit hits, exposed on /api/metrics
+limit_metrics: Dict[tuple, int] = {}
+
+def count_limit_hit(metric: str, label: str):
+    limit_metrics[(metric, label)] = limit_metrics.get((metric, label), 0) + 1
+
+class InMemoryRateLimiter:
+    """Token buckets held in this process"""
+    def __init__(self):
+        # key -> (tokens, updated, time the bucket is full again)
+        self.buckets: Dict[str, tuple] = {}
+        self.pruned_at = time.monotonic()
+
+    def prune(self, now: float):
+        """Drop buckets that have refilled; a missing bucket starts out full anyway"""
+        self.buckets = {key: bucket for key, bucket in self.buckets.items() if bucket[2] > now}
+        self.pruned_at = now
+
+    async def acquire(self, key: str, capacity: float, refill_per_second: float) -> float:
+        """Take a token, returning 0 or the seconds until one is available"""
+        now = time.monotonic()
+        if now - self.pruned_at >= RATE_LIMIT_PRUNE_INTERVAL:
+            self.prune(now)
+        tokens, updated, _ = self.buckets.get(key, (capacity, now, now))
+        tokens = min(capacity, tokens + (now - updated) * refill_per_second)
+        retry_after = 0 if tokens >= 1 else (1 - tokens) / refill_per_second
+        if tokens >= 1:
+            tokens -= 1
+        self.buckets[key] = (tokens, now, now + (capacity - tokens) / refill_per_second)
+        return retry_after
+
+class MongoRateLimiter:
+    """Token buckets in the rate_limits collection, shared by every worker.
+
+    Each bucket is updated with a compare-and-set on its last update time, so
+    concurrent requests from several workers cannot spend the same token.
+    """
+    async def acquire(self, key: str, capacity: float, refill_per_second: float) -> float:
+        while True:
+            now = time.time()
+            bucket = await db.rate_limits.find_one({"_id": key})
+            if bucket is None:
+                tokens, updated = capacity, now
+            else:
+                updated = bucket["updated_at"]
+                tokens = min(capacity, bucket["tokens"] + max(now - updated, 0) * refill_per_second)
+            
+            retry_after = 0 if tokens >= 1 else (1 - tokens) / refill_per_second
+            remaining = tokens - 1 if tokens >= 1 else tokens
+            fields = {
+                "tokens": remaining,
+                "updated_at": now,
+                # Idle buckets are full again by then, so the TTL index can drop them
+                "expires_at": datetime.now(timezone.utc) + timedelta(seconds=capacity / refill_per_second)
+            }
+            if bucket is None:
+                try:
+                    await db.rate_limits.insert_one({"_id": key, **fields})
+                    return retry_after
+                except DuplicateKeyError:
+                    continue
+            result = await db.rate_limits.update_one({"_id": key, "updated_at": updated}, {"$set": fields})
+            if result.modified_count:
+                return retry_after
+
+rate_limiter = MongoRateLimiter() if RATE_LIMIT_BACKEND == "mongo" else InMemoryRateLimiter()
+
+def rate_limited_user(route_class: str):
+    """Dependency resolving the current user, rejecting with 429 once their bucket for route_class is empty"""
+    limit = RATE_LIMITS[route_class]
+    
+    async def dependency(user: User = Depends(get_current_user)) -> User:
+        retry_after = await rate_limiter.acquire(
+            f"{user.user_id}:{route_class}", limit["capacity"], limit["refill_per_second"]
+        )
+        if retry_after:
+            count_limit_hit("rate_limited", route_class)
+            raise HTTPException(
+                status_code=429,
+                detail="Too many requests. Please try again shortly.",
+                headers={"Retry-After": str(math.ceil(retry_after))}
+            )
+        return user
+    
+    return dependency
+
+class ConcurrencyLimiter:
+    """Bound how many expensive operations run at once across all users.
+
+    Up to max_waiting callers queue for a slot, each for at most wait_timeout
+    seconds; anyone beyond that gets a 503 with Retry-After rather than
+    piling onto an unbounded queue.
+    """
+    def __init__(self, name: str, limit: int, max_waiting: int, wait_timeout: float = 30):
+        self.name = name
+        self.limit = limit
+        self.max_waiting = max_waiting
+        self.wait_timeout = wait_timeout
+        self.semaphore = asyncio.Semaphore(limit)
+        self.active = 0
+        self.waiting = 0
+
+    def overloaded(self) -> HTTPException:
+        count_limit_hit("overloaded", self.name)
+        return HTTPException(
+            status_code=503,
+            detail="The server is busy. Please try again shortly.",
+            headers={"Retry-After": str(math.ceil(self.wait_timeout / 2))}
+        )
+
+    @asynccontextmanager
+    async def slot(self):
+        if self.semaphore.locked() and self.waiting >= self.max_waiting:
+            raise self.overloaded()
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self.semaphore.acquire(), self.wait_timeout)
+        except asyncio.TimeoutError:
+            raise self.overloaded()
+        finally:
+            self.waiting -= 1
+        self.active += 1
+        try:
+            yield
+        finally:
+            self.active -= 1
+            self.semaphore.release()
+
+ocr_limiter = ConcurrencyLimiter(
+    "ocr",
+    int(os.environ.get("OCR_CONCURRENCY", "4")),
+    int(os.environ.get("OCR_MAX_WAITING", "16"))
+)
+render_limiter = ConcurrencyLimiter(
+    "render",
+    int(os.environ.get("RENDER_CONCURRENCY", str(os.cpu_count() or 2))),
+    int(os.environ.get("RENDER_MAX_WAITING", "8"))
+)
+
+# ============ PAGINATION HELPERS ============
+
+DEFAULT_PAGE_SIZE = int(os.environ.get("DEFAULT_PAGE_SIZE", "100"))
+MAX_PAGE_SIZE = int(os.environ.get("MAX_PAGE_SIZE", "500"))
+
+def encode_cursor(sort_value: Any, id_value: str) -> str:
+    """Encode the (sort_key, id) of the last item on a page as an opaque cursor"""
+    raw = json.dumps([sort_value, id_value], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("utf-8").rstrip("=")
+
+def decode_cursor(cursor: str) -> tuple:
+    """Decode a cursor produced by encode_cursor"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        sort_value, id_value = json.loads(base64.urlsafe_b64decode(padded.encode("utf-8")))
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return sort_value, id_value
+
+def keyset_condition(sort_field: str, id_field: str, direction: int, sort_value: Any, id_value: str) -> Dict[str, Any]:
+    """Build the match condition for documents that sort strictly after (sort_value, id_value)"""
+    op = "$lt" if direction < 0 else "$gt"
+    tie_break = {sort_field: sort_value, id_field: {op: id_value}}
+
+    if sort_value is None:
+        # Nulls sort before every other value, so they are last in descending
+        # order and first in ascending order.
+        if direction < 0:
+            return tie_break
+        return {"$or": [tie_break, {sort_field: {"$ne": None}}]}
+
+    if direction < 0:
+        # Comparisons never match null or missing values, which still follow in descending order
+        return {"$or": [{sort_field: {op: sort_value}}, tie_break, {sort_field: None}]}
+    return {"$or": [{sort_field: {op: sort_value}}, tie_break]}
+
+async def paginate(
+    collection,
+    query: Dict[str, Any],
+    sort_field: str,
+    id_field: str,
+    direction: int = -1,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    projection: Optional[Dict[str, Any]] = None
+):
+    """List documents ordered by (sort_field, id_field) using keyset pagination.
+
+    Without limit or cursor the full, untruncated list is returned for
+    backwards compatibility. Otherwise a page envelope is returned:
+    {"items": [...], "has_more": bool, "next_cursor": str | None}
+    """
+    projection = projection or {"_id": 0}
+    sort_spec = [(sort_field, direction), (id_field, direction)]
+
+    if limit is None and cursor is None:
+        return await collection.find(query, projection).sort(sort_spec).to_list(None)
+
+    page_size = max(1, min(limit or DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE))
+
+    page_query = query
+    if cursor:
+        sort_value, id_value = decode_cursor(cursor)
+        page_query = {"$and": [query, keyset_condition(sort_field, id_field, direction, sort_value, id_value)]}
+
+    # Both keys are needed to build the next cursor, even if the caller projected them away
+    fetch_projection = dict(projection)
+    if any(v for k, v in projection.items() if k != "_id"):
+        fetch_projection[sort_field] = 1
+        fetch_projection[id_field] = 1
+
+    items = await collection.find(page_query, fetch_projection).sort(sort_spec).limit(page_size + 1).to_list(page_size + 1)
+
+    has_more = len(items) > page_size
+    items = items[:page_size]
+    next_cursor = None
+    if has_more and items:
+        last = items[-1]
+        next_cursor = encode_cursor(last.get(sort_field), last[id_field])
+
+    return {
+        "items": items,
+        "has_more": has_more,
+        "next_cursor": next_cursor
+    }
+
+# ============ FIELD PROJECTIONS ============
+
+# Named views translate into Mongo projections. "detail" is the full document;
+# list endpoints default to "summary" so heavy payloads (image_url, ocr_data,
+# file_url) are only sent when explicitly requested.
+FIELD_VIEWS = {
+    "certificates": {
+        "summary": [
+            "certificate_id", "title", "provider", "credits", "credit_types", "credit_type",
+            "subject", "completion_date", "expiration_date", "certificate_number",
+            "ocr_status", "ocr_error", "eeds_imported", "thumbnail_url", "preview_url",
+            "created_at", "updated_at"
+        ],
+        "export": [
+            "certificate_id", "title", "provider", "credits", "credit_types", "credit_type",
+            "subject", "completion_date", "certificate_number", "accme_provider_number", "location"
+        ],
+    },
+    "self_reported_credits": {
+        "summary": [
+            "credit_id", "activity_type", "title", "description", "credits", "credit_types",
+            "completion_date", "hours_spent", "reference_url", "created_at", "updated_at"
+        ],
+        "export": ["credit_id", "activity_type", "title", "credits", "credit_types", "completion_date"],
+    },
+    "cme_events": {
+        "summary": [
+            "event_id", "title", "description", "provider", "location", "event_url",
+            "start_date", "end_date", "start_time", "end_time", "credits_available",
+            "credit_types", "registration_url", "cost", "is_registered", "is_attended",
+            "passcode", "notes"
+        ],
+        "export": [
+            "event_id", "title", "provider", "location", "start_date", "end_date",
+            "credits_available", "credit_types", "is_attended"
+        ],
+    },
+    "course_materials": {
+        "summary": [
+            "material_id", "certificate_id", "event_id", "title", "material_type",
+            "file_name", "file_size", "content_type", "notes", "created_at"
+        ],
+        "export": ["material_id", "certificate_id", "event_id", "title", "material_type", "file_name", "file_size"],
+    },
+}
+
+def build_projection(
+    resource: str,
+    view: Optional[str] = None,
+    fields: Optional[str] = None,
+    default_view: str = "summary"
+) -> Dict[str, Any]:
+    """Translate a fields= list or a named view into a Mongo projection"""
+    if fields:
+        names = [f.strip() for f in fields.split(",") if f.strip()]
+        invalid = [f for f in names if f.startswith("$") or f == "_id" or not f.replace("_", "").replace(".", "").isalnum()]
+        if invalid or not names:
+            raise HTTPException(status_code=400, detail=f"Invalid fields: {', '.join(invalid) or fields}")
+        projection = {name: 1 for name in names}
+        projection["_id"] = 0
+        return projection
+
+    view = view or default_view
+    if view == "detail":
+        return {"_id": 0}
+    views = FIELD_VIEWS[resource]
+    if view not in views:
+        raise HTTPException(status_code=400, detail=f"Unknown view '{view}'. Use one of: detail, {', '.join(views)}")
+    projection = {name: 1 for name in views[view]}
+    projection["_id"] = 0
+    return projection
+
 # ============ AUTH ROUTES ============
 
 @api_router.post("/auth/session")
@@ -565,7 +917,7 @@ async def lookup_npi_registry(npi: str) -> Optional[Dict[str, Any]]:
         return None
 
 @api_router.post("/users/npi/validate")
-async def validate_npi(request: Request, user: User = Depends(get_current_user)):
+async def validate_npi(request: Request, user: User = Depends(rate_limited_user("npi"))):
     """Validate and link NPI number to profile"""
     body = await request.json()
     npi = body.get("npi", "").strip()
@@ -644,6 +996,13 @@ async def get_all_cme_types():
     """Get all CME types"""
     return CME_TYPES
 
+@api_router.get("/cme-types/match")
+async def match_cme_types(text: str = "", user: User = Depends(get_current_user)):
+    """Match certificate credit wording to credit types, with confidence scores"""
+    matcher = await user_credit_type_matcher(user.user_id)
+    matches = matcher.match(text)
+    return {"matches": matches, "credit_types": matched_credit_type_ids(matches)}
+
 @api_router.post("/cme-types/custom")
 async def create_custom_credit_type(request: Request, user: User = Depends(get_current_user)):
     """Create a custom credit type"""
@@ -705,15 +1064,19 @@ async def get_self_reported_types():
 @api_router.get("/self-reported")
 async def get_self_reported_credits(
     user: User = Depends(get_current_user),
-    year: Optional[int] = None
+    year: Optional[int] = None,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    view: Optional[str] = None,
+    fields: Optional[str] = None
 ):
     """Get user's self-reported credits"""
     query = {"user_id": user.user_id}
     if year:
         query["completion_date"] = {"$regex": f"^{year}"}
     
-    credits = await db.self_reported_credits.find(query, {"_id": 0}).sort("completion_date", -1).to_list(500)
-    return credits
+    projection = build_projection("self_reported_credits", view, fields)
+    return await paginate(db.self_reported_credits, query, "completion_date", "credit_id", -1, limit, cursor, projection)
 
 @api_router.post("/self-reported")
 async def create_self_reported_credit(data: SelfReportedCreditCreate, user: User = Depends(get_current_user)):
@@ -721,11 +1084,13 @@ async def create_self_reported_credit(data: SelfReportedCreditCreate, user: User
     credit = SelfReportedCredit(user_id=user.user_id, **data.model_dump())
     
     credit_dict = credit.model_dump()
+    credit_dict["credit_types"] = credit_types_of(credit_dict)
     credit_dict["created_at"] = credit_dict["created_at"].isoformat()
     credit_dict["updated_at"] = credit_dict["updated_at"].isoformat()
     
     await db.self_reported_credits.insert_one(credit_dict)
     credit_dict.pop("_id", None)
+    await upsert_ledger_entry("self_reported", credit_dict)
     
     # Update requirement progress (self-reported credits count too)
     await update_requirement_progress(user.user_id)
@@ -736,6 +1101,8 @@ async def create_self_reported_credit(data: SelfReportedCreditCreate, user: User
 async def update_self_reported_credit(credit_id: str, request: Request, user: User = Depends(get_current_user)):
     """Update a self-reported credit"""
     body = await request.json()
+    if "credit_types" in body:
+        body["credit_types"] = credit_types_of(body)
     
     result = await db.self_reported_credits.update_one(
         {"credit_id": credit_id, "user_id": user.user_id},
@@ -745,9 +1112,9 @@ async def update_self_reported_credit(credit_id: str, request: Request, user: Us
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Self-reported credit not found")
     
-    await update_requirement_progress(user.user_id)
-    
     credit = await db.self_reported_credits.find_one({"credit_id": credit_id}, {"_id": 0})
+    await upsert_ledger_entry("self_reported", credit)
+    await update_requirement_progress(user.user_id)
     return credit
 
 @api_router.delete("/self-reported/{credit_id}")
@@ -760,16 +1127,172 @@ async def delete_self_reported_credit(credit_id: str, user: User = Depends(get_c
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Self-reported credit not found")
     
+    await record_tombstones(user.user_id, "self_reported_credits", [credit_id])
+    await remove_ledger_entry("self_reported", credit_id)
     await update_requirement_progress(user.user_id)
     return {"message": "Self-reported credit deleted"}
 
+# ============ EVENT STREAM ============
+
+EVENT_HEARTBEAT_SECONDS = float(os.environ.get("EVENT_HEARTBEAT_SECONDS", "15"))
+EVENT_QUEUE_SIZE = 100  # Events buffered per connection; the oldest are dropped past this
+EVENT_LOG_BYTES = 16 * 1024 * 1024
+# "memory" delivers within this worker; "mongo" shares events between workers
+EVENT_BUS_BACKEND = os.environ.get("EVENT_BUS_BACKEND", "memory")
+
+class EventHub:
+    """This worker's SSE connections, by user, each fed through its own bounded queue"""
+    def __init__(self):
+        self.subscribers: Dict[str, set] = {}
+        self.dropped = 0
+
+    @property
+    def connections(self) -> int:
+        return sum(len(queues) for queues in self.subscribers.values())
+
+    def subscribe(self, user_id: str) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=EVENT_QUEUE_SIZE)
+        self.subscribers.setdefault(user_id, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, user_id: str, queue: asyncio.Queue):
+        queues = self.subscribers.get(user_id)
+        if queues is not None:
+            queues.discard(queue)
+            if not queues:
+                del self.subscribers[user_id]
+
+    def deliver(self, event: Dict[str, Any]):
+        for queue in self.subscribers.get(event["user_id"], ()):
+            if queue.full():
+                # A stalled client loses its oldest event rather than holding up the others
+                queue.get_nowait()
+                self.dropped += 1
+            queue.put_nowait(event)
+
+class LocalEventBus:
+    """Delivers published events to this worker's connections only"""
+    def __init__(self, hub: EventHub):
+        self.hub = hub
+        self.sequence = itertools.count(1)
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def publish(self, event: Dict[str, Any]):
+        self.hub.deliver({**event, "id": str(next(self.sequence))})
+
+class MongoEventBus:
+    """Shares events between workers through the capped events collection.
+
+    Each worker tails the collection once and fans out to its own connections,
+    so open streams cost no queries of their own.
+    """
+    def __init__(self, hub: EventHub):
+        self.hub = hub
+        self.task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        if "events" not in await db.list_collection_names():
+            try:
+                await db.create_collection("events", capped=True, size=EVENT_LOG_BYTES)
+                # A tailable cursor on an empty capped collection closes at once
+                await db.events.insert_one({"type": "bus.started", "created_at": datetime.now(timezone.utc).isoformat()})
+            except CollectionInvalid:
+                pass  # Created by another worker
+        self.task = asyncio.create_task(self.tail())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+
+    async def publish(self, event: Dict[str, Any]):
+        await db.events.insert_one({**event, "created_at": datetime.now(timezone.utc).isoformat()})
+
+    async def tail(self):
+        latest = await db.events.find({}, {"_id": 1}).sort("$natural", -1).limit(1).to_list(1)
+        last_id = latest[0]["_id"] if latest else None
+        while True:
+            try:
+                cursor = db.events.find(
+                    {"_id": {"$gt": last_id}} if last_id else {},
+                    cursor_type=CursorType.TAILABLE_AWAIT
+                )
+                while cursor.alive:
+                    async for doc in cursor:
+                        last_id = doc["_id"]
+                        if doc.get("user_id"):
+                            self.hub.deliver({
+                                "id": str(doc["_id"]), "user_id": doc["user_id"], "type": doc["type"], "data": doc["data"]
+                            })
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Event bus tail failed: {e}")
+            await asyncio.sleep(1)
+
+EVENT_BUSES = {"memory": LocalEventBus, "mongo": MongoEventBus}
+event_hub = EventHub()
+event_bus = EVENT_BUSES[EVENT_BUS_BACKEND](event_hub)
+
+async def publish_event(user_id: str, event_type: str, data: Dict[str, Any]):
+    """Push an event to the user's open streams; a failed publish never fails the caller"""
+    try:
+        await event_bus.publish({"user_id": user_id, "type": event_type, "data": data})
+    except Exception as e:
+        logger.warning(f"Publishing {event_type} for {user_id} failed: {e}")
+
+async def publish_ocr_status(cert: Optional[Dict[str, Any]]):
+    if cert:
+        await publish_event(cert["user_id"], "certificate.ocr", {
+            "certificate_id": cert["certificate_id"],
+            "ocr_status": cert.get("ocr_status"),
+            "ocr_error": cert.get("ocr_error"),
+        })
+
+def format_sse(event: Dict[str, Any]) -> str:
+    return f"id: {event['id']}\nevent: {event['type']}\ndata: {json.dumps(event['data'])}\n\n"
+
+@api_router.get("/events/stream")
+async def stream_events(user: User = Depends(get_current_user)):
+    """Server-Sent Events for the user: OCR status changes, finished exports and requirement progress"""
+    queue = event_hub.subscribe(user.user_id)
+    
+    async def events():
+        try:
+            yield "retry: 5000\n: connected\n\n"
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), EVENT_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    # Keeps proxies from closing an idle stream
+                    yield ": heartbeat\n\n"
+                    continue
+                yield format_sse(event)
+        finally:
+            event_hub.unsubscribe(user.user_id, queue)
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 # ============ CME EVENTS/CALENDAR ROUTES ============
 
 @api_router.get("/events")
 async def get_events(
     user: User = Depends(get_current_user),
     upcoming: bool = False,
-    past: bool = False
+    past: bool = False,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    view: Optional[str] = None,
+    fields: Optional[str] = None
 ):
     """Get user's CME events"""
     query = {"user_id": user.user_id}
@@ -780,8 +1303,8 @@ async def get_events(
     elif past:
         query["start_date"] = {"$lt": today}
     
-    events = await db.cme_events.find(query, {"_id": 0}).sort("start_date", 1).to_list(500)
-    return events
+    projection = build_projection("cme_events", view, fields)
+    return await paginate(db.cme_events, query, "start_date", "event_id", 1, limit, cursor, projection)
 
 @api_router.post("/events")
 async def create_event(data: CMEEventCreate, user: User = Depends(get_current_user)):
@@ -802,11 +1325,16 @@ async def create_event(data: CMEEventCreate, user: User = Depends(get_current_us
     return event_dict
 
 @api_router.get("/events/{event_id}")
-async def get_event(event_id: str, user: User = Depends(get_current_user)):
+async def get_event(
+    event_id: str,
+    user: User = Depends(get_current_user),
+    view: Optional[str] = None,
+    fields: Optional[str] = None
+):
     """Get a specific event"""
     event = await db.cme_events.find_one(
         {"event_id": event_id, "user_id": user.user_id},
-        {"_id": 0}
+        build_projection("cme_events", view, fields, default_view="detail")
     )
     if not event:
         raise HTTPException(status_code=404, detail="Event not found")
@@ -837,6 +1365,7 @@ async def delete_event(event_id: str, user: User = Depends(get_current_user)):
     
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Event not found")
+    await record_tombstones(user.user_id, "events", [event_id])
     
     return {"message": "Event deleted"}
 
@@ -906,13 +1435,21 @@ async def sign_in_to_event(request: Request, user: User = Depends(get_current_us
 # ============ EVALUATIONS ROUTES ============
 
 @api_router.get("/evaluations")
-async def get_evaluations(user: User = Depends(get_current_user)):
+async def get_evaluations(
+    user: User = Depends(get_current_user),
+    certificate_id: Optional[str] = None,
+    event_id: Optional[str] = None,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None
+):
     """Get user's evaluations"""
-    evaluations = await db.evaluations.find(
-        {"user_id": user.user_id},
-        {"_id": 0}
-    ).sort("created_at", -1).to_list(500)
-    return evaluations
+    query = {"user_id": user.user_id}
+    if certificate_id:
+        query["certificate_id"] = certificate_id
+    if event_id:
+        query["event_id"] = event_id
+    
+    return await paginate(db.evaluations, query, "created_at", "evaluation_id", -1, limit, cursor)
 
 @api_router.post("/evaluations")
 async def create_evaluation(data: EvaluationCreate, user: User = Depends(get_current_user)):
@@ -953,13 +1490,21 @@ async def delete_evaluation(evaluation_id: str, user: User = Depends(get_current
 # ============ SPEAKER DISCLOSURES ROUTES ============
 
 @api_router.get("/disclosures")
-async def get_disclosures(user: User = Depends(get_current_user)):
+async def get_disclosures(
+    user: User = Depends(get_current_user),
+    certificate_id: Optional[str] = None,
+    event_id: Optional[str] = None,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None
+):
     """Get speaker disclosures"""
-    disclosures = await db.speaker_disclosures.find(
-        {"user_id": user.user_id},
-        {"_id": 0}
-    ).sort("created_at", -1).to_list(500)
-    return disclosures
+    query = {"user_id": user.user_id}
+    if certificate_id:
+        query["certificate_id"] = certificate_id
+    if event_id:
+        query["event_id"] = event_id
+    
+    return await paginate(db.speaker_disclosures, query, "created_at", "disclosure_id", -1, limit, cursor)
 
 @api_router.post("/disclosures")
 async def create_disclosure(data: SpeakerDisclosureCreate, user: User = Depends(get_current_user)):
@@ -992,7 +1537,11 @@ async def delete_disclosure(disclosure_id: str, user: User = Depends(get_current
 async def get_materials(
     user: User = Depends(get_current_user),
     certificate_id: Optional[str] = None,
-    event_id: Optional[str] = None
+    event_id: Optional[str] = None,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    view: Optional[str] = None,
+    fields: Optional[str] = None
 ):
     """Get course materials"""
     query = {"user_id": user.user_id}
@@ -1001,8 +1550,17 @@ async def get_materials(
     if event_id:
         query["event_id"] = event_id
     
-    materials = await db.course_materials.find(query, {"_id": 0}).sort("created_at", -1).to_list(500)
-    return materials
+    projection = build_projection("course_materials", view, fields)
+    return await paginate(db.course_materials, query, "created_at", "material_id", -1, limit, cursor, projection)
+
+# Material files live in GridFS under their material_id
+material_bucket = AsyncIOMotorGridFSBucket(db, bucket_name="materials")
+MATERIAL_MAX_BYTES = int(os.environ.get("MATERIAL_MAX_BYTES", str(1024 * 1024 * 1024)))
+MATERIAL_UPLOAD_CHUNK_SIZE = 1024 * 1024
+MATERIAL_MIGRATION_BATCH_SIZE = 20
+
+def material_content_url(material_id: str) -> str:
+    return f"/api/materials/{material_id}/content"
 
 @api_router.post("/materials")
 async def upload_material(
@@ -1014,22 +1572,46 @@ async def upload_material(
     file: UploadFile = File(...),
     user: User = Depends(get_current_user)
 ):
-    """Upload a course material"""
-    content = await file.read()
-    base64_content = base64.b64encode(content).decode('utf-8')
-    
+    """Upload a course material, streaming the file to the blob store in chunks"""
     material = CourseMaterial(
         user_id=user.user_id,
         certificate_id=certificate_id,
         event_id=event_id,
         title=title or file.filename,
         material_type=material_type,
-        file_url=f"data:{file.content_type};base64,{base64_content}",
         file_name=file.filename,
-        file_size=len(content),
+        content_type=file.content_type or "application/octet-stream",
         notes=notes
     )
     
+    grid_in = material_bucket.open_upload_stream_with_id(
+        material.material_id,
+        file.filename or material.material_id,
+        metadata={"user_id": user.user_id, "content_type": material.content_type}
+    )
+    sha256 = hashlib.sha256()
+    size = 0
+    try:
+        while True:
+            chunk = await file.read(MATERIAL_UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > MATERIAL_MAX_BYTES:
+                raise HTTPException(
+                    status_code=413,
+                    detail=f"File is larger than the {MATERIAL_MAX_BYTES // (1024 * 1024)} MB limit"
+                )
+            sha256.update(chunk)
+            await grid_in.write(chunk)
+    except BaseException:
+        await grid_in.abort()
+        raise
+    await grid_in.close()
+    
+    material.file_url = material_content_url(material.material_id)
+    material.file_size = size
+    material.sha256 = sha256.hexdigest()
     mat_dict = material.model_dump()
     mat_dict["created_at"] = mat_dict["created_at"].isoformat()
     
@@ -1038,6 +1620,77 @@ async def upload_material(
     
     return mat_dict
 
+@api_router.get("/materials/{material_id}/content")
+async def get_material_content(material_id: str, request: Request, user: User = Depends(get_current_user)):
+    """Download a course material's file, with Range and ETag support"""
+    material = await db.course_materials.find_one(
+        {"material_id": material_id, "user_id": user.user_id},
+        {"_id": 0, "file_url": 1, "file_name": 1, "content_type": 1, "sha256": 1}
+    )
+    if not material:
+        raise HTTPException(status_code=404, detail="Material not found")
+    
+    file_url = material.get("file_url") or ""
+    if file_url.startswith("data:"):
+        # Inline upload the blob store migration has not reached yet
+        content, media_type = decode_data_url(file_url)
+        return Response(content=content, media_type=media_type)
+    if not material.get("sha256"):
+        raise HTTPException(status_code=404, detail="Material has no stored file")
+    
+    filename = (material.get("file_name") or material_id).replace('"', "")
+    try:
+        return await blob_response(
+            request,
+            material_bucket,
+            material_id,
+            material.get("content_type") or "application/octet-stream",
+            headers={
+                "Content-Disposition": f'inline; filename="{filename}"',
+                "Cache-Control": "private, max-age=0, must-revalidate"
+            },
+            etag=f'"{material["sha256"]}"'
+        )
+    except NoFile:
+        raise HTTPException(status_code=404, detail="Material file not found")
+
+async def migrate_inline_materials():
+    """Move base64 material files stored inline in course_materials into the blob store"""
+    async def migrate_batch(materials):
+        for material in materials:
+            file_url = material.get("file_url") or ""
+            if not file_url.startswith("data:"):
+                continue
+            content, content_type = decode_data_url(file_url)
+            material_id = material["material_id"]
+            try:
+                await material_bucket.delete(material_id)  # Left over from an interrupted run
+            except NoFile:
+                pass
+            await material_bucket.upload_from_stream_with_id(
+                material_id,
+                material.get("file_name") or material_id,
+                content,
+                metadata={"user_id": material.get("user_id"), "content_type": content_type}
+            )
+            await db.course_materials.update_one(
+                {"_id": material["_id"]},
+                {"$set": {
+                    "file_url": material_content_url(material_id),
+                    "file_size": len(content),
+                    "content_type": content_type,
+                    "sha256": hashlib.sha256(content).hexdigest()
+                }}
+            )
+    
+    await run_batched_migration(
+        "course_materials_blob_store",
+        db.course_materials,
+        migrate_batch,
+        projection={"material_id": 1, "user_id": 1, "file_url": 1, "file_name": 1},
+        batch_size=MATERIAL_MIGRATION_BATCH_SIZE
+    )
+
 @api_router.delete("/materials/{material_id}")
 async def delete_material(material_id: str, user: User = Depends(get_current_user)):
     """Delete a course material"""
@@ -1048,6 +1701,11 @@ async def delete_material(material_id: str, user: User = Depends(get_current_use
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Material not found")
     
+    try:
+        await material_bucket.delete(material_id)
+    except NoFile:
+        pass  # External URL, or an inline upload from before the blob store
+    
     return {"message": "Material deleted"}
 
 # ============ CERTIFICATE ROUTES ============
@@ -1056,29 +1714,31 @@ async def delete_material(material_id: str, user: User = Depends(get_current_use
 async def get_certificates(
     user: User = Depends(get_current_user),
     credit_type: Optional[str] = None,
-    year: Optional[int] = None
+    year: Optional[int] = None,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    view: Optional[str] = None,
+    fields: Optional[str] = None
 ):
     """Get user's certificates"""
     query = {"user_id": user.user_id}
     
     if credit_type:
-        # Search in both credit_types array and legacy credit_type field
-        query["$or"] = [
-            {"credit_types": credit_type},
-            {"credit_type": credit_type}
-        ]
+        query.update(credit_types_predicate([credit_type]))
     
     if year:
         query["completion_date"] = {"$regex": f"^{year}"}
     
-    certificates = await db.certificates.find(query, {"_id": 0}).sort("completion_date", -1).to_list(1000)
+    projection = build_projection("certificates", view, fields)
+    result = await paginate(db.certificates, query, "completion_date", "certificate_id", -1, limit, cursor, projection)
+    certificates = result["items"] if isinstance(result, dict) else result
     
-    # Normalize credit_types for backwards compatibility
+    # Documents the credit_types migration has not reached yet
     for cert in certificates:
         if not cert.get("credit_types") and cert.get("credit_type"):
             cert["credit_types"] = [cert["credit_type"]]
     
-    return certificates
+    return result
 
 @api_router.post("/certificates")
 async def create_certificate(cert_data: CertificateCreate, user: User = Depends(get_current_user)):
@@ -1086,10 +1746,7 @@ async def create_certificate(cert_data: CertificateCreate, user: User = Depends(
     data = cert_data.model_dump()
     
     # Handle credit_types - ensure it's populated
-    if not data.get("credit_types") and data.get("credit_type"):
-        data["credit_types"] = [data["credit_type"]]
-    elif data.get("credit_types") and not data.get("credit_type"):
-        data["credit_type"] = data["credit_types"][0] if data["credit_types"] else None
+    normalize_credit_fields(data)
     
     cert = Certificate(user_id=user.user_id, **data)
     
@@ -1099,18 +1756,51 @@ async def create_certificate(cert_data: CertificateCreate, user: User = Depends(
     
     await db.certificates.insert_one(cert_dict)
     cert_dict.pop("_id", None)  # Remove MongoDB's _id to avoid serialization error
+    await upsert_ledger_entry("certificate", cert_dict)
     
     # Update requirement progress
     await update_requirement_progress(user.user_id)
     
     return cert_dict
 
+class CertificateMerge(BaseModel):
+    keep_id: str
+    merge_ids: List[str] = Field(min_length=1)
+
+# Declared before /certificates/{certificate_id} so "duplicates" is not taken for an id
+@api_router.get("/certificates/duplicates")
+async def get_certificate_duplicates(
+    user: User = Depends(get_current_user),
+    days: Optional[int] = None,
+    min_score: Optional[float] = None
+):
+    """Find certificates that look like the same activity entered more than once"""
+    days = DEDUPE_DATE_WINDOW_DAYS if days is None else days
+    min_score = DEDUPE_MIN_SCORE if min_score is None else min_score
+    if days < 0 or not 0 < min_score <= 1:
+        raise HTTPException(status_code=400, detail="days must be >= 0 and min_score in (0, 1]")
+    groups = await find_metadata_duplicates(user.user_id, days, min_score)
+    return {"groups": groups, "group_count": len(groups)}
+
+@api_router.post("/certificates/merge")
+async def merge_duplicate_certificates(body: CertificateMerge, user: User = Depends(get_current_user)):
+    """Merge duplicate certificates into the one being kept"""
+    merge_ids = list(dict.fromkeys(body.merge_ids))
+    if body.keep_id in merge_ids:
+        raise HTTPException(status_code=400, detail="keep_id cannot also be merged")
+    return await merge_certificates(user.user_id, body.keep_id, merge_ids)
+
 @api_router.get("/certificates/{certificate_id}")
-async def get_certificate(certificate_id: str, user: User = Depends(get_current_user)):
+async def get_certificate(
+    certificate_id: str,
+    user: User = Depends(get_current_user),
+    view: Optional[str] = None,
+    fields: Optional[str] = None
+):
     """Get a specific certificate"""
     cert = await db.certificates.find_one(
         {"certificate_id": certificate_id, "user_id": user.user_id},
-        {"_id": 0}
+        build_projection("certificates", view, fields, default_view="detail")
     )
     if not cert:
         raise HTTPException(status_code=404, detail="Certificate not found")
@@ -1120,6 +1810,8 @@ async def get_certificate(certificate_id: str, user: User = Depends(get_current_
 async def update_certificate(certificate_id: str, request: Request, user: User = Depends(get_current_user)):
     """Update a certificate"""
     body = await request.json()
+    if "credit_types" in body or "credit_type" in body:
+        normalize_credit_fields(body)
     
     result = await db.certificates.update_one(
         {"certificate_id": certificate_id, "user_id": user.user_id},
@@ -1129,22 +1821,29 @@ async def update_certificate(certificate_id: str, request: Request, user: User =
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Certificate not found")
     
+    cert = await db.certificates.find_one({"certificate_id": certificate_id}, {"_id": 0})
+    await upsert_ledger_entry("certificate", cert)
+    
     # Update requirement progress
     await update_requirement_progress(user.user_id)
-    
-    cert = await db.certificates.find_one({"certificate_id": certificate_id}, {"_id": 0})
     return cert
 
 @api_router.delete("/certificates/{certificate_id}")
 async def delete_certificate(certificate_id: str, user: User = Depends(get_current_user)):
     """Delete a certificate"""
-    result = await db.certificates.delete_one(
-        {"certificate_id": certificate_id, "user_id": user.user_id}
+    deleted = await db.certificates.find_one_and_delete(
+        {"certificate_id": certificate_id, "user_id": user.user_id},
+        projection={"_id": 0, "certificate_id": 1, "renditions": 1}
     )
     
-    if result.deleted_count == 0:
+    if deleted is None:
         raise HTTPException(status_code=404, detail="Certificate not found")
     
+    await record_tombstones(user.user_id, "certificates", [certificate_id])
+    await remove_ledger_entry("certificate", certificate_id)
+    await db.certificate_image_hashes.delete_one({"certificate_id": certificate_id})
+    await release_renditions((deleted.get("renditions") or {}).values())
+    
     # Update requirement progress
     await update_requirement_progress(user.user_id)
     
@@ -1153,241 +1852,197 @@ async def delete_certificate(certificate_id: str, user: User = Depends(get_curre
 @api_router.post("/certificates/upload")
 async def upload_certificate(
     file: UploadFile = File(...),
-    user: User = Depends(get_current_user)
+    allow_duplicate: bool = False,
+    user: User = Depends(rate_limited_user("upload"))
 ):
     """Upload certificate image/PDF for OCR processing"""
     # Read file content
     content = await file.read()
     base64_content = base64.b64encode(content).decode('utf-8')
     
-    # Create certificate with pending OCR
-    cert = Certificate(
-        user_id=user.user_id,
-        title="Processing...",
-        provider="Processing...",
-        credits=0,
-        credit_type="unknown",
-        completion_date=datetime.now(timezone.utc).strftime("%Y-%m-%d"),
-        ocr_status="processing",
-        image_url=f"data:{file.content_type};base64,{base64_content}"
-    )
-    
-    cert_dict = cert.model_dump()
-    cert_dict["created_at"] = cert_dict["created_at"].isoformat()
-    cert_dict["updated_at"] = cert_dict["updated_at"].isoformat()
-    
-    await db.certificates.insert_one(cert_dict)
-    cert_dict.pop("_id", None)  # Remove MongoDB's _id to avoid serialization error
+    # Hash the image while looking for an EEDS QR code, both in worker threads
+    hashing = asyncio.ensure_future(asyncio.to_thread(certificate_image_hashes, content, file.content_type))
+    eeds_payload = await scan_certificate_codes(content, file.content_type)
     
-    # Process OCR in background (we'll return immediately and process async)
-    # For now, we'll do it synchronously for simplicity
+    # Catch a second scan of a certificate already on file before paying for OCR
     try:
-        ocr_result = await process_certificate_ocr(cert.certificate_id, base64_content, file.content_type)
-        return ocr_result
+        image_hashes = await hashing
     except Exception as e:
-        logger.error(f"OCR processing failed: {e}")
-        await db.certificates.update_one(
-            {"certificate_id": cert.certificate_id},
-            {"$set": {"ocr_status": "failed"}}
+        logger.warning(f"Hashing uploaded certificate image failed: {e}")
+        image_hashes = None
+    if image_hashes and not allow_duplicate:
+        duplicates = await find_similar_certificates(user.user_id, image_hashes)
+        if duplicates:
+            raise HTTPException(status_code=409, detail={
+                "message": "This looks like a certificate you have already uploaded",
+                "duplicates": duplicates
+            })
+    certificate_number = eeds_payload and eeds_payload["fields"].get("certificate_number")
+    if certificate_number and not allow_duplicate:
+        duplicates = await db.certificates.find(
+            {"user_id": user.user_id, "certificate_number": certificate_number},
+            build_projection("certificates")
+        ).to_list(None)
+        if duplicates:
+            raise HTTPException(status_code=409, detail={
+                "message": "A certificate with this EEDS certificate number is already on file",
+                "duplicates": duplicates
+            })
+    
+    # Wait for an OCR slot before creating the certificate, so a rejected
+    # upload leaves nothing behind. EEDS QR uploads skip OCR and need no slot.
+    async with (nullcontext() if eeds_payload else ocr_limiter.slot()):
+        # Create certificate with pending OCR
+        cert = Certificate(
+            user_id=user.user_id,
+            title="Processing...",
+            provider="Processing...",
+            credits=0,
+            credit_types=["unknown"],
+            credit_type="unknown",
+            completion_date=datetime.now(timezone.utc).strftime("%Y-%m-%d"),
+            ocr_status="processing",
+            image_url=f"data:{file.content_type};base64,{base64_content}"
         )
-        return cert_dict
+        
+        cert_dict = cert.model_dump()
+        cert_dict.update(certificate_rendition_urls(cert.certificate_id))
+        cert_dict["created_at"] = cert_dict["created_at"].isoformat()
+        cert_dict["updated_at"] = cert_dict["updated_at"].isoformat()
+        
+        await db.certificates.insert_one(cert_dict)
+        cert_dict.pop("_id", None)  # Remove MongoDB's _id to avoid serialization error
+        await upsert_ledger_entry("certificate", cert_dict)
+        if image_hashes:
+            await store_image_hashes(user.user_id, cert.certificate_id, image_hashes)
+        run_in_background(create_certificate_renditions(cert.certificate_id, content, file.content_type))
+        await publish_ocr_status(cert_dict)
+        
+        if eeds_payload:
+            try:
+                count_upload_path("eeds_qr")
+                eeds_result = await apply_eeds_payload(cert.certificate_id, eeds_payload, user.user_id)
+                await publish_ocr_status(eeds_result)
+                return eeds_result
+            finally:
+                await bump_data_version(user.user_id)
+        
+        # Process OCR in background (we'll return immediately and process async)
+        # For now, we'll do it synchronously for simplicity
+        try:
+            ocr_result = await process_certificate_ocr(
+                cert.certificate_id, base64_content, file.content_type, user.user_id
+            )
+            if ocr_result.get("ocr_status") == "failed":
+                count_upload_path("failed")
+            else:
+                count_upload_path("template" if (ocr_result.get("ocr_data") or {}).get("ocr_model") == "template" else "ocr_models")
+            await publish_ocr_status(ocr_result)
+            return ocr_result
+        except Exception as e:
+            logger.error(f"OCR processing failed: {e}")
+            count_upload_path("failed")
+            await db.certificates.update_one(
+                {"certificate_id": cert.certificate_id},
+                {"$set": {"ocr_status": "failed", "updated_at": datetime.now(timezone.utc).isoformat()}}
+            )
+            await publish_ocr_status({**cert_dict, "ocr_status": "failed"})
+            return cert_dict
+        finally:
+            await bump_data_version(user.user_id)
 
-async def process_certificate_ocr(certificate_id: str, base64_content: str, mime_type: str):
-    """Process certificate with GPT-4o vision - enhanced with better error handling and prompting"""
+async def process_certificate_ocr(
+    certificate_id: str,
+    base64_content: str,
+    mime_type: str,
+    user_id: Optional[str] = None
+):
+    """Process certificate through the OCR model cascade - enhanced with better error handling and prompting"""
     ocr_error_message = None
     try:
-        from emergentintegrations.llm.chat import LlmChat, UserMessage, ImageContent
+        # Known provider layouts are read straight from the PDF text layer
+        text_layer = None
+        if mime_type == "application/pdf":
+            text_layer = await pdf_text_layer(base64.b64decode(base64_content))
+        result = await template_ocr_result(text_layer)
         
-        api_key = os.environ.get("EMERGENT_LLM_KEY")
-        if not api_key:
-            ocr_error_message = "OCR service not configured. Please enter details manually."
-            raise Exception("EMERGENT_LLM_KEY not configured")
+        if result is None:
+            api_key = os.environ.get("EMERGENT_LLM_KEY")
+            if not api_key:
+                ocr_error_message = "OCR service not configured. Please enter details manually."
+                raise Exception("EMERGENT_LLM_KEY not configured")
         
-        # Handle PDF files by converting to image
-        image_base64 = base64_content
-        final_mime_type = mime_type
+            # Handle PDF files by converting to image
+            image_base64 = base64_content
+            final_mime_type = mime_type
         
-        if mime_type == "application/pdf":
-            try:
-                from pdf2image import convert_from_bytes
-                from PIL import Image
-                import io
+            if mime_type == "application/pdf":
+                try:
+                    from pdf2image import convert_from_bytes
+                    from PIL import Image
+                    import io
                 
-                logger.info(f"Converting PDF to image for {certificate_id}")
+                    logger.info(f"Converting PDF to image for {certificate_id}")
                 
-                # Decode the base64 PDF content
-                pdf_bytes = base64.b64decode(base64_content)
+                    # Decode the base64 PDF content
+                    pdf_bytes = base64.b64decode(base64_content)
                 
-                # Convert PDF to images (first page only for certificates)
-                images = convert_from_bytes(pdf_bytes, dpi=150, first_page=1, last_page=1)
+                    # Convert PDF to images (first page only for certificates)
+                    images = convert_from_bytes(pdf_bytes, dpi=150, first_page=1, last_page=1)
                 
-                if images:
-                    # Convert the first page to PNG
-                    img_buffer = io.BytesIO()
-                    images[0].save(img_buffer, format='PNG', optimize=True)
-                    img_buffer.seek(0)
+                    if images:
+                        # Convert the first page to PNG
+                        img_buffer = io.BytesIO()
+                        images[0].save(img_buffer, format='PNG', optimize=True)
+                        img_buffer.seek(0)
                     
-                    # Re-encode as base64
-                    image_base64 = base64.b64encode(img_buffer.getvalue()).decode('utf-8')
-                    final_mime_type = "image/png"
-                    logger.info(f"PDF converted to PNG successfully for {certificate_id}")
-                else:
-                    ocr_error_message = "Failed to convert PDF to image. Please upload as PNG or JPEG."
-                    raise Exception("PDF conversion produced no images")
+                        # Re-encode as base64
+                        image_base64 = base64.b64encode(img_buffer.getvalue()).decode('utf-8')
+                        final_mime_type = "image/png"
+                        logger.info(f"PDF converted to PNG successfully for {certificate_id}")
+                    else:
+                        ocr_error_message = "Failed to convert PDF to image. Please upload as PNG or JPEG."
+                        raise Exception("PDF conversion produced no images")
                     
-            except ImportError as e:
-                logger.error(f"pdf2image not installed: {e}")
-                ocr_error_message = "PDF processing not available. Please upload as PNG or JPEG."
-                raise Exception("PDF processing library not available")
-            except Exception as e:
-                logger.error(f"PDF conversion error for {certificate_id}: {e}")
-                ocr_error_message = f"Failed to process PDF: {str(e)}. Please upload as PNG or JPEG."
-                raise
-        
-        # Validate image format for GPT-4o
-        supported_formats = ["image/png", "image/jpeg", "image/gif", "image/webp"]
-        if final_mime_type not in supported_formats:
-            ocr_error_message = f"Unsupported image format: {final_mime_type}. Please upload PNG, JPEG, GIF, or WebP."
-            raise Exception(f"Unsupported format: {final_mime_type}")
-        
-        # Enhanced system prompt for better extraction
-        system_prompt = """You are an expert at extracting information from medical CME (Continuing Medical Education) certificates. 
-
-Analyze the certificate image carefully and extract ALL available information. CME certificates typically contain:
-- Activity/course title or name
-- Provider/sponsor organization (ACCME-accredited organizations, medical associations, hospitals)
-- Number of credits earned (look for numbers followed by "credits", "hours", "CME", "AMA PRA Category 1", etc.)
-- Credit type (AMA PRA Category 1, Category 2, AANP, AAPA, ANCC, MOC, etc.)
-- Completion date or date awarded
-- Certificate/reference number
-- Medical subject or specialty
-
-IMPORTANT INSTRUCTIONS:
-1. Return ONLY a valid JSON object - no explanation, no markdown
-2. Use null for any field you cannot determine with confidence
-3. For dates, use YYYY-MM-DD format (e.g., "2024-03-15")
-4. For credits, extract the numeric value only (e.g., 1.5, not "1.5 credits")
-5. For credit_type, use the exact wording from the certificate
-
-JSON format:
-{"title": "string or null", "provider": "string or null", "credits": number or null, "credit_type": "string or null", "completion_date": "YYYY-MM-DD or null", "certificate_number": "string or null", "subject": "string or null"}"""
-
-        chat = LlmChat(
-            api_key=api_key,
-            session_id=f"ocr_{certificate_id}",
-            system_message=system_prompt
-        ).with_model("openai", "gpt-4o")
-        
-        # Use the converted image (either original or PDF->PNG)
-        image_content = ImageContent(image_base64=image_base64)
-        
-        response = await chat.send_message(UserMessage(
-            text="Extract all CME certificate information from this image. Return only the JSON object.",
-            file_contents=[image_content]
-        ))
+                except ImportError as e:
+                    logger.error(f"pdf2image not installed: {e}")
+                    ocr_error_message = "PDF processing not available. Please upload as PNG or JPEG."
+                    raise Exception("PDF processing library not available")
+                except Exception as e:
+                    logger.error(f"PDF conversion error for {certificate_id}: {e}")
+                    ocr_error_message = f"Failed to process PDF: {str(e)}. Please upload as PNG or JPEG."
+                    raise
         
-        logger.info(f"OCR Response for {certificate_id}: {response[:500]}...")
+            # Validate image format for the vision models
+            supported_formats = ["image/png", "image/jpeg", "image/gif", "image/webp"]
+            if final_mime_type not in supported_formats:
+                ocr_error_message = f"Unsupported image format: {final_mime_type}. Please upload PNG, JPEG, GIF, or WebP."
+                raise Exception(f"Unsupported format: {final_mime_type}")
         
-        # Parse response with improved handling
-        ocr_data = {}
-        parse_error = None
-        try:
-            # Clean up response - handle various formats
-            response_text = response.strip()
-            
-            # Remove markdown code blocks
-            if response_text.startswith("```json"):
-                response_text = response_text[7:]
-            elif response_text.startswith("```"):
-                response_text = response_text[3:]
-            if response_text.endswith("```"):
-                response_text = response_text[:-3]
-            response_text = response_text.strip()
-            
-            # Try to find JSON in the response if not pure JSON
-            if not response_text.startswith("{"):
-                import re
-                json_match = re.search(r'\{[^{}]*\}', response_text, re.DOTALL)
-                if json_match:
-                    response_text = json_match.group()
-            
-            ocr_data = json.loads(response_text)
-            
-            # Validate we got at least some data
-            if not any(ocr_data.get(k) for k in ["title", "provider", "credits"]):
-                parse_error = "Could not extract key information"
-                
-        except json.JSONDecodeError as e:
-            parse_error = f"Failed to parse OCR response: {str(e)}"
-            logger.warning(f"JSON parse error for {certificate_id}: {e}. Response: {response_text[:200]}")
-            ocr_data = {"raw_text": response, "parse_error": str(e)}
+            # Cheapest model first, escalating while the result would be partial or failed
+            result = await run_ocr_cascade(certificate_id, image_base64, api_key)
+            if text_layer and result["status"] == "completed":
+                await learn_ocr_template(text_layer, result["ocr_data"])
         
-        # Enhanced credit type mapping with more variations
-        credit_type_map = {
-            # AMA
-            "ama pra category 1": "ama_cat1",
-            "ama category 1": "ama_cat1",
-            "category 1 credit": "ama_cat1",
-            "category 1": "ama_cat1",
-            "ama pra category 2": "ama_cat2",
-            "category 2": "ama_cat2",
-            # AOA
-            "aoa category 1-a": "aoa_1a",
-            "aoa 1a": "aoa_1a",
-            "aoa category 1-b": "aoa_1b",
-            "aoa 1b": "aoa_1b",
-            # NP/PA
-            "aanp contact": "aanp_contact",
-            "aanp": "aanp_contact",
-            "aapa category 1": "aapa_cat1",
-            "aapa": "aapa_cat1",
-            "ancc contact": "ancc_contact",
-            "ancc": "ancc_contact",
-            "contact hours": "ancc_contact",
-            # Other
-            "pharmacology": "pharmacology",
-            "pharmacotherapeutics": "pharmacology",
-            "moc": "moc",
-            "maintenance of certification": "moc",
-            "self-assessment": "self_assessment",
-            "self assessment": "self_assessment",
-            "ethics": "ethics",
-            "medical ethics": "ethics",
-            "pain management": "pain_mgmt",
-            "opioid": "pain_mgmt",
-            "cne": "cne",
-            "continuing nursing": "cne",
-        }
+        ocr_data = result["ocr_data"]
+        ocr_data["ocr_model"] = result["model"]
+        ocr_data["ocr_attempts"] = result["attempts"]
         
         extracted_credit_type = ocr_data.get("credit_type", "")
         if extracted_credit_type:
-            normalized_type = extracted_credit_type.lower().strip()
-            matched = False
-            for key, value in credit_type_map.items():
-                if key in normalized_type:
-                    ocr_data["credit_type_id"] = value
-                    matched = True
-                    break
-            if not matched:
-                # Keep the original text for display but don't map
-                ocr_data["credit_type_id"] = "ama_cat1"  # Default
+            matcher = await user_credit_type_matcher(user_id)
+            matches = matcher.match(extracted_credit_type)
+            ocr_data["credit_type_matches"] = matches
+            credit_type_ids = matched_credit_type_ids(matches)
+            if credit_type_ids:
+                ocr_data["credit_type_id"] = credit_type_ids[0]
+                ocr_data["credit_type_ids"] = credit_type_ids
+            else:
+                # Keep the original text for review rather than guessing a type
                 ocr_data["credit_type_original"] = extracted_credit_type
         
-        # Determine OCR status based on extraction quality
-        fields_extracted = sum(1 for k in ["title", "provider", "credits", "completion_date"] 
-                              if ocr_data.get(k) not in [None, "", 0])
-        
-        if parse_error:
-            ocr_status = "failed"
-            ocr_error_message = parse_error
-        elif fields_extracted >= 3:
-            ocr_status = "completed"
-        elif fields_extracted >= 1:
-            ocr_status = "partial"  # Some data extracted but needs manual review
-            ocr_error_message = "Some fields could not be extracted. Please review and edit."
-        else:
-            ocr_status = "failed"
-            ocr_error_message = "Could not extract certificate data. Please enter details manually."
+        ocr_status = result["status"]
+        ocr_error_message = result["error"]
         
         # Update certificate with OCR data
         update_data = {
@@ -1401,36 +2056,15 @@ JSON format:
             update_data["title"] = str(ocr_data["title"])[:255]  # Limit length
         if ocr_data.get("provider"):
             update_data["provider"] = str(ocr_data["provider"])[:255]
-        if ocr_data.get("credits"):
-            try:
-                credits_val = ocr_data["credits"]
-                if isinstance(credits_val, str):
-                    # Extract number from string like "1.5 credits"
-                    import re
-                    num_match = re.search(r'[\d.]+', credits_val)
-                    if num_match:
-                        credits_val = num_match.group()
-                update_data["credits"] = float(credits_val)
-            except (ValueError, TypeError):
-                pass
-        if ocr_data.get("credit_type_id"):
-            update_data["credit_type"] = ocr_data["credit_type_id"]
-            update_data["credit_types"] = [ocr_data["credit_type_id"]]
-        if ocr_data.get("completion_date"):
-            # Validate date format
-            date_str = str(ocr_data["completion_date"])
-            try:
-                datetime.strptime(date_str, "%Y-%m-%d")
-                update_data["completion_date"] = date_str
-            except ValueError:
-                # Try to parse other formats
-                for fmt in ["%m/%d/%Y", "%d/%m/%Y", "%B %d, %Y", "%b %d, %Y"]:
-                    try:
-                        parsed = datetime.strptime(date_str, fmt)
-                        update_data["completion_date"] = parsed.strftime("%Y-%m-%d")
-                        break
-                    except ValueError:
-                        continue
+        credits_val = ocr_credits_value(ocr_data.get("credits"))
+        if credits_val is not None:
+            update_data["credits"] = credits_val
+        if ocr_data.get("credit_type_ids"):
+            update_data["credit_type"] = ocr_data["credit_type_ids"][0]
+            update_data["credit_types"] = ocr_data["credit_type_ids"]
+        completion_date = ocr_date_value(ocr_data.get("completion_date"))
+        if completion_date:
+            update_data["completion_date"] = completion_date
         if ocr_data.get("certificate_number"):
             update_data["certificate_number"] = str(ocr_data["certificate_number"])[:100]
         if ocr_data.get("subject"):
@@ -1442,6 +2076,7 @@ JSON format:
         )
         
         cert = await db.certificates.find_one({"certificate_id": certificate_id}, {"_id": 0})
+        await upsert_ledger_entry("certificate", cert)
         return cert
         
     except Exception as e:
@@ -1467,43 +2102,849 @@ JSON format:
         cert = await db.certificates.find_one({"certificate_id": certificate_id}, {"_id": 0})
         return cert
 
-@api_router.post("/certificates/eeds-import")
-async def import_eeds_certificate(request: Request, user: User = Depends(get_current_user)):
-    """Import certificate from EEDS QR code data"""
-    body = await request.json()
-    qr_data = body.get("qr_data", "")
-    
-    # Parse EEDS QR code data (format varies, this is a basic implementation)
-    # EEDS typically encodes certificate info in the QR code
-    credit_types = body.get("credit_types", [])
-    if not credit_types and body.get("credit_type"):
-        credit_types = [body.get("credit_type")]
-    
-    cert_data = {
-        "title": body.get("title", "EEDS Certificate"),
-        "provider": body.get("provider", "EEDS"),
-        "credits": float(body.get("credits", 1)),
-        "credit_types": credit_types,
-        "credit_type": credit_types[0] if credit_types else "ama_cat1",
-        "completion_date": body.get("completion_date", datetime.now(timezone.utc).strftime("%Y-%m-%d")),
-        "certificate_number": body.get("certificate_number"),
-        "subject": body.get("subject"),
-        "eeds_imported": True
-    }
-    
-    cert = Certificate(user_id=user.user_id, **cert_data)
-    cert_dict = cert.model_dump()
-    cert_dict["created_at"] = cert_dict["created_at"].isoformat()
-    cert_dict["updated_at"] = cert_dict["updated_at"].isoformat()
+# ============ OCR MODEL CASCADE ============
+
+OCR_SYSTEM_PROMPT = """You are an expert at extracting information from medical CME (Continuing Medical Education) certificates. 
+
+Analyze the certificate image carefully and extract ALL available information. CME certificates typically contain:
+- Activity/course title or name
+- Provider/sponsor organization (ACCME-accredited organizations, medical associations, hospitals)
+- Number of credits earned (look for numbers followed by "credits", "hours", "CME", "AMA PRA Category 1", etc.)
+- Credit type (AMA PRA Category 1, Category 2, AANP, AAPA, ANCC, MOC, etc.)
+- Completion date or date awarded
+- Certificate/reference number
+- Medical subject or specialty
+
+IMPORTANT INSTRUCTIONS:
+1. Return ONLY a valid JSON object - no explanation, no markdown
+2. Use null for any field you cannot determine with confidence
+3. For dates, use YYYY-MM-DD format (e.g., "2024-03-15")
+4. For credits, extract the numeric value only (e.g., 1.5, not "1.5 credits")
+5. For credit_type, use the exact wording from the certificate
+
+JSON format:
+{"title": "string or null", "provider": "string or null", "credits": number or null, "credit_type": "string or null", "completion_date": "YYYY-MM-DD or null", "certificate_number": "string or null", "subject": "string or null"}"""
+
+def parse_ocr_cascade(spec: str) -> List[Dict[str, Any]]:
+    """Tiers from "provider/model:cost,provider/model:cost", cheapest first.
+
+    The cost is the estimated USD per certificate, used only for reporting.
+    """
+    tiers = []
+    for entry in spec.split(","):
+        entry = entry.strip()
+        if not entry:
+            continue
+        name, _, cost = entry.partition(":")
+        provider, _, model = name.partition("/")
+        if not provider or not model:
+            raise ValueError(f"OCR cascade tier must look like provider/model[:cost], got {entry!r}")
+        tiers.append({"name": name, "provider": provider, "model": model, "cost": float(cost or 0)})
+    if not tiers:
+        raise ValueError("OCR cascade needs at least one tier")
+    return tiers
+
+OCR_CASCADE = parse_ocr_cascade(os.environ.get("OCR_CASCADE", "openai/gpt-4.1-mini:0.0008,openai/gpt-4o:0.0045"))
+# Results with these statuses go on to the next tier; the last tier's answer is final
+OCR_ESCALATE_ON = {
+    status.strip() for status in os.environ.get("OCR_ESCALATE_ON", "partial,failed").split(",") if status.strip()
+}
+OCR_STATUS_RANK = {"failed": 0, "partial": 1, "completed": 2}
+OCR_MAX_CREDITS = 200
+OCR_DATE_FORMATS = ["%Y-%m-%d", "%m/%d/%Y", "%d/%m/%Y", "%B %d, %Y", "%b %d, %Y"]
+
+# Attempts, escalations, latency and estimated cost per tier, exposed on /api/metrics
+ocr_tier_metrics: Dict[str, Dict[str, float]] = {}
+
+def ocr_credits_value(value: Any) -> Optional[float]:
+    """Credits as a float, taking the number out of text like "1.5 credits" """
+    if value in (None, "", 0):
+        return None
+    try:
+        if isinstance(value, str):
+            num_match = re.search(r'[\d.]+', value)
+            if num_match:
+                value = num_match.group()
+        return float(value)
+    except (ValueError, TypeError):
+        return None
+
+def ocr_date_value(value: Any) -> Optional[str]:
+    """A completion date normalized to YYYY-MM-DD, or None if no known format matches"""
+    if not value:
+        return None
+    for fmt in OCR_DATE_FORMATS:
+        try:
+            return datetime.strptime(str(value).strip(), fmt).strftime("%Y-%m-%d")
+        except ValueError:
+            continue
+    return None
+
+def ocr_valid_fields(ocr_data: Dict[str, Any]) -> List[str]:
+    """Key fields that are present and well formed"""
+    valid = []
+    for key in ["title", "provider"]:
+        value = ocr_data.get(key)
+        if isinstance(value, str) and len(value.strip()) >= 3 and re.search(r"[A-Za-z]", value):
+            valid.append(key)
+    credits = ocr_credits_value(ocr_data.get("credits"))
+    if credits is not None and 0 < credits <= OCR_MAX_CREDITS:
+        valid.append("credits")
+    completion_date = ocr_date_value(ocr_data.get("completion_date"))
+    if completion_date and "1950-01-01" <= completion_date <= (datetime.now(timezone.utc) + timedelta(days=366)).strftime("%Y-%m-%d"):
+        valid.append("completion_date")
+    return valid
+
+def score_ocr_result(ocr_data: Dict[str, Any], parse_error: Optional[str]) -> Dict[str, Any]:
+    """The OCR status a result would get, counting only well-formed key fields"""
+    fields_extracted = len(ocr_valid_fields(ocr_data))
+    if parse_error:
+        return {"status": "failed", "error": parse_error, "fields": fields_extracted}
+    if fields_extracted >= 3:
+        return {"status": "completed", "error": None, "fields": fields_extracted}
+    if fields_extracted >= 1:
+        # Some data extracted but needs manual review
+        return {"status": "partial", "error": "Some fields could not be extracted. Please review and edit.", "fields": fields_extracted}
+    return {"status": "failed", "error": "Could not extract certificate data. Please enter details manually.", "fields": fields_extracted}
+
+def parse_ocr_response(certificate_id: str, response: str) -> tuple:
+    """The extracted fields and a parse error, if any, from a model's reply"""
+    ocr_data = {}
+    parse_error = None
+    response_text = response.strip()
+    try:
+        # Remove markdown code blocks
+        if response_text.startswith("```json"):
+            response_text = response_text[7:]
+        elif response_text.startswith("```"):
+            response_text = response_text[3:]
+        if response_text.endswith("```"):
+            response_text = response_text[:-3]
+        response_text = response_text.strip()
+        
+        # Try to find JSON in the response if not pure JSON
+        if not response_text.startswith("{"):
+            json_match = re.search(r'\{[^{}]*\}', response_text, re.DOTALL)
+            if json_match:
+                response_text = json_match.group()
+        
+        ocr_data = json.loads(response_text)
+        
+        # Validate we got at least some data
+        if not any(ocr_data.get(k) for k in ["title", "provider", "credits"]):
+            parse_error = "Could not extract key information"
+    except json.JSONDecodeError as e:
+        parse_error = f"Failed to parse OCR response: {str(e)}"
+        logger.warning(f"JSON parse error for {certificate_id}: {e}. Response: {response_text[:200]}")
+        ocr_data = {"raw_text": response, "parse_error": str(e)}
+    return ocr_data, parse_error
+
+async def run_ocr_tier(tier: Dict[str, Any], certificate_id: str, image_base64: str, api_key: str) -> tuple:
+    """Ask one vision model for the certificate fields"""
+    from emergentintegrations.llm.chat import LlmChat, UserMessage, ImageContent
+    
+    chat = LlmChat(
+        api_key=api_key,
+        session_id=f"ocr_{certificate_id}_{tier['model']}",
+        system_message=OCR_SYSTEM_PROMPT
+    ).with_model(tier["provider"], tier["model"])
+    response = await chat.send_message(UserMessage(
+        text="Extract all CME certificate information from this image. Return only the JSON object.",
+        file_contents=[ImageContent(image_base64=image_base64)]
+    ))
+    logger.info(f"OCR Response from {tier['name']} for {certificate_id}: {response[:500]}...")
+    return parse_ocr_response(certificate_id, response)
+
+def record_ocr_attempt(tier: Dict[str, Any], seconds: float, escalated: bool, errored: bool = False):
+    """Count one tier attempt; errors before the last tier also count as escalations"""
+    metrics = ocr_tier_metrics.setdefault(tier["name"], {
+        "attempts": 0, "accepted": 0, "escalated": 0, "errors": 0, "latency_seconds": 0.0, "cost": 0.0
+    })
+    metrics["attempts"] += 1
+    metrics["latency_seconds"] += seconds
+    if errored:
+        metrics["errors"] += 1
+    else:
+        metrics["cost"] += tier["cost"]
+    if escalated:
+        metrics["escalated"] += 1
+    elif not errored:
+        metrics["accepted"] += 1
+
+def ocr_cascade_report() -> List[Dict[str, Any]]:
+    """Per-tier attempts, mean latency, estimated cost and escalation rate since startup"""
+    report = []
+    for tier in OCR_CASCADE:
+        metrics = ocr_tier_metrics.get(tier["name"], {})
+        attempts = metrics.get("attempts", 0)
+        report.append({
+            "tier": tier["name"],
+            "attempts": attempts,
+            "accepted": metrics.get("accepted", 0),
+            "escalated": metrics.get("escalated", 0),
+            "errors": metrics.get("errors", 0),
+            "mean_latency_ms": round(metrics.get("latency_seconds", 0) / attempts * 1000, 1) if attempts else None,
+            "cost": round(metrics.get("cost", 0), 6),
+            "escalation_rate": round(metrics.get("escalated", 0) / attempts, 4) if attempts else None,
+        })
+    return report
+
+async def run_ocr_cascade(
+    certificate_id: str,
+    image_base64: str,
+    api_key: str,
+    tiers: Optional[List[Dict[str, Any]]] = None
+) -> Dict[str, Any]:
+    """Try each tier cheapest first, stopping at the first result the policy accepts.
+
+    The best-scoring result across the tiers tried is returned, so a stronger model that
+    does worse never replaces a usable answer. Raises the last error if every tier errored.
+    """
+    tiers = tiers or OCR_CASCADE
+    best = None
+    attempts = []
+    last_error = None
+    for index, tier in enumerate(tiers):
+        final_tier = index == len(tiers) - 1
+        started = time.perf_counter()
+        try:
+            ocr_data, parse_error = await run_ocr_tier(tier, certificate_id, image_base64, api_key)
+        except Exception as e:
+            seconds = time.perf_counter() - started
+            logger.warning(f"OCR tier {tier['name']} errored for {certificate_id}: {e}")
+            record_ocr_attempt(tier, seconds, escalated=not final_tier, errored=True)
+            attempts.append({"tier": tier["name"], "status": "error", "latency_ms": round(seconds * 1000), "error": str(e)[:200]})
+            last_error = e
+            continue
+        seconds = time.perf_counter() - started
+        score = score_ocr_result(ocr_data, parse_error)
+        escalate = not final_tier and score["status"] in OCR_ESCALATE_ON
+        record_ocr_attempt(tier, seconds, escalated=escalate)
+        attempts.append({
+            "tier": tier["name"],
+            "status": score["status"],
+            "fields": score["fields"],
+            "latency_ms": round(seconds * 1000),
+            "cost": tier["cost"],
+        })
+        if best is None or (OCR_STATUS_RANK[score["status"]], score["fields"]) > (OCR_STATUS_RANK[best["status"]], best["fields"]):
+            best = {**score, "ocr_data": ocr_data, "model": tier["name"]}
+        if not escalate:
+            break
+    if best is None:
+        raise last_error
+    best["attempts"] = attempts
+    return best
+
+# ============ PROVIDER TEMPLATES ============
+
+# Certificates from the same provider share a layout. A PDF whose text layer matches a learned
+# layout is extracted locally with the template's rules instead of going to the OCR models.
+TEMPLATE_FIELDS = ["title", "provider", "credits", "credit_type", "completion_date", "certificate_number", "subject"]
+# Fields that are taken as-is when the model read them from the page but they are not in the text layer
+TEMPLATE_CONSTANT_FIELDS = ["provider", "credit_type"]
+TEMPLATE_MIN_ANCHORS = 4
+TEMPLATE_MATCH_RATIO = 0.8  # Share of a template's anchors that must be on the page
+TEMPLATE_CANDIDATE_LIMIT = 200
+TEMPLATE_TEXT_TIMEOUT = 10
+TEMPLATE_COLUMN_GAP = re.compile(r"\s{2,}")
+TEMPLATE_NUMBER = re.compile(r"\d+(?:\.\d+)?")
+TEMPLATE_DATE = re.compile(r"\d{4}-\d{2}-\d{2}|\d{1,2}/\d{1,2}/\d{4}|[A-Za-z]{3,9}\.? \d{1,2}, \d{4}")
+TEMPLATE_VALUE_PATTERNS = {"credits": TEMPLATE_NUMBER.pattern, "completion_date": TEMPLATE_DATE.pattern}
+TEMPLATE_CONTEXT_WORDS = 2  # Words kept, hashed, on either side of a labelled value
+TEMPLATE_ANY_WORD = "*"
+
+# Template outcomes since startup, exposed on /api/metrics
+template_metrics: Dict[str, int] = {}
+
+def count_template_outcome(outcome: str):
+    template_metrics[outcome] = template_metrics.get(outcome, 0) + 1
+
+async def pdf_text_layer(pdf_bytes: bytes) -> Optional[str]:
+    """Text of a PDF's first page with its layout kept, or None for scanned or unreadable PDFs.
+
+    Uses poppler's pdftotext, which ships alongside the pdftoppm that pdf2image needs.
+    """
+    try:
+        proc = await asyncio.create_subprocess_exec(
+            "pdftotext", "-layout", "-q", "-f", "1", "-l", "1", "-", "-",
+            stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL
+        )
+    except FileNotFoundError:
+        return None
+    try:
+        stdout, _ = await asyncio.wait_for(proc.communicate(pdf_bytes), timeout=TEMPLATE_TEXT_TIMEOUT)
+    except asyncio.TimeoutError:
+        proc.kill()
+        return None
+    text = stdout.decode("utf-8", errors="replace")
+    return text if proc.returncode == 0 and len(text.strip()) >= 40 else None
+
+def template_units(text: str) -> List[str]:
+    """Page text split into lines and layout columns, whitespace collapsed"""
+    units = []
+    for line in text.splitlines():
+        for segment in TEMPLATE_COLUMN_GAP.split(line.strip()):
+            segment = " ".join(segment.split())
+            if segment:
+                units.append(segment)
+    return units
+
+def template_anchor_key(unit: str) -> str:
+    """Hash of a text unit with numbers masked, so templates keep no page text"""
+    return hashlib.sha1(TEMPLATE_NUMBER.sub("#", unit.lower()).encode()).hexdigest()[:16]
+
+def locate_template_value(field: str, value: Any, unit: str) -> Optional[tuple]:
+    """Span of an extracted value within one text unit"""
+    if field == "credits":
+        target = ocr_credits_value(value)
+        for m in TEMPLATE_NUMBER.finditer(unit):
+            if target is not None and float(m.group()) == target:
+                return m.span()
+        return None
+    if field == "completion_date":
+        target = ocr_date_value(value)
+        for m in TEMPLATE_DATE.finditer(unit):
+            if target and ocr_date_value(m.group()) == target:
+                return m.span()
+        return None
+    target = " ".join(str(value).split()).lower()
+    start = unit.lower().find(target) if target else -1
+    return (start, start + len(target)) if start >= 0 else None
+
+def template_word_key(word: str) -> str:
+    """Hash of one word with numbers masked, so field rules keep no page text either"""
+    return hashlib.sha1(TEMPLATE_NUMBER.sub("#", word.lower()).encode()).hexdigest()[:8]
+
+def template_word_spans(unit: str) -> List[tuple]:
+    return [m.span() for m in re.finditer(r"\S+", unit)]
+
+def template_field_context(unit: str, span: tuple, other_spans: List[tuple]) -> Dict[str, List[str]]:
+    """The words on either side of a labelled value, hashed; other fields' words match anything"""
+    words = template_word_spans(unit)
+    inside = [i for i, (start, end) in enumerate(words) if start < span[1] and span[0] < end]
+    first, last = inside[0], inside[-1] + 1
+
+    def key(i):
+        start, end = words[i]
+        if any(start < other_end and other_start < end for other_start, other_end in other_spans):
+            return TEMPLATE_ANY_WORD
+        return template_word_key(unit[start:end])
+
+    return {
+        "words_before": [key(i) for i in range(max(0, first - TEMPLATE_CONTEXT_WORDS), first)],
+        "words_after": [key(i) for i in range(last, min(len(words), last + TEMPLATE_CONTEXT_WORDS))],
+    }
+
+def template_context_matches(keys: List[str], expected: List[str]) -> bool:
+    return len(keys) == len(expected) and all(e == TEMPLATE_ANY_WORD or k == e for k, e in zip(keys, expected))
+
+def shared_template_context(a: List[str], b: List[str]) -> List[str]:
+    """Leading words two contexts share; a word either side has as a wildcard stays a wildcard"""
+    shared = []
+    for x, y in zip(a, b):
+        if x != y and TEMPLATE_ANY_WORD not in (x, y):
+            break
+        shared.append(x if x == y else TEMPLATE_ANY_WORD)
+    return shared
+
+def merge_template_rule(old: Dict[str, Any], new: Dict[str, Any]) -> Dict[str, Any]:
+    """Narrow a labelled field's context to the words two samples share, such as a label but not a name"""
+    if "words_before" not in old or "words_before" not in new:
+        return new
+    merged = {
+        "words_before": shared_template_context(old["words_before"][::-1], new["words_before"][::-1])[::-1],
+        "words_after": shared_template_context(old["words_after"], new["words_after"]),
+    }
+    return merged if merged["words_before"] or merged["words_after"] else new
+
+def find_template_value(field: str, rule: Dict[str, Any], units: List[str]) -> Optional[str]:
+    """First value in the page whose surrounding words match a labelled field's context"""
+    before, after = rule["words_before"], rule["words_after"]
+    value_pattern = TEMPLATE_VALUE_PATTERNS.get(field)
+    for unit in units:
+        words = template_word_spans(unit)
+        keys = [template_word_key(unit[start:end]) for start, end in words]
+        for first in range(len(before), len(words)):
+            if not template_context_matches(keys[first - len(before):first], before):
+                continue
+            if value_pattern:
+                m = re.match(value_pattern, unit[words[first][0]:])
+                if not m:
+                    continue
+                end = words[first][0] + m.end()
+                last = next((i for i, (start, _) in enumerate(words) if start >= end), len(words))
+                if template_context_matches(keys[last:last + len(after)], after):
+                    return m.group()
+                continue
+            if not after:
+                return unit[words[first][0]:]
+            for last in range(first + 1, len(words) - len(after) + 1):
+                if template_context_matches(keys[last:last + len(after)], after):
+                    return unit[words[first][0]:words[last - 1][1]]
+    return None
+
+def learn_template_layout(units: List[str], ocr_data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Anchors and per-field rules for a page whose fields the OCR models extracted"""
+    spans = {}
+    for field in TEMPLATE_FIELDS:
+        if ocr_data.get(field) in (None, ""):
+            continue
+        for index, unit in enumerate(units):
+            span = locate_template_value(field, ocr_data[field], unit)
+            # Values must not overlap, e.g. credits inside "AMA PRA Category 1 Credit"
+            if span and not any(i == index and span[0] < end and start < span[1] for i, (start, end) in spans.values()):
+                spans[field] = (index, span)
+                break
+    value_units = {index for index, _ in spans.values()}
+    anchors = {index: template_anchor_key(unit) for index, unit in enumerate(units) if index not in value_units}
+    if len(set(anchors.values())) < TEMPLATE_MIN_ANCHORS:
+        return None
+
+    fields = {}
+    for field, (index, _) in spans.items():
+        span = spans[field][1]
+        if span != (0, len(units[index])):
+            # A labelled value such as "Date of Completion: March 5, 2025", found by the words around it
+            other_spans = [other for name, (i, other) in spans.items() if i == index and name != field]
+            fields[field] = template_field_context(units[index], span, other_spans)
+        else:
+            # A value on its own, found by its position after the nearest anchor above it
+            above = [i for i in anchors if i < index]
+            fields[field] = {"after": anchors[above[-1]], "offset": index - above[-1]} if above else {"after": None, "offset": index}
+    constants = {
+        field: ocr_data[field] for field in TEMPLATE_CONSTANT_FIELDS
+        if field not in spans and ocr_data.get(field)
+    }
+    return {"anchors": sorted(set(anchors.values())), "fields": fields, "constants": constants}
+
+def apply_template(template: Dict[str, Any], units: List[str]) -> Dict[str, Any]:
+    """Fields extracted from a page with a template's rules"""
+    keys = [template_anchor_key(unit) for unit in units]
+    ocr_data = dict(template.get("constants") or {})
+    for field, rule in template["fields"].items():
+        value = None
+        if "words_before" in rule:
+            value = find_template_value(field, rule, units)
+        elif "offset" in rule:
+            base = 0 if rule["after"] is None else (keys.index(rule["after"]) if rule["after"] in keys else None)
+            if base is not None and base + rule["offset"] < len(units):
+                value = units[base + rule["offset"]]
+        if value:
+            ocr_data[field] = value
+    if ocr_data.get("completion_date"):
+        ocr_data["completion_date"] = ocr_date_value(ocr_data["completion_date"]) or ocr_data["completion_date"]
+    if ocr_data.get("credits"):
+        ocr_data["credits"] = ocr_credits_value(ocr_data["credits"])
+    return ocr_data
+
+async def match_ocr_template(units: List[str]) -> Optional[Dict[str, Any]]:
+    """The learned template with the most anchors on this page, if enough of them are"""
+    keys = {template_anchor_key(unit) for unit in units}
+    candidates = await db.ocr_templates.find(
+        {"anchors": {"$in": list(keys)}},
+        {"_id": 0, "template_id": 1, "anchors": 1, "fields": 1, "constants": 1}
+    ).sort("samples", -1).to_list(TEMPLATE_CANDIDATE_LIMIT)
+    best, best_overlap = None, 0
+    for template in candidates:
+        overlap = len(keys.intersection(template["anchors"]))
+        if overlap >= TEMPLATE_MATCH_RATIO * len(template["anchors"]) and overlap > best_overlap:
+            best, best_overlap = template, overlap
+    return best
+
+async def template_ocr_result(text_layer: Optional[str]) -> Optional[Dict[str, Any]]:
+    """A cascade-shaped OCR result from a matching template, or None to fall back to the models"""
+    if not text_layer:
+        count_template_outcome("no_text_layer")
+        return None
+    started = time.perf_counter()
+    units = template_units(text_layer)
+    template = await match_ocr_template(units)
+    if not template:
+        count_template_outcome("miss")
+        return None
+    ocr_data = apply_template(template, units)
+    score = score_ocr_result(ocr_data, None)
+    # Every field the template knows must come out, or the layout has drifted
+    if score["status"] != "completed" or any(not ocr_data.get(field) for field in template["fields"]):
+        count_template_outcome("fallback")
+        await db.ocr_templates.update_one({"template_id": template["template_id"]}, {"$inc": {"fallbacks": 1}})
+        return None
+    count_template_outcome("hit")
+    await db.ocr_templates.update_one(
+        {"template_id": template["template_id"]},
+        {"$inc": {"hits": 1}, "$set": {"last_hit_at": datetime.now(timezone.utc).isoformat()}}
+    )
+    ocr_data["template_id"] = template["template_id"]
+    seconds = time.perf_counter() - started
+    return {
+        **score,
+        "ocr_data": ocr_data,
+        "model": "template",
+        "attempts": [{"tier": "template", "status": score["status"], "fields": score["fields"], "latency_ms": round(seconds * 1000), "cost": 0}],
+    }
+
+async def learn_ocr_template(text_layer: str, ocr_data: Dict[str, Any]):
+    """Learn or refine the template for a page the OCR models read completely.
+
+    A page matching an existing template narrows its anchors and the words around labelled
+    values to those both pages share, which drops per-certificate text such as the learner's name.
+    """
+    units = template_units(text_layer)
+    layout = learn_template_layout(units, ocr_data)
+    if not layout:
+        return None
+    now = datetime.now(timezone.utc).isoformat()
+    existing = await match_ocr_template(units)
+    if existing:
+        anchors = sorted(set(existing["anchors"]) & set(layout["anchors"]))
+        if len(anchors) >= TEMPLATE_MIN_ANCHORS:
+            fields = {
+                field: merge_template_rule(existing["fields"].get(field, {}), rule)
+                for field, rule in layout["fields"].items()
+                if rule.get("after") is None or rule["after"] in anchors
+            }
+            await db.ocr_templates.update_one(
+                {"template_id": existing["template_id"]},
+                {"$set": {"anchors": anchors, "fields": fields, "constants": layout["constants"], "updated_at": now},
+                 "$inc": {"samples": 1}}
+            )
+            count_template_outcome("refined")
+            return existing["template_id"]
+    template_id = f"tpl_{uuid.uuid4().hex[:12]}"
+    await db.ocr_templates.insert_one({
+        "template_id": template_id,
+        **layout,
+        "provider": ocr_data.get("provider"),
+        "samples": 1,
+        "hits": 0,
+        "fallbacks": 0,
+        "created_at": now,
+        "updated_at": now
+    })
+    count_template_outcome("learned")
+    return template_id
+
+# ============ EEDS QR PARSING ============
+
+# Normalized QR key -> certificate field
+EEDS_FIELD_ALIASES = {
+    "title": "title",
+    "activity": "title",
+    "activity_title": "title",
+    "course": "title",
+    "provider": "provider",
+    "organization": "provider",
+    "org": "provider",
+    "sponsor": "provider",
+    "credits": "credits",
+    "credit_hours": "credits",
+    "hours": "credits",
+    "credit_type": "credit_types",
+    "credit_types": "credit_types",
+    "date": "completion_date",
+    "completion_date": "completion_date",
+    "completed": "completion_date",
+    "certificate_number": "certificate_number",
+    "certificate": "certificate_number",
+    "cert": "certificate_number",
+    "cert_no": "certificate_number",
+    "id": "certificate_number",
+    "subject": "subject",
+    "topic": "subject",
+}
+EEDS_URL_PATTERN = re.compile(r"^[a-z][a-z0-9+.-]*://", re.IGNORECASE)
+EEDS_QUERY_PATTERN = re.compile(r"^[^\s=&|;]+=[^&|;\n]*(?:&[^\s=&]+=[^&|;\n]*)*$")
+EEDS_PAIR_PATTERN = re.compile(r"([A-Za-z][\w #.-]*?)\s*[:=]\s*([^|;\n\r\t]*)")
+EEDS_KEY_SEPARATORS = re.compile(r"[\s#.-]+")
+EEDS_CREDITS_PATTERN = re.compile(r"\d+(?:\.\d+)?")
+EEDS_US_DATE_PATTERN = re.compile(r"^(\d{1,2})/(\d{1,2})/(\d{4})$")
+EEDS_COMPACT_DATE_PATTERN = re.compile(r"^(\d{4})(\d{2})(\d{2})$")
+# A URL path segment that reads as a certificate number rather than a route, e.g. EU-12345
+EEDS_IDENTIFIER_PATTERN = re.compile(r"^(?=.*\d)[A-Za-z0-9][\w-]{3,}$")
+EEDS_BATCH_MAX = 1000
+
+def eeds_date(value: str) -> str:
+    """Normalize the date layouts seen on EEDS certificates to YYYY-MM-DD"""
+    match = EEDS_US_DATE_PATTERN.match(value)
+    if match:
+        month, day, year = match.groups()
+        return f"{year}-{int(month):02d}-{int(day):02d}"
+    match = EEDS_COMPACT_DATE_PATTERN.match(value)
+    if match:
+        return "-".join(match.groups())
+    return value[:10]
+
+def eeds_fields(pairs) -> Dict[str, Any]:
+    """Map raw QR key/value pairs onto certificate fields, keeping the first value per field"""
+    fields = {}
+    for key, value in pairs:
+        field = EEDS_FIELD_ALIASES.get(EEDS_KEY_SEPARATORS.sub("_", str(key).strip().lower()).strip("_"))
+        if field is None or field in fields or value is None:
+            continue
+        if field == "credit_types":
+            types = value if isinstance(value, list) else re.split(r"[,;]", str(value))
+            types = [str(t).strip() for t in types if str(t).strip()]
+            if types:
+                fields[field] = types
+            continue
+        value = str(value).strip()
+        if not value:
+            continue
+        if field == "credits":
+            match = EEDS_CREDITS_PATTERN.search(value)
+            if not match:
+                continue
+            fields[field] = float(match.group())
+        elif field == "completion_date":
+            fields[field] = eeds_date(value)
+        else:
+            fields[field] = value
+    return fields
+
+def parse_eeds_qr(raw: Any) -> Dict[str, Any]:
+    """Parse an EEDS QR payload into certificate fields.
+
+    Handles JSON objects, URLs carrying the data in their query string or
+    fragment, bare query strings and key:value / key=value pairs delimited by
+    pipes, semicolons or newlines. Anything else is taken as the certificate
+    number, as EEDS prints it on the certificate.
+    """
+    if isinstance(raw, dict):
+        return eeds_fields(raw.items())
+    text = str(raw or "").strip()
+    if not text:
+        return {}
+    if text.startswith("{"):
+        try:
+            data = json.loads(text)
+        except ValueError:
+            data = None
+        if isinstance(data, dict):
+            return eeds_fields(data.items())
+    if EEDS_URL_PATTERN.match(text):
+        url = urllib.parse.urlsplit(text)
+        pairs = urllib.parse.parse_qsl(url.query) + urllib.parse.parse_qsl(url.fragment)
+        fields = eeds_fields(pairs)
+        if "certificate_number" not in fields:
+            # Verification links end in the certificate number, e.g. /verify/ABC123; with
+            # the data in the query the last segment is usually just a route, e.g. /cert
+            segment = urllib.parse.unquote(url.path.rstrip("/").rsplit("/", 1)[-1])
+            if segment and (not pairs or EEDS_IDENTIFIER_PATTERN.match(segment)):
+                fields["certificate_number"] = segment
+        return fields
+    if EEDS_QUERY_PATTERN.match(text):
+        return eeds_fields(urllib.parse.parse_qsl(text))
+    pairs = EEDS_PAIR_PATTERN.findall(text)
+    if pairs:
+        return eeds_fields(pairs)
+    return {"certificate_number": text}
+
+def eeds_row_error(fields: Dict[str, Any]) -> Optional[str]:
+    """Why parsed QR fields cannot be imported, or None when they can"""
+    if not fields.get("title") and fields.get("credits") is None:
+        # Free text such as "Dr. Smith: great course" parses to nothing useful
+        return "QR code has no certificate title or credits"
+    date = fields.get("completion_date")
+    if date:
+        try:
+            datetime.strptime(str(date), "%Y-%m-%d")
+        except ValueError:
+            return f"Invalid completion date: {date}"
+    return None
+
+def eeds_certificate_row(qr_fields: Dict[str, Any], overrides: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Build an import row from parsed QR fields, filling the usual EEDS defaults.
+
+    Raises ValueError when the fields are not a certificate, see eeds_row_error.
+    """
+    row = dict(qr_fields)
+    for field, value in (overrides or {}).items():
+        if value not in (None, "", []):
+            row[field] = value
+    error = eeds_row_error(row)
+    if error:
+        raise ValueError(error)
+    row.setdefault("title", "EEDS Certificate")
+    row.setdefault("provider", "EEDS")
+    row.setdefault("credits", 1)
+    row.setdefault("completion_date", datetime.now(timezone.utc).strftime("%Y-%m-%d"))
+    if not row.get("credit_types"):
+        row["credit_types"] = [row.get("credit_type") or "ama_cat1"]
+    return row
+
+@api_router.post("/certificates/eeds-import")
+async def import_eeds_certificate(request: Request, user: User = Depends(get_current_user)):
+    """Import certificate from EEDS QR code data"""
+    body = await request.json()
+    
+    # Fields sent alongside the scan (e.g. corrected in the import dialog) take
+    # precedence; the parsed QR payload fills in the rest
+    overrides = {field: body.get(field) for field in (
+        "title", "provider", "credits", "completion_date", "certificate_number", "subject"
+    )}
+    overrides["credit_types"] = body.get("credit_types") or (
+        [body["credit_type"]] if body.get("credit_type") else None
+    )
+    try:
+        row = eeds_certificate_row(parse_eeds_qr(body.get("qr_data")), overrides)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    credit_types = row["credit_types"]
+    
+    cert_data = {
+        "title": row["title"],
+        "provider": row["provider"],
+        "credits": float(row["credits"]),
+        "credit_types": credit_types,
+        "credit_type": credit_types[0],
+        "completion_date": row["completion_date"],
+        "certificate_number": row.get("certificate_number"),
+        "subject": row.get("subject"),
+        "eeds_imported": True
+    }
+    
+    cert = Certificate(user_id=user.user_id, **cert_data)
+    cert_dict = cert.model_dump()
+    cert_dict["created_at"] = cert_dict["created_at"].isoformat()
+    cert_dict["updated_at"] = cert_dict["updated_at"].isoformat()
     
     await db.certificates.insert_one(cert_dict)
     cert_dict.pop("_id", None)  # Remove MongoDB's _id to avoid serialization error
+    await upsert_ledger_entry("certificate", cert_dict)
     
     # Update requirement progress
     await update_requirement_progress(user.user_id)
     
     return cert_dict
 
+class CertificateImportRow(BaseModel):
+    """One row of a certificate import, validated in bulk through CERTIFICATE_IMPORT_ADAPTER"""
+    model_config = ConfigDict(extra="ignore", coerce_numbers_to_str=True)
+    title: str = Field(min_length=1)
+    provider: str = Field(min_length=1)
+    completion_date: str = Field(min_length=1)
+    credits: float = 0
+    credit_types: List[str] = []
+    credit_type: Optional[str] = None
+    subject: Optional[str] = None
+    expiration_date: Optional[str] = None
+    certificate_number: Optional[str] = None
+
+    @field_validator("credit_types", mode="before")
+    @classmethod
+    def split_credit_types(cls, value):
+        if isinstance(value, str):
+            # Commas from the import template, semicolons from our own CSV export
+            return [t.strip() for t in re.split(r"[,;]", value) if t.strip()]
+        return value or []
+
+CERTIFICATE_IMPORT_ADAPTER = TypeAdapter(List[CertificateImportRow])
+IMPORT_BATCH_SIZE = 1000
+IMPORT_REQUIRED_FIELDS = {
+    "title": "Missing title",
+    "provider": "Missing provider",
+    "completion_date": "Missing completion date",
+}
+
+def import_row_error(error: Dict[str, Any]) -> str:
+    """Turn a pydantic error for an import row into the message shown to the user"""
+    field = error["loc"][1] if len(error["loc"]) > 1 else None
+    if field in IMPORT_REQUIRED_FIELDS and (error["type"] == "missing" or not error.get("input")):
+        return IMPORT_REQUIRED_FIELDS[field]
+    return f"{field}: {error['msg']}" if field else error["msg"]
+
+def validate_import_rows(rows: List[Any]) -> tuple:
+    """Validate import rows in one pass, returning (index, row) pairs for valid rows and per-row errors"""
+    try:
+        return list(enumerate(CERTIFICATE_IMPORT_ADAPTER.validate_python(rows))), {}
+    except ValidationError as e:
+        errors = {}
+        for error in e.errors():
+            # Report the first problem per row, as the required fields are listed first
+            errors.setdefault(error["loc"][0], import_row_error(error))
+    valid_indexes = [idx for idx in range(len(rows)) if idx not in errors]
+    valid = CERTIFICATE_IMPORT_ADAPTER.validate_python([rows[idx] for idx in valid_indexes])
+    return list(zip(valid_indexes, valid)), errors
+
+def certificate_import_key(user_id: str, row: CertificateImportRow) -> str:
+    """Natural key of an imported certificate, so re-importing the same file is a no-op"""
+    parts = [user_id, row.title, row.provider, row.completion_date, row.certificate_number or ""]
+    return hashlib.sha1("\x1f".join(part.strip().lower() for part in parts).encode("utf-8")).hexdigest()
+
+async def import_certificate_rows(
+    user_id: str,
+    rows: List[Any],
+    row_numbers: Optional[List[int]] = None,
+    extra_fields: Optional[Dict[str, Any]] = None
+) -> Dict[str, Any]:
+    """Validate and insert certificate rows in unordered batches.
+
+    Rows matching an already imported certificate are rejected by the unique
+    import_key index. Errors are numbered from row_numbers when given (e.g.
+    file line numbers), else from 1. extra_fields are set on every created
+    certificate. Requirement progress is left to the caller, so a large
+    import recomputes it once.
+    """
+    def row_number(idx: int) -> int:
+        return row_numbers[idx] if row_numbers else idx + 1
+    
+    valid, row_errors = validate_import_rows(rows)
+    errors = [{"row": row_number(idx), "error": message} for idx, message in row_errors.items()]
+    
+    docs = []
+    for idx, row in valid:
+        credit_types = row.credit_types or [row.credit_type or "ama_cat1"]
+        cert = Certificate(
+            user_id=user_id,
+            title=row.title,
+            provider=row.provider,
+            credits=row.credits,
+            credit_types=credit_types,
+            credit_type=credit_types[0],
+            subject=row.subject,
+            completion_date=row.completion_date,
+            expiration_date=row.expiration_date,
+            certificate_number=row.certificate_number,
+            **(extra_fields or {})
+        )
+        cert_dict = cert.model_dump()
+        cert_dict["created_at"] = cert_dict["created_at"].isoformat()
+        cert_dict["updated_at"] = cert_dict["updated_at"].isoformat()
+        cert_dict["import_key"] = certificate_import_key(user_id, row)
+        docs.append((idx, cert_dict))
+    
+    imported = []
+    duplicate_count = 0
+    for start in range(0, len(docs), IMPORT_BATCH_SIZE):
+        batch = docs[start:start + IMPORT_BATCH_SIZE]
+        # Stamped as each batch is written rather than when the rows were built, since
+        # delta sync only looks back SYNC_SETTLE for writes that land after their timestamp
+        written_at = datetime.now(timezone.utc).isoformat()
+        for _, doc in batch:
+            doc["updated_at"] = written_at
+        failed = {}
+        try:
+            await db.certificates.insert_many([doc for _, doc in batch], ordered=False)
+        except BulkWriteError as e:
+            for error in e.details.get("writeErrors", []):
+                failed[error["index"]] = error
+        
+        for position, (idx, doc) in enumerate(batch):
+            doc.pop("_id", None)
+            error = failed.get(position)
+            if error is None:
+                imported.append(doc)
+            elif error.get("code") == 11000:
+                duplicate_count += 1
+                errors.append({"row": row_number(idx), "error": "Duplicate certificate"})
+            else:
+                errors.append({"row": row_number(idx), "error": error.get("errmsg", "Insert failed")})
+    
+    await upsert_ledger_entries("certificate", imported)
+    errors.sort(key=lambda error: error["row"])
+    return {"imported": imported, "errors": errors, "duplicate_count": duplicate_count}
+
 @api_router.post("/certificates/bulk-import")
 async def bulk_import_certificates(request: Request, user: User = Depends(get_current_user)):
     """Bulk import certificates from CSV data"""
@@ -1513,77 +2954,306 @@ async def bulk_import_certificates(request: Request, user: User = Depends(get_cu
     if not certificates_data:
         raise HTTPException(status_code=400, detail="No certificates provided")
     
-    imported = []
-    errors = []
+    result = await import_certificate_rows(user.user_id, certificates_data)
+    
+    # Update requirement progress
+    await update_requirement_progress(user.user_id)
+    
+    return {
+        "imported_count": len(result["imported"]),
+        "error_count": len(result["errors"]),
+        "duplicate_count": result["duplicate_count"],
+        "imported": result["imported"],
+        "errors": result["errors"]
+    }
+
+@api_router.post("/certificates/eeds-import-batch")
+async def import_eeds_batch(request: Request, user: User = Depends(get_current_user)):
+    """Import many scanned EEDS QR codes in one request"""
+    body = await request.json()
+    qr_codes = body.get("qr_codes") or []
     
-    for idx, cert_data in enumerate(certificates_data):
+    if not isinstance(qr_codes, list) or not qr_codes:
+        raise HTTPException(status_code=400, detail="No QR codes provided")
+    if len(qr_codes) > EEDS_BATCH_MAX:
+        raise HTTPException(status_code=400, detail=f"At most {EEDS_BATCH_MAX} QR codes per batch")
+    
+    rows, row_numbers, numbers = [], [], []
+    duplicates, errors = [], []
+    seen = set()
+    for idx, raw in enumerate(qr_codes):
         try:
-            # Validate required fields
-            if not cert_data.get("title"):
-                errors.append({"row": idx + 1, "error": "Missing title"})
-                continue
-            if not cert_data.get("provider"):
-                errors.append({"row": idx + 1, "error": "Missing provider"})
-                continue
-            if not cert_data.get("completion_date"):
-                errors.append({"row": idx + 1, "error": "Missing completion date"})
-                continue
-            
-            # Handle credit types
-            credit_types = cert_data.get("credit_types", [])
-            if isinstance(credit_types, str):
-                credit_types = [t.strip() for t in credit_types.split(",") if t.strip()]
-            if not credit_types and cert_data.get("credit_type"):
-                credit_types = [cert_data.get("credit_type")]
-            
-            cert = Certificate(
-                user_id=user.user_id,
-                title=cert_data.get("title", ""),
-                provider=cert_data.get("provider", ""),
-                credits=float(cert_data.get("credits", 0)),
-                credit_types=credit_types,
-                credit_type=credit_types[0] if credit_types else "ama_cat1",
-                subject=cert_data.get("subject"),
-                completion_date=cert_data.get("completion_date"),
-                expiration_date=cert_data.get("expiration_date"),
-                certificate_number=cert_data.get("certificate_number")
-            )
-            
-            cert_dict = cert.model_dump()
-            cert_dict["created_at"] = cert_dict["created_at"].isoformat()
-            cert_dict["updated_at"] = cert_dict["updated_at"].isoformat()
-            
-            await db.certificates.insert_one(cert_dict)
-            cert_dict.pop("_id", None)
-            imported.append(cert_dict)
-            
-        except Exception as e:
+            row = eeds_certificate_row(parse_eeds_qr(raw))
+        except ValueError as e:
             errors.append({"row": idx + 1, "error": str(e)})
+            continue
+        # Scanning the same code twice is common; fall back to the raw payload
+        # for codes that carry no certificate number
+        key = row.get("certificate_number") or str(raw).strip()
+        if key in seen:
+            duplicates.append({"row": idx + 1, "certificate_number": row.get("certificate_number")})
+            continue
+        seen.add(key)
+        rows.append(row)
+        row_numbers.append(idx + 1)
+        if row.get("certificate_number"):
+            numbers.append(row["certificate_number"])
+    
+    # Certificates already on file from an earlier scan or manual entry
+    existing = set()
+    if numbers:
+        cursor = db.certificates.find(
+            {"user_id": user.user_id, "certificate_number": {"$in": numbers}},
+            {"_id": 0, "certificate_number": 1}
+        )
+        existing = {cert["certificate_number"] async for cert in cursor}
+    if existing:
+        keep = [i for i, row in enumerate(rows) if row.get("certificate_number") not in existing]
+        duplicates.extend(
+            {"row": row_numbers[i], "certificate_number": row["certificate_number"]}
+            for i, row in enumerate(rows) if row.get("certificate_number") in existing
+        )
+        rows = [rows[i] for i in keep]
+        row_numbers = [row_numbers[i] for i in keep]
     
-    # Update requirement progress
-    await update_requirement_progress(user.user_id)
+    result = {"imported": [], "errors": [], "duplicate_count": 0}
+    if rows:
+        result = await import_certificate_rows(
+            user.user_id, rows, row_numbers, extra_fields={"eeds_imported": True}
+        )
+        await update_requirement_progress(user.user_id)
     
+    duplicates.sort(key=lambda duplicate: duplicate["row"])
+    errors = sorted(errors + result["errors"], key=lambda error: error["row"])
     return {
-        "imported_count": len(imported),
+        "imported_count": len(result["imported"]),
         "error_count": len(errors),
-        "imported": imported,
-        "errors": errors
+        "duplicate_count": len(duplicates) + result["duplicate_count"],
+        "imported": result["imported"],
+        "errors": errors,
+        "duplicates": duplicates
+    }
+
+IMPORT_FILE_MAX_BYTES = int(os.environ.get("IMPORT_FILE_MAX_BYTES", str(50 * 1024 * 1024)))
+
+# Normalized file header -> import row field
+IMPORT_COLUMN_ALIASES = {
+    "title": "title",
+    "provider": "provider",
+    "credits": "credits",
+    "credit_type": "credit_types",
+    "credit_types": "credit_types",
+    "completion_date": "completion_date",
+    "date": "completion_date",
+    "subject": "subject",
+    "certificate_number": "certificate_number",
+    "certificate_#": "certificate_number",
+    "expiration_date": "expiration_date",
+}
+
+def import_columns(header) -> List[Optional[str]]:
+    """Map a file's header row to import fields (None for unknown columns)"""
+    return [
+        IMPORT_COLUMN_ALIASES.get(str(name or "").strip().lower().replace(" ", "_"))
+        for name in header
+    ]
+
+def import_cell_value(value):
+    if isinstance(value, datetime):
+        return value.strftime("%Y-%m-%d")
+    if isinstance(value, str):
+        return value.strip()
+    return value
+
+def import_row(columns: List[Optional[str]], values) -> Optional[Dict[str, Any]]:
+    """Build an import row from cell values; None for a blank line"""
+    row = {}
+    for column, value in zip(columns, values):
+        value = import_cell_value(value)
+        # Empty cells fall back to field defaults, or count as missing
+        if column and value not in (None, ""):
+            row[column] = value
+    return row if any(value not in (None, "") for value in values) else None
+
+def iter_csv_import_rows(f):
+    """Yield (line number, row) pairs from a CSV file, one line at a time"""
+    text = io.TextIOWrapper(f, encoding="utf-8-sig", newline="")
+    reader = csv.reader(text)
+    columns = import_columns(next(reader, []))
+    for values in reader:
+        row = import_row(columns, values)
+        if row is not None:
+            yield reader.line_num, row
+
+def iter_xlsx_import_rows(f):
+    """Yield (row number, row) pairs from the first sheet of a workbook in read-only mode"""
+    wb = openpyxl.load_workbook(f, read_only=True, data_only=True)
+    try:
+        rows = wb.worksheets[0].iter_rows(values_only=True)
+        columns = import_columns(next(rows, ()))
+        for line, values in enumerate(rows, 2):
+            row = import_row(columns, values)
+            if row is not None:
+                yield line, row
+    finally:
+        wb.close()
+
+def read_import_chunk(rows, size: int = IMPORT_BATCH_SIZE) -> List[tuple]:
+    return list(itertools.islice(rows, size))
+
+@api_router.post("/certificates/import-file")
+async def import_certificate_file(
+    file: UploadFile = File(...),
+    user: User = Depends(rate_limited_user("upload"))
+):
+    """Import certificates from a CSV or XLSX file, streaming progress as NDJSON.
+
+    Emits one "progress" line per batch (with that batch's row errors) and a
+    final "complete" line with the totals.
+    """
+    filename = (file.filename or "").lower()
+    if filename.endswith(".xlsx") or file.content_type == XLSX_MEDIA_TYPE:
+        reader = iter_xlsx_import_rows
+    elif filename.endswith(".csv") or file.content_type == "text/csv":
+        reader = iter_csv_import_rows
+    else:
+        raise HTTPException(status_code=400, detail="Unsupported file type. Upload a CSV or XLSX file")
+    if file.size is not None and file.size > IMPORT_FILE_MAX_BYTES:
+        raise HTTPException(status_code=413, detail="Import file is too large")
+    
+    # The upload is spooled to disk by the time we get here; copy its handle,
+    # as the form closes the original once the endpoint returns
+    upload = tempfile.TemporaryFile()
+    await asyncio.to_thread(shutil.copyfileobj, file.file, upload)
+    upload.seek(0)
+    
+    async def events():
+        totals = {"rows_read": 0, "imported_count": 0, "error_count": 0, "duplicate_count": 0}
+        try:
+            rows = reader(upload)
+            while True:
+                # Parsing is blocking file I/O, so read each chunk in a worker thread
+                chunk = await asyncio.to_thread(read_import_chunk, rows)
+                if not chunk:
+                    break
+                result = await import_certificate_rows(
+                    user.user_id,
+                    [row for _, row in chunk],
+                    [line for line, _ in chunk]
+                )
+                totals["rows_read"] += len(chunk)
+                totals["imported_count"] += len(result["imported"])
+                totals["error_count"] += len(result["errors"])
+                totals["duplicate_count"] += result["duplicate_count"]
+                yield json.dumps({"type": "progress", **totals, "errors": result["errors"]}) + "\n"
+        except Exception as e:
+            logger.error(f"Certificate file import failed for {user.user_id}: {e}")
+            yield json.dumps({"type": "error", "detail": f"Could not read import file: {e}"}) + "\n"
+        finally:
+            upload.close()
+        
+        if totals["imported_count"]:
+            await update_requirement_progress(user.user_id)
+        yield json.dumps({"type": "complete", **totals}) + "\n"
+    
+    return StreamingResponse(events(), media_type="application/x-ndjson")
+
+# ============ CERTIFICATE CODE DETECTION ============
+
+# Uploads whose QR code carries a complete EEDS payload are imported from it without OCR
+QR_SCAN_MAX_EDGE = 1600
+EEDS_REQUIRED_FIELDS = ("title", "credits", "completion_date")
+UPLOAD_PATHS = ["eeds_qr", "template", "ocr_models", "failed"]
+
+# Which path handled each upload, exposed on /api/metrics
+upload_path_metrics: Dict[str, int] = {}
+
+def count_upload_path(path: str):
+    upload_path_metrics[path] = upload_path_metrics.get(path, 0) + 1
+
+def decode_certificate_codes(content: bytes, mime_type: str) -> List[str]:
+    """Decoded text of the QR codes and barcodes on a certificate image or a PDF's first page.
+
+    CPU bound, so run it in a worker thread. Returns nothing when OpenCV is not installed.
+    """
+    try:
+        import cv2
+    except ImportError:
+        return []
+    image = open_certificate_image(content, mime_type, QR_SCAN_MAX_EDGE)
+    image.thumbnail((QR_SCAN_MAX_EDGE, QR_SCAN_MAX_EDGE), Image.LANCZOS)
+    gray = np.asarray(image.convert("L"))
+    
+    codes = []
+    ok, decoded, _, _ = cv2.QRCodeDetectorAruco().detectAndDecodeMulti(gray)
+    if ok:
+        codes.extend(decoded)
+    if not any(codes):
+        # The single-code detector finds some codes the multi detector misses
+        text, _, _ = cv2.QRCodeDetector().detectAndDecode(gray)
+        codes.append(text)
+    ok, decoded, _, _ = cv2.barcode.BarcodeDetector().detectAndDecodeWithType(gray)
+    if ok:
+        codes.extend(decoded)
+    return list(dict.fromkeys(code for code in codes if code))
+
+def eeds_payload_from_codes(codes: List[str]) -> Optional[Dict[str, Any]]:
+    """The first decoded code that parses to a complete EEDS payload, with its raw text"""
+    for code in codes:
+        fields = parse_eeds_qr(code)
+        if all(fields.get(field) for field in EEDS_REQUIRED_FIELDS) and not eeds_row_error(fields):
+            return {"raw": code, "fields": fields}
+    return None
+
+async def scan_certificate_codes(content: bytes, mime_type: str) -> Optional[Dict[str, Any]]:
+    """Look for an EEDS QR payload on an uploaded certificate; failures only skip the shortcut"""
+    try:
+        codes = await asyncio.to_thread(decode_certificate_codes, content, mime_type)
+    except Exception as e:
+        logger.warning(f"Scanning uploaded certificate for QR codes failed: {e}")
+        return None
+    return eeds_payload_from_codes(codes)
+
+async def apply_eeds_payload(certificate_id: str, payload: Dict[str, Any], user_id: str) -> Dict[str, Any]:
+    """Fill an uploaded certificate from its EEDS QR code, as the EEDS import would"""
+    row = eeds_certificate_row(payload["fields"])
+    credit_types = row["credit_types"]
+    update_data = {
+        "title": str(row["title"])[:255],
+        "provider": str(row["provider"])[:255],
+        "credits": float(row["credits"]),
+        "credit_types": credit_types,
+        "credit_type": credit_types[0],
+        "completion_date": row["completion_date"],
+        "certificate_number": row.get("certificate_number"),
+        "subject": row.get("subject"),
+        "eeds_imported": True,
+        "ocr_status": "completed",
+        "ocr_data": {"ocr_model": "eeds_qr", "qr_data": payload["raw"], **payload["fields"]},
+        "ocr_error": None,
+        "updated_at": datetime.now(timezone.utc).isoformat()
     }
+    await db.certificates.update_one({"certificate_id": certificate_id}, {"$set": update_data})
+    cert = await db.certificates.find_one({"certificate_id": certificate_id}, {"_id": 0})
+    await upsert_ledger_entry("certificate", cert)
+    await update_requirement_progress(user_id)
+    return cert
 
 # ============ REQUIREMENTS ROUTES ============
 
 @api_router.get("/requirements")
 async def get_requirements(
     user: User = Depends(get_current_user),
-    active_only: bool = True
+    active_only: bool = True,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None
 ):
     """Get user's requirements"""
     query = {"user_id": user.user_id}
     if active_only:
         query["is_active"] = True
     
-    requirements = await db.requirements.find(query, {"_id": 0}).sort("due_date", 1).to_list(100)
-    return requirements
+    return await paginate(db.requirements, query, "due_date", "requirement_id", 1, limit, cursor)
 
 @api_router.post("/requirements")
 async def create_requirement(req_data: RequirementCreate, user: User = Depends(get_current_user)):
@@ -1644,6 +3314,7 @@ async def delete_requirement(requirement_id: str, user: User = Depends(get_curre
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Requirement not found")
     
+    await record_tombstones(user.user_id, "requirements", [requirement_id])
     return {"message": "Requirement deleted"}
 
 
@@ -1676,8 +3347,15 @@ async def get_certificate_filter_options(user: User = Depends(get_current_user))
     }
 
 
+async def bump_data_version(user_id: str):
+    """Record that the user's credits changed, invalidating their cached exports"""
+    await db.users.update_one({"user_id": user_id}, {"$inc": {"data_version": 1}})
+
 async def update_requirement_progress(user_id: str):
     """Update progress for all user requirements"""
+    # Every credit write path ends here, so this is also where cached exports go stale
+    await bump_data_version(user_id)
+    
     requirements = await db.requirements.find(
         {"user_id": user_id, "is_active": True},
         {"_id": 0}
@@ -1692,120 +3370,1927 @@ async def update_single_requirement_progress(user_id: str, requirement_id: str):
     if not req:
         return
     
-    # Build base match conditions
-    base_match = [{"user_id": user_id}]
+    # Certificates and self-reported credits both live in the ledger, so one query covers them
+    match: Dict[str, Any] = {"user_id": user_id}
     
     # Handle year range filtering
     start_year = req.get("start_year")
     end_year = req.get("end_year")
-    
-    year_conditions = []
-    if start_year:
-        year_conditions.append({
-            "$expr": {"$gte": [{"$toInt": {"$substr": ["$completion_date", 0, 4]}}, start_year]}
-        })
-    if end_year:
-        year_conditions.append({
-            "$expr": {"$lte": [{"$toInt": {"$substr": ["$completion_date", 0, 4]}}, end_year]}
-        })
-    
-    # Handle credit types filtering
+    if start_year or end_year:
+        match["year"] = {}
+        if start_year:
+            match["year"]["$gte"] = start_year
+        if end_year:
+            match["year"]["$lte"] = end_year
+    
+    # Handle credit types filtering (ledger credit_types is always populated)
     credit_types = req.get("credit_types", [])
     credit_type = req.get("credit_type")
-    
-    credit_type_condition = None
     if credit_types:
-        credit_type_condition = {
-            "$or": [
-                {"credit_types": {"$in": credit_types}},
-                {"credit_type": {"$in": credit_types}}
-            ]
-        }
+        match["credit_types"] = {"$in": credit_types}
     elif credit_type:
-        credit_type_condition = {
-            "$or": [
-                {"credit_types": credit_type},
-                {"credit_type": credit_type}
-            ]
-        }
+        match["credit_types"] = credit_type
     
-    # Handle provider filtering (case-insensitive partial match) - certificates only
+    # Provider and subject filters (case-insensitive partial match) apply to certificates only
+    certificate_conditions = []
     providers = req.get("providers", [])
-    provider_condition = None
     if providers:
-        provider_conditions = []
-        for provider in providers:
-            provider_conditions.append({
-                "provider": {"$regex": provider, "$options": "i"}
-            })
-        provider_condition = {"$or": provider_conditions}
-    
-    # Handle subject filtering (case-insensitive partial match) - certificates only
+        certificate_conditions.append({
+            "$or": [{"provider": {"$regex": provider, "$options": "i"}} for provider in providers]
+        })
     subjects = req.get("subjects", [])
-    subject_condition = None
     if subjects:
-        subject_conditions = []
-        for subject in subjects:
-            subject_conditions.append({
-                "subject": {"$regex": subject, "$options": "i"}
-            })
-        subject_condition = {"$or": subject_conditions}
-    
-    # Build certificate query
-    cert_match = base_match.copy()
-    cert_match.extend(year_conditions)
-    if credit_type_condition:
-        cert_match.append(credit_type_condition)
-    if provider_condition:
-        cert_match.append(provider_condition)
-    if subject_condition:
-        cert_match.append(subject_condition)
-    
-    cert_query = {"$and": cert_match} if len(cert_match) > 1 else cert_match[0]
-    
-    cert_pipeline = [
-        {"$match": cert_query},
-        {"$group": {"_id": None, "total_credits": {"$sum": "$credits"}, "count": {"$sum": 1}}}
-    ]
-    
-    cert_result = await db.certificates.aggregate(cert_pipeline).to_list(1)
-    cert_credits = cert_result[0]["total_credits"] if cert_result else 0
-    cert_count = cert_result[0]["count"] if cert_result else 0
-    
-    # Build self-reported credits query (no provider/subject filtering - just year and credit type)
-    self_match = base_match.copy()
-    self_match.extend(year_conditions)
-    if credit_type_condition:
-        self_match.append(credit_type_condition)
-    
-    self_query = {"$and": self_match} if len(self_match) > 1 else self_match[0]
-    
-    self_pipeline = [
-        {"$match": self_query},
-        {"$group": {"_id": None, "total_credits": {"$sum": "$credits"}, "count": {"$sum": 1}}}
-    ]
+        certificate_conditions.append({
+            "$or": [{"subject": {"$regex": subject, "$options": "i"}} for subject in subjects]
+        })
+    if certificate_conditions:
+        match["$or"] = [
+            {"source": "self_reported"},
+            {"$and": [{"source": "certificate"}, *certificate_conditions]}
+        ]
     
-    self_result = await db.self_reported_credits.aggregate(self_pipeline).to_list(1)
-    self_credits = self_result[0]["total_credits"] if self_result else 0
-    self_count = self_result[0]["count"] if self_result else 0
+    result = await db.credit_ledger.aggregate([
+        {"$match": match},
+        {"$group": {"_id": "$source", "total_credits": {"$sum": "$credits"}, "count": {"$sum": 1}}}
+    ]).to_list(None)
+    by_source = {row["_id"]: row for row in result}
+    cert_count = by_source.get("certificate", {}).get("count", 0)
+    self_count = by_source.get("self_reported", {}).get("count", 0)
     
     # Total credits
-    total_credits = cert_credits + self_credits
-    total_count = cert_count + self_count
+    total_credits = sum(row["total_credits"] for row in result)
     
+    progress = {
+        "credits_earned": total_credits,
+        "matching_certificates": cert_count,
+        "matching_self_reported": self_count,
+    }
+    # Unchanged progress is not a change, for delta sync or for clients
+    if all(req.get(field) == value for field, value in progress.items()):
+        return
     await db.requirements.update_one(
         {"requirement_id": requirement_id},
-        {"$set": {
-            "credits_earned": total_credits,
-            "matching_certificates": cert_count,
-            "matching_self_reported": self_count,
-            "updated_at": datetime.now(timezone.utc).isoformat()
-        }}
+        {"$set": {**progress, "updated_at": datetime.now(timezone.utc).isoformat()}}
     )
+    if total_credits != req.get("credits_earned"):
+        await publish_event(user_id, "requirement.progress", {
+            "requirement_id": requirement_id,
+            "credits_earned": total_credits,
+            "credits_required": req.get("credits_required"),
+        })
 
-# ============ REPORTS ROUTES ============
+# ============ CREDIT TYPES ============
 
-@api_router.get("/reports/summary")
+# credit_types is the canonical field; credit_type is kept as its first entry for older clients
+CREDIT_TYPES_MIGRATION = "credit_types_normalize"
+credit_types_normalized = False  # Set once this instance has seen the migration finish
+
+def credit_types_of(doc: Dict[str, Any]) -> List[str]:
+    """A document's credit types, falling back to the legacy field; never empty"""
+    return doc.get("credit_types") or ([doc["credit_type"]] if doc.get("credit_type") else ["unknown"])
+
+def normalize_credit_fields(data: Dict[str, Any]) -> Dict[str, Any]:
+    """Fill credit_types from the legacy credit_type (or vice versa) in place"""
+    credit_types = credit_types_of(data)
+    data["credit_types"] = credit_types
+    data["credit_type"] = credit_types[0]
+    return data
+
+def credit_types_predicate(credit_types: List[str]) -> Dict[str, Any]:
+    """Query predicate matching documents that carry any of credit_types"""
+    condition = {"$in": credit_types}
+    if credit_types_normalized:
+        return {"credit_types": condition}
+    # Until the migration finishes, legacy documents may only have credit_type
+    return {"$or": [{"credit_types": condition}, {"credit_type": condition}]}
+
+async def normalize_credit_types():
+    """Migrate certificates and self-reported credits to a non-empty credit_types array"""
+    global credit_types_normalized
+    
+    def migrate(collection, legacy_field: bool):
+        async def migrate_batch(docs):
+            updates = []
+            for doc in docs:
+                current = {"credit_types": doc.get("credit_types"), "credit_type": doc.get("credit_type")}
+                fields = normalize_credit_fields(dict(current)) if legacy_field else {"credit_types": credit_types_of(doc)}
+                if any(fields[k] != current[k] for k in fields):
+                    # Matching the old values skips documents edited since the batch was read
+                    updates.append(UpdateOne({"_id": doc["_id"], **current}, {"$set": fields}))
+            if updates:
+                await collection.bulk_write(updates, ordered=False)
+        return migrate_batch
+    
+    projection = {"credit_types": 1, "credit_type": 1}
+    await run_batched_migration(
+        f"{CREDIT_TYPES_MIGRATION}_certificates", db.certificates, migrate(db.certificates, True), projection=projection
+    )
+    await run_batched_migration(
+        f"{CREDIT_TYPES_MIGRATION}_self_reported", db.self_reported_credits,
+        migrate(db.self_reported_credits, False), projection=projection
+    )
+    credit_types_normalized = True
+
+# ============ CREDIT TYPE MATCHING ============
+
+# Phrases seen on certificates -> (credit type id, confidence). Phrases naming
+# the accrediting body and category are near-certain; a bare category, body
+# acronym or topic is weaker evidence.
+CREDIT_TYPE_ALIASES = {
+    # AMA
+    "ama pra category 1 credit": ("ama_cat1", 0.95),
+    "ama pra category 1": ("ama_cat1", 0.95),
+    "ama category 1": ("ama_cat1", 0.95),
+    "category 1 credit": ("ama_cat1", 0.75),
+    "category 1": ("ama_cat1", 0.7),
+    "ama pra category 2 credit": ("ama_cat2", 0.95),
+    "ama pra category 2": ("ama_cat2", 0.95),
+    "ama category 2": ("ama_cat2", 0.95),
+    "category 2": ("ama_cat2", 0.7),
+    # AOA
+    "aoa category 1 a": ("aoa_1a", 0.95),
+    "aoa category 1a": ("aoa_1a", 0.95),
+    "aoa 1a": ("aoa_1a", 0.9),
+    "aoa category 1 b": ("aoa_1b", 0.95),
+    "aoa category 1b": ("aoa_1b", 0.95),
+    "aoa 1b": ("aoa_1b", 0.9),
+    # NP/PA
+    "aanp contact hours": ("aanp_contact", 0.95),
+    "aanp contact": ("aanp_contact", 0.9),
+    "aanp": ("aanp_contact", 0.75),
+    "aapa category 1 cme": ("aapa_cat1", 0.95),
+    "aapa category 1": ("aapa_cat1", 0.95),
+    "aapa": ("aapa_cat1", 0.75),
+    "ancc contact hours": ("ancc_contact", 0.95),
+    "ancc contact": ("ancc_contact", 0.9),
+    "ancc": ("ancc_contact", 0.75),
+    "nursing contact hours": ("ancc_contact", 0.8),
+    "contact hours": ("ancc_contact", 0.65),
+    # Other
+    "pharmacology": ("pharmacology", 0.8),
+    "pharmacotherapeutics": ("pharmacology", 0.8),
+    "maintenance of certification": ("moc", 0.9),
+    "moc": ("moc", 0.85),
+    "moc part ii": ("moc", 0.9),
+    "self assessment": ("self_assessment", 0.85),
+    "medical ethics": ("ethics", 0.9),
+    "ethics": ("ethics", 0.75),
+    "pain management": ("pain_mgmt", 0.85),
+    "opioid": ("pain_mgmt", 0.6),
+    "opioid prescribing": ("pain_mgmt", 0.7),
+    "cne": ("cne", 0.85),
+    "continuing nursing education": ("cne", 0.9),
+    "continuing nursing": ("cne", 0.85),
+    "cultural competency": ("cultural", 0.85),
+}
+CREDIT_TYPE_NAME_CONFIDENCE = 0.95
+# Matches below this are reported but not applied to the certificate
+CREDIT_TYPE_MIN_CONFIDENCE = 0.6
+CREDIT_TYPE_SEPARATORS = re.compile(r"[^a-z0-9]+")
+
+def normalize_credit_text(text: Any) -> str:
+    """Lowercase and collapse punctuation, so "1-A", "1 A" and "Self-Assessment" compare equal"""
+    return CREDIT_TYPE_SEPARATORS.sub(" ", str(text or "").lower()).strip()
+
+def trie_regex(phrases) -> str:
+    """A regex matching any of phrases, factored into a prefix trie.
+
+    The engine branches once per character instead of trying every phrase at
+    every position, and as continuations are tried before a phrase is allowed
+    to end, the longest phrase at a position wins.
+    """
+    trie: Dict[str, Any] = {}
+    for phrase in phrases:
+        node = trie
+        for char in phrase:
+            node = node.setdefault(char, {})
+        node[""] = True
+    
+    def build(node) -> str:
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else f"(?:{'|'.join(branches)})"
+        return f"(?:{body})?" if "" in node else body
+    
+    return build(trie)
+
+class CreditTypeMatcher:
+    """Finds every known credit type phrase in a text with one compiled regex.
+
+    At each position the most specific phrase wins ("aapa category 1" over
+    "category 1"), independent of how the phrase table is ordered.
+    """
+    def __init__(self, phrases: Dict[str, tuple]):
+        self.phrases = {}
+        for phrase, (credit_type_id, confidence) in phrases.items():
+            key = normalize_credit_text(phrase)
+            if key and confidence > self.phrases.get(key, (None, -1))[1]:
+                self.phrases[key] = (credit_type_id, confidence)
+        # Normalized text is words separated by single spaces, so phrases can only start at a space
+        self.pattern = re.compile(rf"(?:^| )({trie_regex(self.phrases)})(?= |$)")
+
+    def match(self, text: Any) -> List[Dict[str, Any]]:
+        """All credit types mentioned in text, most confident first"""
+        normalized = normalize_credit_text(text)
+        found = {}
+        for phrase in self.pattern.findall(normalized):
+            credit_type_id, confidence = self.phrases[phrase]
+            if phrase == normalized:
+                confidence = 1.0  # The whole text is a known phrase
+            if confidence > found.get(credit_type_id, {}).get("confidence", -1):
+                found[credit_type_id] = {
+                    "credit_type_id": credit_type_id,
+                    "confidence": confidence,
+                    "matched": phrase
+                }
+        return sorted(found.values(), key=lambda match: -match["confidence"])
+
+def standard_credit_type_phrases() -> Dict[str, tuple]:
+    phrases = dict(CREDIT_TYPE_ALIASES)
+    for types in CME_TYPES.values():
+        for credit_type in types:
+            phrases[credit_type["name"]] = (credit_type["id"], CREDIT_TYPE_NAME_CONFIDENCE)
+            phrases[credit_type["id"]] = (credit_type["id"], CREDIT_TYPE_NAME_CONFIDENCE)
+    return phrases
+
+STANDARD_CREDIT_TYPE_MATCHER = CreditTypeMatcher(standard_credit_type_phrases())
+
+@functools.lru_cache(maxsize=256)
+def credit_type_matcher_for(custom_types: tuple) -> CreditTypeMatcher:
+    """Matcher including a user's custom types, given as sorted (name, id) pairs"""
+    if not custom_types:
+        return STANDARD_CREDIT_TYPE_MATCHER
+    phrases = standard_credit_type_phrases()
+    for name, credit_type_id in custom_types:
+        phrases[name] = (credit_type_id, CREDIT_TYPE_NAME_CONFIDENCE)
+    return CreditTypeMatcher(phrases)
+
+async def user_credit_type_matcher(user_id: Optional[str]) -> CreditTypeMatcher:
+    if not user_id:
+        return STANDARD_CREDIT_TYPE_MATCHER
+    custom_types = await db.custom_credit_types.find(
+        {"user_id": user_id},
+        {"_id": 0, "name": 1, "credit_type_id": 1}
+    ).to_list(100)
+    return credit_type_matcher_for(tuple(sorted((ct["name"], ct["credit_type_id"]) for ct in custom_types)))
+
+def matched_credit_type_ids(matches: List[Dict[str, Any]]) -> List[str]:
+    return [m["credit_type_id"] for m in matches if m["confidence"] >= CREDIT_TYPE_MIN_CONFIDENCE]
+
+# ============ CREDIT LEDGER ============
+
+# One entry per certificate or self-reported credit, so requirement progress
+# and reports read a single collection instead of one per source
+LEDGER_SOURCES = {
+    "certificate": ("certificates", "certificate_id"),
+    "self_reported": ("self_reported_credits", "credit_id"),
+}
+# Source document fields a ledger entry is built from
+LEDGER_FIELDS = ["user_id", "credits", "credit_types", "credit_type", "completion_date", "provider", "subject"]
+MIGRATION_BATCH_SIZE = 500
+
+def ledger_entry(source: str, doc: Dict[str, Any]) -> Dict[str, Any]:
+    """Normalize a certificate or self-reported credit into a ledger entry"""
+    _, id_field = LEDGER_SOURCES[source]
+    completion_date = doc.get("completion_date") or ""
+    return {
+        "source": source,
+        "source_id": doc[id_field],
+        "user_id": doc["user_id"],
+        "credits": doc.get("credits") or 0,
+        "credit_types": credit_types_of(doc),
+        "completion_date": completion_date,
+        "year": int(completion_date[:4]) if completion_date[:4].isdigit() else None,
+        "provider": doc.get("provider"),
+        "subject": doc.get("subject")
+    }
+
+async def upsert_ledger_entry(source: str, doc: Dict[str, Any]):
+    """Write a credit document's ledger entry; call after every insert or update"""
+    entry = ledger_entry(source, doc)
+    await db.credit_ledger.update_one(
+        {"source": source, "source_id": entry["source_id"]},
+        {"$set": entry},
+        upsert=True
+    )
+
+async def upsert_ledger_entries(source: str, docs: List[Dict[str, Any]]):
+    """Write ledger entries for a batch of credit documents in one round trip"""
+    if not docs:
+        return
+    await db.credit_ledger.bulk_write([
+        UpdateOne(
+            {"source": source, "source_id": entry["source_id"]},
+            {"$set": entry},
+            upsert=True
+        )
+        for entry in (ledger_entry(source, doc) for doc in docs)
+    ], ordered=False)
+
+async def remove_ledger_entry(source: str, source_id: str):
+    await db.credit_ledger.delete_one({"source": source, "source_id": source_id})
+
+async def ledger_breakdown(match: Dict[str, Any]) -> Dict[Optional[int], Dict[str, Any]]:
+    """Per-year totals and per-credit-type sums from the ledger in one aggregation.
+
+    An entry with several credit types counts toward each of them, but only
+    once toward the year's totals.
+    """
+    rows = await db.credit_ledger.aggregate([
+        {"$match": match},
+        {"$unwind": {"path": "$credit_types", "includeArrayIndex": "type_index"}},
+        {"$group": {
+            "_id": {"year": "$year", "credit_type": "$credit_types"},
+            "credits": {"$sum": "$credits"},
+            "count": {"$sum": 1},
+            "total_credits": {"$sum": {"$cond": [{"$eq": ["$type_index", 0]}, "$credits", 0]}},
+            "certificates": {"$sum": {"$cond": [
+                {"$and": [{"$eq": ["$type_index", 0]}, {"$eq": ["$source", "certificate"]}]}, 1, 0
+            ]}},
+            "self_reported": {"$sum": {"$cond": [
+                {"$and": [{"$eq": ["$type_index", 0]}, {"$eq": ["$source", "self_reported"]}]}, 1, 0
+            ]}}
+        }},
+        {"$sort": {"_id.year": 1, "credits": -1}}
+    ]).to_list(None)
+    
+    years = {}
+    for row in rows:
+        year = years.setdefault(row["_id"]["year"], {
+            "total_credits": 0,
+            "total_certificates": 0,
+            "total_self_reported": 0,
+            "by_credit_type": {}
+        })
+        year["total_credits"] += row["total_credits"]
+        year["total_certificates"] += row["certificates"]
+        year["total_self_reported"] += row["self_reported"]
+        year["by_credit_type"][row["_id"]["credit_type"]] = {"credits": row["credits"], "count": row["count"]}
+    return years
+
+async def run_batched_migration(
+    name: str,
+    collection,
+    migrate_batch,
+    projection: Optional[Dict[str, Any]] = None,
+    batch_size: int = MIGRATION_BATCH_SIZE
+):
+    """Apply migrate_batch to every document of a collection in _id order.
+
+    Progress is checkpointed in the migrations collection after each batch,
+    so an interrupted run resumes where it stopped and a finished one is a no-op.
+    """
+    state = await db.migrations.find_one({"name": name}, {"_id": 0})
+    if state and state.get("completed_at"):
+        return
+    last_id = state.get("last_id") if state else None
+    
+    while True:
+        query = {"_id": {"$gt": last_id}} if last_id is not None else {}
+        batch = await collection.find(query, projection).sort("_id", 1).limit(batch_size).to_list(batch_size)
+        if not batch:
+            break
+        await migrate_batch(batch)
+        last_id = batch[-1]["_id"]
+        await db.migrations.update_one(
+            {"name": name},
+            {"$set": {"last_id": last_id, "updated_at": datetime.now(timezone.utc).isoformat()}, "$inc": {"processed": len(batch)}},
+            upsert=True
+        )
+    
+    await db.migrations.update_one(
+        {"name": name},
+        {"$set": {"completed_at": datetime.now(timezone.utc).isoformat()}},
+        upsert=True
+    )
+    logger.info(f"Migration {name} complete")
+
+async def backfill_credit_ledger():
+    """Create ledger entries for credits written before the ledger existed.
+
+    Requirement progress saved while the backfill ran was computed from a partial
+    ledger, so every requirement is recomputed once the ledger is complete.
+    """
+    for source, (collection_name, id_field) in LEDGER_SOURCES.items():
+        async def migrate_batch(docs, source=source):
+            await upsert_ledger_entries(source, docs)
+        await run_batched_migration(
+            f"credit_ledger_{source}",
+            db[collection_name],
+            migrate_batch,
+            projection={field: 1 for field in (id_field, *LEDGER_FIELDS)}
+        )
+    
+    async def recompute_batch(requirements):
+        for req in requirements:
+            await update_single_requirement_progress(req["user_id"], req["requirement_id"])
+    await run_batched_migration(
+        "credit_ledger_requirement_progress",
+        db.requirements,
+        recompute_batch,
+        projection={"requirement_id": 1, "user_id": 1}
+    )
+
+# ============ TRANSCRIPT RENDERING ============
+
+EXPORT_SPOOL_MAX_SIZE = 8 * 1024 * 1024  # Rendered exports larger than this spill to disk
+EXPORT_STREAM_CHUNK_SIZE = 64 * 1024
+
+PDF_TABLE_STYLE = [
+    ("BACKGROUND", (0, 0), (-1, 0), colors.HexColor("#4F46E5")),
+    ("TEXTCOLOR", (0, 0), (-1, 0), colors.white),
+    ("FONTNAME", (0, 0), (-1, 0), "Helvetica-Bold"),
+    ("FONTSIZE", (0, 0), (-1, -1), 8),
+    ("VALIGN", (0, 0), (-1, -1), "MIDDLE"),
+    ("LINEBELOW", (0, 0), (-1, -1), 0.25, colors.HexColor("#e2e8f0")),
+]
+
+PDF_CELL_FONT = "Helvetica"  # reportlab's table default
+PDF_CELL_FONT_SIZE = 8
+PDF_CELL_PADDING = 12  # reportlab's default 6pt left and right cell padding
+
+PDF_SUBTOTAL_STYLE = [
+    ("FONTNAME", (0, -1), (-1, -1), "Helvetica-Bold"),
+    ("BACKGROUND", (0, -1), (-1, -1), colors.HexColor("#f8fafc")),
+]
+
+class TranscriptHeader(BaseModel):
+    """Transcript-level values shared by every export format"""
+    user_name: str
+    user_email: str = ""
+    npi_number: Optional[str] = None
+    year: int
+    end_year: Optional[int] = None
+    total_certificates: int = 0
+    total_credits: float = 0
+    generated_at: datetime = Field(default_factory=datetime.now)
+
+    @property
+    def period(self) -> str:
+        """The year, or the year range for multi-year transcripts"""
+        if self.end_year and self.end_year != self.year:
+            return f"{self.year}–{self.end_year}"
+        return str(self.year)
+
+class TranscriptFilter(BaseModel):
+    """Which certificates a transcript covers: a year range plus optional filters"""
+    start_year: int
+    end_year: int
+    credit_types: List[str] = []
+    providers: List[str] = []
+    subjects: List[str] = []
+
+    @classmethod
+    def for_year(cls, year: int) -> "TranscriptFilter":
+        return cls(start_year=year, end_year=year)
+
+class TranscriptEntry(BaseModel):
+    """One certificate row as shown on every export format"""
+    certificate_id: str = ""
+    title: str = ""
+    provider: str = ""
+    credits: float = 0
+    credit_types: List[str] = []
+    credit_type: str = ""  # Display type; the legacy field when present
+    completion_date: str = ""
+    certificate_number: str = ""
+    subject: str = ""
+    accme_provider_number: str = ""
+    location: Optional[str] = None
+
+    @property
+    def primary_credit_type(self) -> str:
+        return self.credit_types[0] if self.credit_types else "unknown"
+
+    @classmethod
+    def from_certificate(cls, cert: Dict[str, Any]) -> "TranscriptEntry":
+        credit_types = cert.get("credit_types") or ([cert["credit_type"]] if cert.get("credit_type") else [])
+        # model_construct skips validation; exports can have tens of thousands of rows
+        return cls.model_construct(
+            certificate_id=cert.get("certificate_id") or "",
+            title=cert.get("title") or "",
+            provider=cert.get("provider") or "",
+            credits=cert.get("credits") or 0,
+            credit_types=credit_types,
+            credit_type=cert.get("credit_type") or (credit_types[0] if credit_types else ""),
+            completion_date=cert.get("completion_date") or "",
+            certificate_number=cert.get("certificate_number") or "",
+            subject=cert.get("subject") or "",
+            accme_provider_number=cert.get("accme_provider_number") or "",
+            location=cert.get("location")
+        )
+
+def fit_cell_text(value: Any, column_width: float) -> str:
+    """Stringify a value and shorten it to the width it has to print in within a table column"""
+    text = "" if value is None else str(value)
+    width = column_width - PDF_CELL_PADDING
+    if stringWidth(text, PDF_CELL_FONT, PDF_CELL_FONT_SIZE) <= width:
+        return text
+    # Longest prefix that still fits with the ellipsis
+    low, high = 0, len(text)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if stringWidth(text[:middle] + "…", PDF_CELL_FONT, PDF_CELL_FONT_SIZE) <= width:
+            low = middle
+        else:
+            high = middle - 1
+    return text[:low].rstrip() + "…"
+
+PDF_ROW_HEIGHT = 0.22*inch
+PDF_COLUMN_HEADERS = ["Title", "Provider", "Credits", "Date", "Certificate #"]
+PDF_COLUMN_WIDTHS = [2.8*inch, 1.9*inch, 0.6*inch, 0.8*inch, 0.9*inch]
+
+class FlowableStream(list):
+    """A story for doc.build that takes the next flowable from an iterator only once the
+    previous ones are laid out, so the document is never held in full"""
+    def __init__(self, flowables):
+        super().__init__()
+        self.pending = iter(flowables)
+
+    def __len__(self):
+        if not super().__len__():
+            flowable = next(self.pending, None)
+            if flowable is not None:
+                self.append(flowable)
+        return super().__len__()
+
+class StreamingTable(Flowable):
+    """A fixed-row-height table whose rows are pulled from an iterator a frame at a time.
+
+    It never fits whole, so the frame always splits it: each split takes as many
+    rows as fit, under the heading (first part only) and a repeated header row.
+    The last row of the iterator is styled with last_row_style.
+    """
+    def __init__(self, heading, header_row, rows, col_widths, style, last_row_style):
+        super().__init__()
+        self.heading = heading
+        self.header_row = header_row
+        self.rows = rows
+        self.col_widths = col_widths
+        self.style = style
+        self.last_row_style = last_row_style
+        self.buffer = []
+        self.exhausted = False
+
+    def wrap(self, availWidth, availHeight):
+        return sum(self.col_widths), availHeight + 1
+
+    def split(self, availWidth, availHeight):
+        used = 0
+        if self.heading is not None:
+            _, heading_height = self.heading.wrap(availWidth, availHeight)
+            used = self.heading.getSpaceBefore() + heading_height + self.heading.getSpaceAfter()
+        fit = int((availHeight - used) // PDF_ROW_HEIGHT) - 1  # Below the header row
+        if fit < 1:
+            return []
+        while len(self.buffer) <= fit and not self.exhausted:
+            try:
+                self.buffer.append(next(self.rows))
+            except StopIteration:
+                self.exhausted = True
+        rows = self.buffer[:fit]
+        last = self.exhausted and len(self.buffer) <= fit
+        parts = [] if self.heading is None else [self.heading]
+        parts.append(Table(
+            [self.header_row, *rows],
+            colWidths=self.col_widths,
+            rowHeights=[PDF_ROW_HEIGHT] * (len(rows) + 1),
+            hAlign="LEFT",
+            style=TableStyle(self.style + (self.last_row_style if last else []))
+        ))
+        if last:
+            return parts
+        # A new flowable for the rest, as the document marks ones it had to move to the next frame
+        rest = StreamingTable(None, self.header_row, self.rows, self.col_widths, self.style, self.last_row_style)
+        rest.buffer = self.buffer[fit:]
+        rest.exhausted = self.exhausted
+        return parts + [rest]
+
+def transcript_pdf_rows(entries: Iterable[TranscriptEntry]):
+    """Table rows for one credit type's certificates, ending with their subtotal"""
+    subtotal = 0
+    count = 0
+    for entry in entries:
+        subtotal += entry.credits
+        count += 1
+        yield [
+            fit_cell_text(entry.title, PDF_COLUMN_WIDTHS[0]),
+            fit_cell_text(entry.provider, PDF_COLUMN_WIDTHS[1]),
+            entry.credits,
+            entry.completion_date,
+            fit_cell_text(entry.certificate_number, PDF_COLUMN_WIDTHS[4]),
+        ]
+    yield [f"Subtotal ({count} certificates)", "", round(subtotal, 2), "", ""]
+
+def render_transcript_pdf(
+    header: TranscriptHeader,
+    by_credit_type: Dict[str, Dict[str, Any]],
+    certificates: Iterable[Dict[str, Any]],
+    out
+) -> None:
+    """Render the transcript PDF into a file object.
+
+    certificates must come ordered by primary credit type (transcript_cursor's
+    by_credit_type order); each type gets a table with a repeating header row and
+    a subtotal row. Rows are laid out a page at a time as they are read. Memory is
+    still O(n) in one respect: reportlab keeps each finished page's drawing
+    operations until the file is written, about 0.5 KiB per row. Runs in a
+    worker thread.
+    """
+    styles = getSampleStyleSheet()
+    doc = SimpleDocTemplate(
+        out,
+        pagesize=letter,
+        leftMargin=0.75*inch,
+        rightMargin=0.75*inch,
+        topMargin=0.75*inch,
+        bottomMargin=0.75*inch,
+        title="CME Transcript",
+        author=header.user_name
+    )
+    
+    def story():
+        yield Paragraph("CME Transcript", styles["Title"])
+        yield Paragraph(f"Name: {escape(header.user_name)}", styles["Normal"])
+        yield Paragraph(f"Year: {header.period}", styles["Normal"])
+        yield Paragraph(f"Total Credits: {header.total_credits}", styles["Normal"])
+        yield Paragraph(f"Total Certificates: {header.total_certificates}", styles["Normal"])
+        yield Spacer(1, 0.2*inch)
+        yield Paragraph("Credits by Type", styles["Heading2"])
+        
+        type_rows = [["Credit Type", "Credits", "Certificates"]]
+        for credit_type, data in by_credit_type.items():
+            type_rows.append([credit_type, data["credits"], data["count"]])
+        yield Table(type_rows, colWidths=[3*inch, 1.2*inch, 1.2*inch], repeatRows=1, hAlign="LEFT", style=TableStyle(PDF_TABLE_STYLE))
+        yield Spacer(1, 0.2*inch)
+        yield Paragraph("Certificates", styles["Heading2"])
+        
+        entries = (TranscriptEntry.from_certificate(cert) for cert in certificates)
+        # FlowableStream only asks for the next flowable once a group's table is used up,
+        # so groupby never skips rows the table has not read yet
+        for credit_type, group in itertools.groupby(entries, key=lambda entry: entry.primary_credit_type):
+            yield StreamingTable(
+                Paragraph(escape(credit_type), styles["Heading3"]),
+                PDF_COLUMN_HEADERS,
+                transcript_pdf_rows(group),
+                PDF_COLUMN_WIDTHS,
+                PDF_TABLE_STYLE,
+                PDF_SUBTOTAL_STYLE
+            )
+            yield Spacer(1, 0.15*inch)
+    
+    doc.build(FlowableStream(story()))
+
+async def render_in_worker(render, *args) -> tempfile.SpooledTemporaryFile:
+    """Run a blocking renderer in a worker thread, spooling its output to a temp file"""
+    output = tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_MAX_SIZE)
+    try:
+        await asyncio.to_thread(render, *args, output)
+    except Exception:
+        output.close()
+        raise
+    output.seek(0)
+    return output
+
+def iter_file_chunks(f, chunk_size: int = EXPORT_STREAM_CHUNK_SIZE):
+    """Yield a file in chunks for StreamingResponse, closing it when done"""
+    try:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        f.close()
+
+EXPORT_CURSOR_BATCH_SIZE = 500
+XLSX_MEDIA_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+async def render_cursor_in_worker(render, cursor, *args, progress=None) -> tempfile.SpooledTemporaryFile:
+    """Run a blocking renderer in a worker thread, feeding it documents from a Mongo cursor.
+
+    Documents are handed over in batches through a bounded queue, so only a
+    few batches are held in memory however large the result set is. The
+    renderer receives an iterator of documents before the output file.
+    progress, when given, is awaited with the running document count after
+    each batch.
+    """
+    batches = queue.Queue(maxsize=4)
+    output = tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_MAX_SIZE)
+    
+    def documents():
+        while True:
+            batch = batches.get()
+            if batch is None:
+                return
+            yield from batch
+    
+    worker = asyncio.ensure_future(asyncio.to_thread(render, *args, documents(), output))
+    
+    async def feed(item):
+        while True:
+            try:
+                batches.put_nowait(item)
+                return
+            except queue.Full:
+                if worker.done():
+                    return
+                await asyncio.sleep(0.005)
+    
+    try:
+        try:
+            batch = []
+            done = 0
+            async for doc in cursor:
+                batch.append(doc)
+                if len(batch) >= EXPORT_CURSOR_BATCH_SIZE:
+                    await feed(batch)
+                    done += len(batch)
+                    batch = []
+                    if progress:
+                        await progress(done)
+            if batch:
+                await feed(batch)
+                if progress:
+                    await progress(done + len(batch))
+        finally:
+            await feed(None)
+            await worker
+    except BaseException:
+        output.close()
+        raise
+    output.seek(0)
+    return output
+
+def transcript_query(user_id: str, filters: TranscriptFilter) -> Dict[str, Any]:
+    """Match a user's certificates completed in the filter's year range"""
+    # completion_date is YYYY-MM-DD, so a string range covers whole years
+    query: Dict[str, Any] = {
+        "user_id": user_id,
+        "completion_date": {"$gte": str(filters.start_year), "$lt": str(filters.end_year + 1)}
+    }
+    if filters.credit_types:
+        query.update(credit_types_predicate(filters.credit_types))
+    if filters.providers:
+        query["provider"] = {"$in": [re.compile(re.escape(p), re.IGNORECASE) for p in filters.providers]}
+    if filters.subjects:
+        query["subject"] = {"$in": [re.compile(re.escape(s), re.IGNORECASE) for s in filters.subjects]}
+    return query
+
+def make_transcript_filter(
+    start_year: Optional[int] = None,
+    end_year: Optional[int] = None,
+    credit_types: Optional[List[str]] = None,
+    providers: Optional[List[str]] = None,
+    subjects: Optional[List[str]] = None
+) -> TranscriptFilter:
+    """Build a transcript filter, defaulting to the current year"""
+    end_year = end_year or start_year or datetime.now().year
+    start_year = start_year or end_year
+    if start_year > end_year:
+        raise HTTPException(status_code=400, detail="start_year must not be after end_year")
+    return TranscriptFilter(
+        start_year=start_year,
+        end_year=end_year,
+        credit_types=credit_types or [],
+        providers=providers or [],
+        subjects=subjects or []
+    )
+
+def transcript_filter_params(
+    start_year: Optional[int] = None,
+    end_year: Optional[int] = None,
+    credit_types: Optional[str] = None,
+    providers: Optional[str] = None,
+    subjects: Optional[str] = None
+) -> TranscriptFilter:
+    """Dependency reading a transcript filter from comma-separated query parameters"""
+    def split(value: Optional[str]) -> List[str]:
+        return [v.strip() for v in value.split(",") if v.strip()] if value else []
+    return make_transcript_filter(start_year, end_year, split(credit_types), split(providers), split(subjects))
+
+def transcript_cursor(query: Dict[str, Any], by_credit_type: bool = False):
+    """Certificates for an export, newest first, read in cursor batches.
+
+    by_credit_type orders them by primary credit type first, for exports grouped
+    by it; credit_type mirrors credit_types[0] (see normalize_credit_fields).
+    """
+    sort = [("completion_date", -1), ("certificate_id", -1)]
+    if by_credit_type:
+        sort.insert(0, ("credit_type", 1))
+    return db.certificates.find(
+        query,
+        build_projection("certificates", "export")
+    ).sort(sort).batch_size(EXPORT_CURSOR_BATCH_SIZE)
+
+async def transcript_credit_type_totals(query: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+    """Credits and certificate counts per credit type; a certificate counts toward each of its types"""
+    rows = await db.certificates.aggregate([
+        {"$match": query},
+        {"$project": {"credits": 1, "credit_types": {"$cond": [
+            {"$gt": [{"$size": {"$ifNull": ["$credit_types", []]}}, 0]},
+            "$credit_types",
+            [{"$ifNull": ["$credit_type", "unknown"]}]
+        ]}}},
+        {"$unwind": "$credit_types"},
+        {"$group": {"_id": "$credit_types", "credits": {"$sum": "$credits"}, "count": {"$sum": 1}}},
+        {"$sort": {"_id": 1}}
+    ]).to_list(None)
+    return {row["_id"]: {"credits": row["credits"], "count": row["count"]} for row in rows}
+
+async def get_transcript_header(user: User, filters: TranscriptFilter, query: Dict[str, Any]) -> TranscriptHeader:
+    """Build the transcript header, totalling the matching certificates in one aggregation"""
+    result = await db.certificates.aggregate([
+        {"$match": query},
+        {"$group": {"_id": None, "total_credits": {"$sum": "$credits"}, "count": {"$sum": 1}}}
+    ]).to_list(1)
+    return TranscriptHeader(
+        user_name=user.name,
+        user_email=user.email,
+        npi_number=user.npi_number,
+        year=filters.start_year,
+        end_year=filters.end_year,
+        total_certificates=result[0]["count"] if result else 0,
+        total_credits=result[0]["total_credits"] if result else 0
+    )
+
+def header_cells(ws, headers: List[str]) -> List[Cell]:
+    """Bold, centered header cells for a write-only worksheet"""
+    cells = []
+    for header in headers:
+        cell = WriteOnlyCell(ws, value=header)
+        cell.font = Font(bold=True)
+        cell.alignment = Alignment(horizontal='center')
+        cells.append(cell)
+    return cells
+
+def title_cell(ws, value: str) -> Cell:
+    cell = WriteOnlyCell(ws, value=value)
+    cell.font = Font(bold=True, size=16)
+    return cell
+
+def render_transcript_excel(header: TranscriptHeader, certs, out) -> None:
+    """Render the transcript workbook in write-only mode (runs in a worker thread)"""
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet("CME Transcript")
+    
+    # Column widths must be set before the first row in write-only mode
+    for col, width in enumerate([40, 30, 10, 20, 15, 15], 1):
+        ws.column_dimensions[get_column_letter(col)].width = width
+    
+    ws.append([title_cell(ws, "CME Transcript")])
+    ws.append([f"Name: {header.user_name}"])
+    ws.append([f"Year: {header.period}"])
+    ws.append([f"Total Credits: {header.total_credits}"])
+    ws.append([])
+    ws.append(header_cells(ws, ["Title", "Provider", "Credits", "Credit Type", "Completion Date", "Certificate #"]))
+    
+    for entry in map(TranscriptEntry.from_certificate, certs):
+        ws.append([
+            entry.title,
+            entry.provider,
+            entry.credits,
+            entry.credit_type,
+            entry.completion_date,
+            entry.certificate_number
+        ])
+    
+    wb.save(out)
+
+PARS_HEADERS = [
+    "Activity ID",
+    "Activity Title",
+    "Activity Type",
+    "Provider/Joint Provider",
+    "ACCME Provider Number",
+    "Credit Type",
+    "Credits Claimed",
+    "Activity Date",
+    "Completion Date",
+    "Certificate Number",
+    "Subject/Topic",
+    "Delivery Format"
+]
+
+# Certificate field rendered in each PARS column (None for derived columns)
+PARS_COLUMN_FIELDS = [
+    "certificate_id", "title", None, "provider", "accme_provider_number", "credit_type",
+    "credits", "completion_date", "completion_date", "certificate_number", "subject", None
+]
+
+PARS_MAX_COLUMN_WIDTH = 50
+
+def pars_credit_type(credit_type: str) -> str:
+    """Map a credit type to its ACCME category label"""
+    if credit_type in ['ama_cat1', 'AMA PRA Category 1']:
+        return 'AMA PRA Category 1 Credit(s)'
+    if credit_type in ['ama_cat2', 'AMA PRA Category 2']:
+        return 'AMA PRA Category 2 Credit(s)'
+    return credit_type
+
+async def get_pars_column_widths(query: Dict[str, Any]) -> List[float]:
+    """Size PARS activity columns from the longest stored value of each field.
+
+    Write-only worksheets emit column widths before any row, so the widths
+    come from one aggregation instead of a second pass over the cells.
+    """
+    fields = sorted({f for f in PARS_COLUMN_FIELDS if f})
+    group = {"_id": None}
+    for field in fields:
+        group[field] = {"$max": {"$strLenCP": {"$toString": {"$ifNull": [f"${field}", ""]}}}}
+    result = await db.certificates.aggregate([{"$match": query}, {"$group": group}]).to_list(1)
+    lengths = result[0] if result else {}
+    
+    derived = {2: len("Course"), 11: len("Enduring Material")}
+    widths = []
+    for idx, (header, field) in enumerate(zip(PARS_HEADERS, PARS_COLUMN_FIELDS)):
+        value_length = (lengths.get(field) or 0) if field else derived[idx]
+        if field == "credit_type" and value_length:
+            # Stored ids may be rendered as the longer ACCME labels
+            value_length = max(value_length, len(pars_credit_type('ama_cat1')))
+        widths.append(min(max(len(header), value_length) + 2, PARS_MAX_COLUMN_WIDTH))
+    return widths
+
+def render_pars_workbook(header: TranscriptHeader, activity_widths: List[float], certs, out) -> None:
+    """Render the ACCME PARS workbook in write-only mode (runs in a worker thread).
+
+    Activities stream into their sheet while the summary totals accumulate;
+    the summary sheet is written last but stays first in the workbook.
+    """
+    wb = openpyxl.Workbook(write_only=True)
+    ws_summary = wb.create_sheet("PARS Summary")
+    ws_activities = wb.create_sheet("PARS Activities")
+    
+    for col, width in enumerate(activity_widths, 1):
+        ws_activities.column_dimensions[get_column_letter(col)].width = width
+    ws_activities.append(header_cells(ws_activities, PARS_HEADERS))
+    
+    total_certificates = 0
+    total_credits = 0
+    by_type: Dict[str, float] = {}
+    
+    for entry in map(TranscriptEntry.from_certificate, certs):
+        total_certificates += 1
+        total_credits += entry.credits
+        
+        for credit_type in entry.credit_types or ["unknown"]:
+            by_type[credit_type] = by_type.get(credit_type, 0) + entry.credits
+        
+        ws_activities.append([
+            entry.certificate_id,
+            entry.title,
+            "Course",  # Default activity type
+            entry.provider,
+            entry.accme_provider_number,
+            pars_credit_type(entry.credit_type),
+            entry.credits,
+            entry.completion_date,
+            entry.completion_date,
+            entry.certificate_number,
+            entry.subject,
+            'Live' if entry.location else 'Enduring Material'
+        ])
+    
+    summary_rows = [
+        [title_cell(ws_summary, "ACCME PARS Activity Report")],
+        [f"Reporting Year: {header.period}"],
+        [f"Generated: {header.generated_at.strftime('%Y-%m-%d %H:%M:%S')}"],
+        [f"Physician Name: {header.user_name}"],
+        [f"NPI Number: {header.npi_number or 'Not Provided'}"],
+        [],
+        header_cells(ws_summary, ["Summary Statistics"]),
+        [f"Total CME Activities: {total_certificates}"],
+        [f"Total Credits: {total_credits}"],
+        [],
+        header_cells(ws_summary, ["Credits by ACCME Category"]),
+    ]
+    summary_rows += [[ctype, credits] for ctype, credits in by_type.items()]
+    
+    # Summary values are all known now, so size its columns while building the rows
+    summary_widths: Dict[int, int] = {}
+    for row in summary_rows:
+        for col, value in enumerate(row, 1):
+            value = value.value if isinstance(value, Cell) else value
+            summary_widths[col] = max(summary_widths.get(col, 0), len(str(value)))
+    for col, length in summary_widths.items():
+        ws_summary.column_dimensions[get_column_letter(col)].width = min(length + 2, PARS_MAX_COLUMN_WIDTH)
+    for row in summary_rows:
+        ws_summary.append(row)
+    
+    wb.save(out)
+
+# Compiled once at import; generate_async() streams the rendered chunks
+template_env = Environment(
+    loader=FileSystemLoader(ROOT_DIR / "templates"),
+    autoescape=select_autoescape(["html"]),
+    enable_async=True,
+    auto_reload=False
+)
+TRANSCRIPT_HTML_TEMPLATE = template_env.get_template("transcript.html")
+
+def self_reported_transcript_query(user_id: str, filters: TranscriptFilter) -> Optional[Dict[str, Any]]:
+    """Match self-reported credits for a transcript filter, or None if none can match"""
+    # Self-reported activities have no provider or subject to filter on
+    if filters.providers or filters.subjects:
+        return None
+    query: Dict[str, Any] = {
+        "user_id": user_id,
+        "completion_date": {"$gte": str(filters.start_year), "$lt": str(filters.end_year + 1)}
+    }
+    if filters.credit_types:
+        query["credit_types"] = {"$in": filters.credit_types}
+    return query
+
+TRANSCRIPT_ROW_FIELDS = [
+    "source", "id", "title", "provider", "activity_type", "credits",
+    "credit_types", "completion_date", "certificate_number", "subject"
+]
+TRANSCRIPT_CSV_HEADERS = [
+    "Source", "ID", "Title", "Provider", "Activity Type", "Credits",
+    "Credit Types", "Completion Date", "Certificate #", "Subject"
+]
+
+def certificate_transcript_row(cert: Dict[str, Any]) -> Dict[str, Any]:
+    entry = TranscriptEntry.from_certificate(cert)
+    return {
+        "source": "certificate",
+        "id": entry.certificate_id,
+        "title": entry.title,
+        "provider": entry.provider,
+        "activity_type": None,
+        "credits": entry.credits,
+        "credit_types": entry.credit_types,
+        "completion_date": entry.completion_date,
+        "certificate_number": entry.certificate_number,
+        "subject": entry.subject
+    }
+
+def self_reported_transcript_row(credit: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "source": "self_reported",
+        "id": credit.get("credit_id") or "",
+        "title": credit.get("title") or "",
+        "provider": None,
+        "activity_type": credit.get("activity_type"),
+        "credits": credit.get("credits") or 0,
+        "credit_types": credit.get("credit_types") or [],
+        "completion_date": credit.get("completion_date") or "",
+        "certificate_number": None,
+        "subject": None
+    }
+
+async def iter_transcript_rows(user_id: str, filters: TranscriptFilter):
+    """Yield certificates and self-reported credits as one stream, newest first.
+
+    Both collections are read through index-ordered cursors and merged as
+    they go, so nothing is sorted or buffered in memory.
+    """
+    certificates = transcript_cursor(transcript_query(user_id, filters))
+    credit_query = self_reported_transcript_query(user_id, filters)
+    credits = None
+    if credit_query is not None:
+        credits = db.self_reported_credits.find(
+            credit_query,
+            build_projection("self_reported_credits", "export")
+        ).sort([("completion_date", -1), ("credit_id", -1)]).batch_size(EXPORT_CURSOR_BATCH_SIZE)
+    
+    cert = await anext(certificates, None)
+    credit = await anext(credits, None) if credits is not None else None
+    while cert is not None or credit is not None:
+        if credit is None or (cert is not None and (cert.get("completion_date") or "") >= (credit.get("completion_date") or "")):
+            yield certificate_transcript_row(cert)
+            cert = await anext(certificates, None)
+        else:
+            yield self_reported_transcript_row(credit)
+            credit = await anext(credits, None)
+
+async def iter_transcript_csv(rows):
+    """Encode transcript rows as CSV, yielding the header row straight away"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(TRANSCRIPT_CSV_HEADERS)
+    yield buffer.getvalue()
+    buffer.seek(0)
+    buffer.truncate()
+    async for row in rows:
+        writer.writerow([
+            ";".join(row[field]) if field == "credit_types" else row[field]
+            for field in TRANSCRIPT_ROW_FIELDS
+        ])
+        if buffer.tell() >= EXPORT_STREAM_CHUNK_SIZE:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+async def iter_transcript_ndjson(rows):
+    """Encode transcript rows as newline-delimited JSON"""
+    chunk = []
+    size = 0
+    async for row in rows:
+        line = json.dumps(row) + "\n"
+        chunk.append(line)
+        size += len(line)
+        if size >= EXPORT_STREAM_CHUNK_SIZE:
+            yield "".join(chunk)
+            chunk = []
+            size = 0
+    if chunk:
+        yield "".join(chunk)
+
+async def iter_transcript_entries(cursor, progress=None):
+    """Map certificate documents from a Mongo cursor to transcript entries"""
+    done = 0
+    async for cert in cursor:
+        yield TranscriptEntry.from_certificate(cert)
+        done += 1
+        if progress and done % EXPORT_CURSOR_BATCH_SIZE == 0:
+            await progress(done)
+
+# ============ BLOB STORE ============
+
+BLOB_STREAM_CHUNK_SIZE = 256 * 1024
+
+def decode_data_url(data_url: str) -> tuple:
+    """Split a base64 data: URL into its bytes and media type"""
+    header, _, data = data_url.partition(",")
+    return base64.b64decode(data), header[len("data:"):].split(";")[0] or "application/octet-stream"
+
+def parse_range_header(range_header: Optional[str], size: int) -> Optional[tuple]:
+    """Parse a single-range "bytes=start-end" header into an inclusive (start, end).
+
+    Returns None when there is no usable Range header; raises 416 when the
+    range cannot be satisfied.
+    """
+    if not range_header or not range_header.startswith("bytes=") or "," in range_header:
+        return None
+    start_text, _, end_text = range_header[len("bytes="):].strip().partition("-")
+    try:
+        if start_text:
+            start = int(start_text)
+            end = int(end_text) if end_text else size - 1
+        else:
+            # Suffix range: the last N bytes
+            start = max(size - int(end_text), 0)
+            end = size - 1
+    except ValueError:
+        return None
+    end = min(end, size - 1)
+    if start > end or start >= size:
+        raise HTTPException(
+            status_code=416,
+            detail="Requested range not satisfiable",
+            headers={"Content-Range": f"bytes */{size}"}
+        )
+    return start, end
+
+async def iter_blob_range(grid_out, start: int, length: int):
+    """Yield length bytes of a GridFS file starting at start"""
+    grid_out.seek(start)
+    remaining = length
+    while remaining > 0:
+        chunk = await grid_out.read(min(BLOB_STREAM_CHUNK_SIZE, remaining))
+        if not chunk:
+            break
+        remaining -= len(chunk)
+        yield chunk
+
+async def blob_response(
+    request: Request,
+    bucket: AsyncIOMotorGridFSBucket,
+    blob_id,
+    media_type: str,
+    headers: Optional[Dict[str, str]] = None,
+    etag: Optional[str] = None
+) -> Response:
+    """Serve a GridFS blob with Content-Length and single-range support.
+
+    With an etag, If-None-Match is answered with 304 and a Range request only
+    gets a partial response while its If-Range still matches.
+    """
+    headers = {"Accept-Ranges": "bytes", **(headers or {})}
+    range_header = request.headers.get("range")
+    if etag:
+        headers["ETag"] = etag
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match and (if_none_match.strip() == "*" or etag in [t.strip() for t in if_none_match.split(",")]):
+            return Response(status_code=304, headers=headers)
+        if_range = request.headers.get("if-range")
+        if if_range and if_range.strip() != etag:
+            range_header = None
+    
+    grid_out = await bucket.open_download_stream(blob_id)
+    size = grid_out.length
+    
+    byte_range = parse_range_header(range_header, size)
+    if byte_range:
+        start, end = byte_range
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+        headers["Content-Length"] = str(end - start + 1)
+        return StreamingResponse(
+            iter_blob_range(grid_out, start, end - start + 1),
+            status_code=206,
+            media_type=media_type,
+            headers=headers
+        )
+    
+    headers["Content-Length"] = str(size)
+    return StreamingResponse(iter_blob_range(grid_out, 0, size), media_type=media_type, headers=headers)
+
+# ============ CERTIFICATE RENDITIONS ============
+
+# Rendition kind -> (longest edge in pixels, WebP quality)
+RENDITION_SIZES = {"thumbnail": (160, 70), "preview": (1024, 80)}
+RENDITION_PDF_DPI = 100
+RENDITION_MIGRATION_BATCH_SIZE = 20
+RENDITION_STORE_ATTEMPTS = 20
+# Renditions are stored once per content hash, so identical scans share blobs;
+# metadata.refs counts the certificates using each one
+rendition_bucket = AsyncIOMotorGridFSBucket(db, bucket_name="renditions")
+rendition_semaphore = asyncio.Semaphore(int(os.environ.get("RENDITION_CONCURRENCY", "2")))
+background_tasks = set()
+
+def run_in_background(coro):
+    """Start a fire-and-forget task, holding a reference until it finishes"""
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+def certificate_rendition_urls(certificate_id: str) -> Dict[str, str]:
+    return {
+        "thumbnail_url": f"/api/certificates/{certificate_id}/renditions/thumbnail",
+        "preview_url": f"/api/certificates/{certificate_id}/renditions/preview",
+    }
+
+def open_certificate_image(content: bytes, mime_type: str, min_size: int) -> Image.Image:
+    """Decode a certificate image, or rasterize a PDF's first page, as upright RGB.
+
+    JPEGs are decoded at a reduced scale when that still leaves at least
+    min_size pixels on each edge.
+    """
+    if mime_type == "application/pdf":
+        from pdf2image import convert_from_bytes
+        pages = convert_from_bytes(content, dpi=RENDITION_PDF_DPI, first_page=1, last_page=1)
+        if not pages:
+            raise ValueError("PDF has no pages")
+        image = pages[0]
+    else:
+        image = Image.open(io.BytesIO(content))
+        image.draft("RGB", (min_size, min_size))
+        image = ImageOps.exif_transpose(image)
+    return image.convert("RGB")
+
+def render_certificate_renditions(content: bytes, mime_type: str) -> Dict[str, bytes]:
+    """Render the WebP renditions of a certificate image, or of a PDF's first page"""
+    largest = max(size for size, _ in RENDITION_SIZES.values())
+    image = open_certificate_image(content, mime_type, largest)
+    
+    renditions = {}
+    for kind, (max_edge, quality) in sorted(RENDITION_SIZES.items(), key=lambda item: -item[1][0]):
+        # Each smaller rendition is resampled from the previous one
+        image.thumbnail((max_edge, max_edge), Image.LANCZOS)
+        output = io.BytesIO()
+        image.save(output, format="WEBP", quality=quality, method=4)
+        renditions[kind] = output.getvalue()
+    return renditions
+
+async def store_rendition(data: bytes) -> str:
+    """Store a rendition under its SHA-256, or take a reference to the stored copy, returning the digest"""
+    digest = hashlib.sha256(data).hexdigest()
+    for _ in range(RENDITION_STORE_ATTEMPTS):
+        result = await db["renditions.files"].update_one(
+            {"_id": digest, "metadata.deleting": {"$ne": True}},
+            {"$inc": {"metadata.refs": 1}}
+        )
+        if result.matched_count:
+            return digest
+        if await db["renditions.files"].find_one({"_id": digest}, {"_id": 1}) is None:
+            try:
+                await rendition_bucket.upload_from_stream_with_id(
+                    digest, f"{digest}.webp", data, metadata={"content_type": "image/webp", "refs": 1}
+                )
+                return digest
+            except DuplicateKeyError:
+                pass  # Being stored concurrently for an identical image
+        # Still being uploaded, or being deleted by release_renditions; look again shortly
+        await asyncio.sleep(0.05)
+    raise RuntimeError(f"Could not store rendition {digest}")
+
+async def release_renditions(digests):
+    """Drop one reference to each rendition, deleting those no certificate uses any more.
+
+    A rendition is deleted only once its count has been decremented to zero and
+    it is then claimed with a conditional update, so a store_rendition that took
+    a reference in between keeps it alive. Its chunks go before its files
+    document, so a concurrent store waits rather than reusing a half-deleted blob.
+    """
+    for digest in digests:
+        released = await db["renditions.files"].find_one_and_update(
+            {"_id": digest},
+            {"$inc": {"metadata.refs": -1}},
+            projection={"metadata.refs": 1},
+            return_document=ReturnDocument.AFTER
+        )
+        if released is None or released["metadata"]["refs"] > 0:
+            continue
+        claimed = await db["renditions.files"].update_one(
+            {"_id": digest, "metadata.refs": {"$lte": 0}, "metadata.deleting": {"$ne": True}},
+            {"$set": {"metadata.deleting": True}}
+        )
+        if claimed.modified_count:
+            await db["renditions.chunks"].delete_many({"files_id": digest})
+            await db["renditions.files"].delete_one({"_id": digest})
+
+async def create_certificate_renditions(certificate_id: str, content: bytes, mime_type: str) -> Dict[str, str]:
+    """Render and store a certificate's renditions, recording their digests on the certificate.
+
+    A certificate whose image cannot be rendered gets an empty renditions
+    map, so it is not retried on every request.
+    """
+    renditions = {}
+    try:
+        async with rendition_semaphore:
+            rendered = await asyncio.to_thread(render_certificate_renditions, content, mime_type)
+        for kind, data in rendered.items():
+            renditions[kind] = await store_rendition(data)
+    except Exception as e:
+        logger.warning(f"Rendering previews for {certificate_id} failed: {e}")
+        await release_renditions(renditions.values())
+        renditions = {}
+    result = await db.certificates.update_one(
+        {"certificate_id": certificate_id, "renditions": {"$exists": False}},
+        {"$set": {"renditions": renditions, **certificate_rendition_urls(certificate_id)}}
+    )
+    if result.matched_count == 0:
+        # Rendered concurrently, merged or deleted meanwhile; keep whatever is recorded
+        await release_renditions(renditions.values())
+        cert = await db.certificates.find_one({"certificate_id": certificate_id}, {"_id": 0, "renditions": 1})
+        renditions = (cert or {}).get("renditions") or {}
+    return renditions
+
+@api_router.get("/certificates/{certificate_id}/renditions/{kind}")
+async def get_certificate_rendition(
+    certificate_id: str,
+    kind: str,
+    request: Request,
+    user: User = Depends(get_current_user)
+):
+    """Serve a certificate thumbnail or preview as WebP"""
+    if kind not in RENDITION_SIZES:
+        raise HTTPException(status_code=404, detail="Unknown rendition")
+    query = {"certificate_id": certificate_id, "user_id": user.user_id}
+    cert = await db.certificates.find_one(query, {"_id": 0, "renditions": 1})
+    if cert is None:
+        raise HTTPException(status_code=404, detail="Certificate not found")
+    
+    renditions = cert.get("renditions")
+    if renditions is None:
+        # Not reached by the backfill yet, or the render at upload was lost
+        source = await db.certificates.find_one(query, {"_id": 0, "image_url": 1})
+        if not (source.get("image_url") or "").startswith("data:"):
+            raise HTTPException(status_code=404, detail="No preview available")
+        content, mime_type = decode_data_url(source["image_url"])
+        renditions = await create_certificate_renditions(certificate_id, content, mime_type)
+    if not renditions.get(kind):
+        raise HTTPException(status_code=404, detail="No preview available")
+    
+    digest = renditions[kind]
+    return await blob_response(
+        request,
+        rendition_bucket,
+        digest,
+        "image/webp",
+        headers={"Cache-Control": "private, max-age=86400"},
+        etag=f'"{digest}"'
+    )
+
+async def backfill_certificate_renditions():
+    """Render previews for uploaded certificates that predate renditions"""
+    async def migrate_batch(certs):
+        for cert in certs:
+            if "renditions" in cert or not (cert.get("image_url") or "").startswith("data:"):
+                continue
+            content, mime_type = decode_data_url(cert["image_url"])
+            await create_certificate_renditions(cert["certificate_id"], content, mime_type)
+    
+    await run_batched_migration(
+        "certificate_renditions",
+        db.certificates,
+        migrate_batch,
+        projection={"certificate_id": 1, "image_url": 1, "renditions": 1},
+        batch_size=RENDITION_MIGRATION_BATCH_SIZE
+    )
+
+# ============ IMAGE DUPLICATE DETECTION ============
+
+# Two scans of the same certificate differ by at most this many of the 64 bits
+# of both their pHash and dHash; requiring both keeps look-alike templates apart
+IMAGE_HASH_DISTANCE = int(os.environ.get("IMAGE_HASH_DISTANCE", "6"))
+# The hash is indexed in 8-bit bands: hashes within IMAGE_HASH_DISTANCE share at
+# least one band exactly (pigeonhole), so candidates come from an index lookup
+IMAGE_HASH_BAND_BITS = 8
+IMAGE_HASH_MIGRATION_BATCH_SIZE = 20
+
+def dct_matrix(n: int) -> np.ndarray:
+    """Orthonormal DCT-II basis, so a 2-D DCT is two matrix products"""
+    k = np.arange(n)[:, None]
+    matrix = np.sqrt(2 / n) * np.cos(np.pi * (2 * np.arange(n)[None, :] + 1) * k / (2 * n))
+    matrix[0] /= np.sqrt(2)
+    return matrix
+
+PHASH_DCT = dct_matrix(32)
+
+def bits_to_hex(bits: np.ndarray) -> str:
+    return f"{int(''.join('1' if bit else '0' for bit in bits.flatten()), 2):016x}"
+
+def compute_image_hashes(image: Image.Image) -> Dict[str, str]:
+    """pHash and dHash of an image as 16-digit hex strings"""
+    gray = image.convert("L")
+    # pHash: signs of the low-frequency DCT coefficients against their median
+    pixels = np.asarray(gray.resize((32, 32), Image.LANCZOS), dtype=np.float64)
+    low = (PHASH_DCT @ pixels @ PHASH_DCT.T)[:8, :8]
+    phash = low > np.median(low.flatten()[1:])
+    # dHash: horizontal brightness gradients
+    small = np.asarray(gray.resize((9, 8), Image.LANCZOS), dtype=np.int16)
+    dhash = small[:, 1:] > small[:, :-1]
+    return {"phash": bits_to_hex(phash), "dhash": bits_to_hex(dhash)}
+
+def certificate_image_hashes(content: bytes, mime_type: str) -> Dict[str, str]:
+    return compute_image_hashes(open_certificate_image(content, mime_type, 64))
+
+def image_hash_bands(phash: str) -> List[str]:
+    """Position-tagged bands of a pHash, e.g. "3:a7", for the multikey index"""
+    digits = IMAGE_HASH_BAND_BITS // 4
+    return [f"{i}:{phash[i * digits:(i + 1) * digits]}" for i in range(len(phash) // digits)]
+
+def hamming_distance(a: str, b: str) -> int:
+    return (int(a, 16) ^ int(b, 16)).bit_count()
+
+def image_hash_distance(a: Dict[str, str], b: Dict[str, str]) -> Optional[int]:
+    """pHash distance of two images, or None when they are not near-duplicates"""
+    distance = hamming_distance(a["phash"], b["phash"])
+    if distance > IMAGE_HASH_DISTANCE or hamming_distance(a["dhash"], b["dhash"]) > IMAGE_HASH_DISTANCE:
+        return None
+    return distance
+
+async def find_similar_certificates(user_id: str, hashes: Dict[str, str]) -> List[Dict[str, Any]]:
+    """Certificates of a user whose image is within IMAGE_HASH_DISTANCE of hashes, closest first"""
+    candidates = db.certificate_image_hashes.find(
+        {"user_id": user_id, "bands": {"$in": image_hash_bands(hashes["phash"])}},
+        {"_id": 0, "certificate_id": 1, "phash": 1, "dhash": 1}
+    )
+    distances = {}
+    async for candidate in candidates:
+        distance = image_hash_distance(candidate, hashes)
+        if distance is not None:
+            distances[candidate["certificate_id"]] = distance
+    if not distances:
+        return []
+    
+    certs = await db.certificates.find(
+        {"user_id": user_id, "certificate_id": {"$in": list(distances)}},
+        build_projection("certificates")
+    ).to_list(None)
+    for cert in certs:
+        cert["distance"] = distances[cert["certificate_id"]]
+    return sorted(certs, key=lambda cert: cert["distance"])
+
+async def store_image_hashes(user_id: str, certificate_id: str, hashes: Dict[str, str]):
+    await db.certificate_image_hashes.update_one(
+        {"certificate_id": certificate_id},
+        {"$set": {"user_id": user_id, **hashes, "bands": image_hash_bands(hashes["phash"])}},
+        upsert=True
+    )
+
+@api_router.get("/certificates/duplicates/images")
+async def find_image_duplicates(user: User = Depends(get_current_user)):
+    """Group a user's certificates whose images are near-duplicates"""
+    hashes = await db.certificate_image_hashes.find(
+        {"user_id": user.user_id},
+        {"_id": 0, "certificate_id": 1, "phash": 1, "dhash": 1}
+    ).to_list(None)
+    
+    # Only certificates sharing a band can be close enough, so compare within bands
+    by_band: Dict[str, List[int]] = {}
+    for idx, entry in enumerate(hashes):
+        for band in image_hash_bands(entry["phash"]):
+            by_band.setdefault(band, []).append(idx)
+    
+    parent = list(range(len(hashes)))
+    def find(idx):
+        while parent[idx] != idx:
+            parent[idx] = parent[parent[idx]]
+            idx = parent[idx]
+        return idx
+    
+    compared = set()
+    distances = {}
+    for members in by_band.values():
+        for a, b in itertools.combinations(members, 2):
+            if (a, b) in compared:
+                continue
+            compared.add((a, b))
+            distance = image_hash_distance(hashes[a], hashes[b])
+            if distance is not None:
+                distances[(a, b)] = distance
+                parent[find(a)] = find(b)
+    
+    groups: Dict[int, set] = {}
+    for a, b in distances:
+        groups.setdefault(find(a), set()).update((a, b))
+    if not groups:
+        return {"groups": [], "group_count": 0}
+    
+    ids = [hashes[idx]["certificate_id"] for members in groups.values() for idx in members]
+    certs = {
+        cert["certificate_id"]: cert
+        async for cert in db.certificates.find(
+            {"user_id": user.user_id, "certificate_id": {"$in": ids}},
+            build_projection("certificates")
+        )
+    }
+    result = []
+    for root, members in groups.items():
+        group_certs = [certs[hashes[idx]["certificate_id"]] for idx in sorted(members) if hashes[idx]["certificate_id"] in certs]
+        if len(group_certs) < 2:
+            continue
+        result.append({
+            "certificates": sorted(group_certs, key=lambda cert: cert.get("created_at") or ""),
+            "max_distance": max(d for (a, b), d in distances.items() if find(a) == root)
+        })
+    return {"groups": result, "group_count": len(result)}
+
+async def backfill_image_hashes():
+    """Hash the images of uploaded certificates that predate duplicate detection"""
+    async def migrate_batch(certs):
+        for cert in certs:
+            if not (cert.get("image_url") or "").startswith("data:"):
+                continue
+            content, mime_type = decode_data_url(cert["image_url"])
+            try:
+                hashes = await asyncio.to_thread(certificate_image_hashes, content, mime_type)
+            except Exception as e:
+                logger.warning(f"Hashing the image of {cert['certificate_id']} failed: {e}")
+                continue
+            await store_image_hashes(cert["user_id"], cert["certificate_id"], hashes)
+    
+    await run_batched_migration(
+        "certificate_image_hashes",
+        db.certificates,
+        migrate_batch,
+        projection={"certificate_id": 1, "user_id": 1, "image_url": 1},
+        batch_size=IMAGE_HASH_MIGRATION_BATCH_SIZE
+    )
+
+# ============ METADATA DUPLICATE DETECTION ============
+
+DEDUPE_DATE_WINDOW_DAYS = 3
+DEDUPE_MIN_SCORE = 0.8
+DEDUPE_TITLE_WEIGHT = 0.7
+DEDUPE_TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+DEDUPE_STOPWORDS = {"a", "an", "and", "the", "of", "in", "on", "for", "to", "with", "cme", "course"}
+DEDUPE_FIELDS = [
+    "certificate_id", "title", "provider", "credits", "completion_date", "certificate_number"
+]
+# Filled in on the kept certificate from a merged one when the kept one lacks them
+MERGE_FILL_FIELDS = [
+    "subject", "expiration_date", "certificate_number", "accme_provider_number", "location",
+    "image_url", "thumbnail_url", "preview_url", "renditions", "ocr_data"
+]
+
+def dedupe_text_features(text: Optional[str]) -> tuple:
+    """Token set and character trigram set of a normalized title or provider"""
+    tokens = [t for t in DEDUPE_TOKEN_PATTERN.findall((text or "").lower()) if t not in DEDUPE_STOPWORDS]
+    padded = f"  {' '.join(tokens)} "
+    return frozenset(tokens), frozenset(padded[i:i + 3] for i in range(len(padded) - 2))
+
+def text_similarity(a: tuple, b: tuple) -> float:
+    """Mean of token-set overlap (so "Grand Rounds" matches "Cardiology Grand Rounds") and trigram Jaccard (typos, OCR noise)"""
+    (tokens_a, trigrams_a), (tokens_b, trigrams_b) = a, b
+    if not tokens_a or not tokens_b:
+        return 0.0
+    token_set = len(tokens_a & tokens_b) / min(len(tokens_a), len(tokens_b))
+    trigram = len(trigrams_a & trigrams_b) / len(trigrams_a | trigrams_b)
+    return (token_set + trigram) / 2
+
+def certificate_dedupe_entry(cert: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    try:
+        day = datetime.strptime(cert.get("completion_date", "")[:10], "%Y-%m-%d").toordinal()
+    except (TypeError, ValueError):
+        return None
+    number = re.sub(r"\W", "", (cert.get("certificate_number") or "")).lower()
+    return {
+        "certificate_id": cert["certificate_id"],
+        "day": day,
+        "number": number,
+        "title": dedupe_text_features(cert.get("title")),
+        "provider": dedupe_text_features(cert.get("provider")),
+    }
+
+def certificate_pair_score(a: Dict[str, Any], b: Dict[str, Any]) -> float:
+    """Likelihood two certificates in the same block record the same activity"""
+    if a["number"] and b["number"]:
+        # Certificate numbers are authoritative when both sides have one
+        return 1.0 if a["number"] == b["number"] else 0.0
+    title = text_similarity(a["title"], b["title"])
+    if not a["provider"][0] or not b["provider"][0]:
+        return title
+    provider = text_similarity(a["provider"], b["provider"])
+    return DEDUPE_TITLE_WEIGHT * title + (1 - DEDUPE_TITLE_WEIGHT) * provider
+
+async def find_metadata_duplicates(
+    user_id: str,
+    window_days: int = DEDUPE_DATE_WINDOW_DAYS,
+    min_score: float = DEDUPE_MIN_SCORE
+) -> List[Dict[str, Any]]:
+    """Group a user's certificates that look like the same activity entered more than once.
+
+    Certificates are blocked by credits and completion date: the list comes
+    sorted by (credits, completion_date) from the index, and each certificate
+    is only scored against the ones with the same credits completed within
+    window_days before it. That keeps the work near linear in the library size.
+    """
+    cursor = db.certificates.find(
+        {"user_id": user_id},
+        {"_id": 0, **{field: 1 for field in DEDUPE_FIELDS}}
+    ).sort([("credits", 1), ("completion_date", 1)])
+    
+    entries = []
+    pairs = []
+    block_credits = None
+    block = []
+    async for cert in cursor:
+        entry = certificate_dedupe_entry(cert)
+        if entry is None:
+            continue
+        if cert.get("credits") != block_credits:
+            block_credits, block = cert.get("credits"), []
+        while block and entry["day"] - block[0]["day"] > window_days:
+            block.pop(0)
+        entry["index"] = len(entries)
+        for other in block:
+            score = certificate_pair_score(other, entry)
+            if score >= min_score:
+                pairs.append((other["index"], entry["index"], score))
+        block.append(entry)
+        entries.append(entry)
+    
+    parent = list(range(len(entries)))
+    def find(idx):
+        while parent[idx] != idx:
+            parent[idx] = parent[parent[idx]]
+            idx = parent[idx]
+        return idx
+    for a, b, _ in pairs:
+        parent[find(a)] = find(b)
+    
+    groups: Dict[int, Dict[str, Any]] = {}
+    for a, b, score in pairs:
+        group = groups.setdefault(find(a), {"members": set(), "pairs": []})
+        group["members"].update((a, b))
+        group["pairs"].append({
+            "certificate_ids": [entries[a]["certificate_id"], entries[b]["certificate_id"]],
+            "score": round(score, 3)
+        })
+    if not groups:
+        return []
+    
+    ids = [entries[idx]["certificate_id"] for group in groups.values() for idx in group["members"]]
+    certs = {
+        cert["certificate_id"]: cert
+        async for cert in db.certificates.find(
+            {"user_id": user_id, "certificate_id": {"$in": ids}},
+            build_projection("certificates")
+        )
+    }
+    result = []
+    for group in groups.values():
+        members = [certs[entries[idx]["certificate_id"]] for idx in sorted(group["members"])]
+        # Suggest keeping the most complete record
+        keep = max(members, key=lambda cert: sum(1 for value in cert.values() if value not in (None, "", [], ["unknown"])))
+        result.append({
+            "certificates": members,
+            "pairs": group["pairs"],
+            "score": max(pair["score"] for pair in group["pairs"]),
+            "suggested_keep_id": keep["certificate_id"]
+        })
+    return sorted(result, key=lambda group: -group["score"])
+
+async def restore_merged_certificates(docs: List[Dict[str, Any]]):
+    """Put back certificates claimed by a merge that could not complete"""
+    if docs:
+        await db.certificates.insert_many([dict(doc) for doc in docs])
+
+async def merge_certificates(user_id: str, keep_id: str, merge_ids: List[str]) -> Dict[str, Any]:
+    """Fold duplicate certificates into keep_id and delete them"""
+    ids = [keep_id, *merge_ids]
+    docs = {
+        cert["certificate_id"]: cert
+        async for cert in db.certificates.find(
+            {"user_id": user_id, "certificate_id": {"$in": ids}},
+            {"_id": 0}
+        )
+    }
+    missing = [cert_id for cert_id in ids if cert_id not in docs]
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Certificate not found: {', '.join(missing)}")
+    
+    # Claim the merged certificates by deleting them before touching the kept one, so a
+    # concurrent merge or delete of the same certificates cannot fold them in twice
+    claimed = []
+    for cert_id in merge_ids:
+        doc = await db.certificates.find_one_and_delete(
+            {"user_id": user_id, "certificate_id": cert_id},
+            projection={"_id": 0}
+        )
+        if doc:
+            claimed.append(doc)
+    if len(claimed) < len(merge_ids):
+        await restore_merged_certificates(claimed)
+        raise HTTPException(status_code=409, detail="Certificates changed while merging; reload and try again")
+    docs.update((doc["certificate_id"], doc) for doc in claimed)
+    
+    keep = docs[keep_id]
+    updates = {}
+    for cert_id in merge_ids:
+        other = docs[cert_id]
+        for field in MERGE_FILL_FIELDS:
+            if not keep.get(field) and not updates.get(field) and other.get(field):
+                updates[field] = other[field]
+        if credit_types_of(keep) == ["unknown"] and "credit_types" not in updates and credit_types_of(other) != ["unknown"]:
+            updates.update(normalize_credit_fields({"credit_types": credit_types_of(other)}))
+    
+    if "thumbnail_url" in updates or "preview_url" in updates:
+        # Rendition URLs name their certificate, and the merged ones are gone
+        updates.update(certificate_rendition_urls(keep_id))
+    guard = {}
+    if "renditions" in updates:
+        # Renditions rendered for the kept certificate since it was read must not be overwritten
+        guard["renditions"] = keep["renditions"] if "renditions" in keep else {"$exists": False}
+    
+    now = datetime.now(timezone.utc).isoformat()
+    result = await db.certificates.update_one(
+        {"certificate_id": keep_id, "user_id": user_id, **guard},
+        {
+            "$set": {**updates, "updated_at": now},
+            "$addToSet": {"merged_from": {"$each": merge_ids}}
+        }
+    )
+    if result.matched_count == 0:
+        # The kept certificate was itself merged away or deleted meanwhile
+        await restore_merged_certificates(claimed)
+        raise HTTPException(status_code=409, detail="Certificates changed while merging; reload and try again")
+    
+    # Keep the image hashes of whichever image the kept certificate ends up with
+    image_source = next((cert_id for cert_id in merge_ids if docs[cert_id].get("image_url") == updates.get("image_url")), None)
+    if "image_url" in updates and image_source:
+        await db.certificate_image_hashes.update_one(
+            {"certificate_id": image_source},
+            {"$set": {"certificate_id": keep_id}}
+        )
+    await record_tombstones(user_id, "certificates", merge_ids)
+    await db.certificate_image_hashes.delete_many({"certificate_id": {"$in": merge_ids}})
+    for cert_id in merge_ids:
+        await remove_ledger_entry("certificate", cert_id)
+    # The kept certificate takes over the references of renditions it inherited
+    renditions_source = next((cert_id for cert_id in merge_ids if "renditions" in updates and docs[cert_id].get("renditions") == updates["renditions"]), None)
+    await release_renditions(
+        digest for doc in claimed if doc["certificate_id"] != renditions_source
+        for digest in (doc.get("renditions") or {}).values()
+    )
+    
+    kept = await db.certificates.find_one({"certificate_id": keep_id}, {"_id": 0})
+    await upsert_ledger_entry("certificate", kept)
+    await update_requirement_progress(user_id)
+    return {field: kept.get(field) for field in FIELD_VIEWS["certificates"]["summary"] if field in kept}
+
+# ============ EXPORT CACHE ============
+
+# Bump a format's version whenever its renderer output changes
+EXPORT_RENDERER_VERSIONS = {"pdf": 1, "excel": 1, "pars": 1}
+EXPORT_CACHE_MAX_BYTES = int(os.environ.get("EXPORT_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+
+export_cache_bucket = AsyncIOMotorGridFSBucket(db, bucket_name="export_cache")
+
+def export_cache_key(user: User, year: int, export_format: str) -> Dict[str, Any]:
+    """Cache key for a rendered export; any change to the inputs yields a new key"""
+    # Name and NPI are printed on the transcripts, so profile edits must miss too
+    profile_hash = hashlib.sha1(f"{user.name}|{user.npi_number or ''}".encode("utf-8")).hexdigest()[:16]
+    return {
+        "user_id": user.user_id,
+        "year": year,
+        "format": export_format,
+        "data_version": user.data_version,
+        "renderer_version": EXPORT_RENDERER_VERSIONS[export_format],
+        "profile_hash": profile_hash
+    }
+
+async def get_cached_export(user: User, year: int, export_format: str) -> Optional[Dict[str, Any]]:
+    """Look up a cached export and mark it as recently used"""
+    return await db.export_cache.find_one_and_update(
+        export_cache_key(user, year, export_format),
+        {"$set": {"last_accessed": datetime.now(timezone.utc).isoformat()}},
+        projection={"_id": 0}
+    )
+
+async def store_cached_export(user: User, year: int, export_format: str, output) -> Dict[str, Any]:
+    """Upload a rendered export to the cache, replacing older versions for the same download"""
+    key = export_cache_key(user, year, export_format)
+    output.seek(0, io.SEEK_END)
+    size = output.tell()
+    output.seek(0)
+    
+    blob_id = await export_cache_bucket.upload_from_stream(
+        f"{user.user_id}_{year}.{export_format}",
+        output,
+        metadata={"user_id": user.user_id, "format": export_format}
+    )
+    now = datetime.now(timezone.utc).isoformat()
+    entry = {**key, "blob_id": blob_id, "size": size, "created_at": now, "last_accessed": now}
+    await db.export_cache.insert_one(entry)
+    entry.pop("_id", None)
+    
+    # Entries for older data or renderer versions can never be hit again
+    stale = await db.export_cache.find(
+        {
+            "user_id": user.user_id,
+            "year": year,
+            "format": export_format,
+            "blob_id": {"$ne": blob_id}
+        },
+        {"_id": 0, "blob_id": 1}
+    ).to_list(None)
+    await evict_cached_exports(stale)
+    await enforce_export_cache_budget(keep_blob_id=blob_id)
+    return entry
+
+async def evict_cached_exports(entries: List[Dict[str, Any]]):
+    """Delete cache entries and their blobs"""
+    for entry in entries:
+        await db.export_cache.delete_one({"blob_id": entry["blob_id"]})
+        try:
+            await export_cache_bucket.delete(entry["blob_id"])
+        except Exception as e:
+            logger.warning(f"Failed to delete cached export blob {entry['blob_id']}: {e}")
+
+async def enforce_export_cache_budget(keep_blob_id=None):
+    """Evict least recently used exports until the cache fits its size budget"""
+    result = await db.export_cache.aggregate([
+        {"$group": {"_id": None, "total": {"$sum": "$size"}}}
+    ]).to_list(1)
+    excess = (result[0]["total"] if result else 0) - EXPORT_CACHE_MAX_BYTES
+    if excess <= 0:
+        return
+    
+    victims = []
+    candidates = db.export_cache.find(
+        {"blob_id": {"$ne": keep_blob_id}},
+        {"_id": 0, "blob_id": 1, "size": 1}
+    ).sort("last_accessed", 1)
+    async for entry in candidates:
+        victims.append(entry)
+        excess -= entry["size"]
+        if excess <= 0:
+            break
+    await evict_cached_exports(victims)
+
+async def cached_export_response(
+    request: Request,
+    user: User,
+    year: int,
+    export_format: str,
+    render,
+    media_type: str,
+    filename: str
+):
+    """Serve an export from the cache, rendering and storing it on a miss"""
+    headers = {"Content-Disposition": f"attachment; filename={filename}"}
+    entry = await get_cached_export(user, year, export_format)
+    if entry:
+        try:
+            return await blob_response(request, export_cache_bucket, entry["blob_id"], media_type, headers)
+        except NoFile:
+            # Evicted by another request between the lookup and the read
+            await db.export_cache.delete_one({"blob_id": entry["blob_id"]})
+    
+    async with render_limiter.slot():
+        output = await render()
+    try:
+        entry = await store_cached_export(user, year, export_format, output)
+        headers["Content-Length"] = str(entry["size"])
+    except Exception as e:
+        logger.error(f"Failed to cache {export_format} export for {user.user_id}: {e}")
+    
+    # Serve the fresh render from the local spool rather than reading it back
+    output.seek(0)
+    return StreamingResponse(iter_file_chunks(output), media_type=media_type, headers=headers)
+
+# ============ REPORTS ROUTES ============
+
+@api_router.get("/reports/summary")
 async def get_report_summary(
     user: User = Depends(get_current_user),
     year: Optional[int] = None
@@ -1816,29 +5301,11 @@ async def get_report_summary(
     # Get certificates for the year
     certs = await db.certificates.find(
         {"user_id": user.user_id, "completion_date": {"$regex": f"^{current_year}"}},
-        {"_id": 0}
-    ).to_list(1000)
-    
-    # Group by credit type (handle multiple credit_types)
-    by_type = {}
-    total_credits = 0
+        build_projection("certificates", "export")
+    ).sort([("completion_date", -1), ("certificate_id", -1)]).to_list(None)
     
-    for cert in certs:
-        credit_types = cert.get("credit_types", [])
-        if not credit_types and cert.get("credit_type"):
-            credit_types = [cert.get("credit_type")]
-        if not credit_types:
-            credit_types = ["unknown"]
-        
-        credits = cert.get("credits", 0)
-        total_credits += credits
-        
-        # Distribute credits to each type (for reporting purposes)
-        for credit_type in credit_types:
-            if credit_type not in by_type:
-                by_type[credit_type] = {"credits": 0, "count": 0}
-            by_type[credit_type]["credits"] += credits
-            by_type[credit_type]["count"] += 1
+    # Totals and credit type breakdown (certificates and self-reported credits)
+    breakdown = (await ledger_breakdown({"user_id": user.user_id, "year": current_year})).get(current_year, {})
     
     # Get requirements progress
     requirements = await db.requirements.find(
@@ -1849,8 +5316,9 @@ async def get_report_summary(
     return {
         "year": current_year,
         "total_certificates": len(certs),
-        "total_credits": total_credits,
-        "by_credit_type": by_type,
+        "total_self_reported": breakdown.get("total_self_reported", 0),
+        "total_credits": breakdown.get("total_credits", 0),
+        "by_credit_type": breakdown.get("by_credit_type", {}),
         "requirements": requirements,
         "certificates": certs
     }
@@ -1866,37 +5334,20 @@ async def get_year_over_year_report(
     end_year = end_year or current_year
     start_year = start_year or (end_year - 4)  # Default to last 5 years
     
-    years_data = []
+    breakdown = await ledger_breakdown({"user_id": user.user_id, "year": {"$gte": start_year, "$lte": end_year}})
     
+    years_data = []
     for year in range(start_year, end_year + 1):
-        # Get certificates for the year
-        certs = await db.certificates.find(
-            {"user_id": user.user_id, "completion_date": {"$regex": f"^{year}"}},
-            {"_id": 0}
-        ).to_list(1000)
-        
-        # Calculate totals
-        total_credits = sum(cert.get("credits", 0) for cert in certs)
-        
-        # Group by credit type
-        by_type = {}
-        for cert in certs:
-            credit_types = cert.get("credit_types", [])
-            if not credit_types and cert.get("credit_type"):
-                credit_types = [cert.get("credit_type")]
-            if not credit_types:
-                credit_types = ["unknown"]
-            
-            for credit_type in credit_types:
-                if credit_type not in by_type:
-                    by_type[credit_type] = 0
-                by_type[credit_type] += cert.get("credits", 0)
-        
+        data = breakdown.get(year, {})
         years_data.append({
             "year": year,
-            "total_certificates": len(certs),
-            "total_credits": total_credits,
-            "by_credit_type": by_type
+            "total_certificates": data.get("total_certificates", 0),
+            "total_self_reported": data.get("total_self_reported", 0),
+            "total_credits": data.get("total_credits", 0),
+            "by_credit_type": {
+                credit_type: totals["credits"]
+                for credit_type, totals in data.get("by_credit_type", {}).items()
+            }
         })
     
     return {
@@ -1905,205 +5356,101 @@ async def get_year_over_year_report(
         "years": years_data
     }
 
+async def build_pdf_export(user: User, filters: TranscriptFilter, progress=None) -> tempfile.SpooledTemporaryFile:
+    """Render the PDF transcript for a filter"""
+    query = transcript_query(user.user_id, filters)
+    header = await get_transcript_header(user, filters, query)
+    
+    by_type = await transcript_credit_type_totals(query)
+    # The PDF groups by credit type, so the cursor is read in that order and fed to the renderer as it goes
+    return await render_cursor_in_worker(
+        render_transcript_pdf, transcript_cursor(query, by_credit_type=True), header, by_type, progress=progress
+    )
+
+async def build_excel_export(user: User, filters: TranscriptFilter, progress=None) -> tempfile.SpooledTemporaryFile:
+    """Render the Excel transcript for a filter"""
+    query = transcript_query(user.user_id, filters)
+    header = await get_transcript_header(user, filters, query)
+    return await render_cursor_in_worker(render_transcript_excel, transcript_cursor(query), header, progress=progress)
+
+async def build_pars_export(user: User, filters: TranscriptFilter, progress=None) -> tempfile.SpooledTemporaryFile:
+    """Render the ACCME PARS workbook for a filter"""
+    query = transcript_query(user.user_id, filters)
+    header = await get_transcript_header(user, filters, query)
+    activity_widths = await get_pars_column_widths(query)
+    return await render_cursor_in_worker(
+        render_pars_workbook, transcript_cursor(query), header, activity_widths, progress=progress
+    )
+
+async def build_html_export(user: User, filters: TranscriptFilter, progress=None) -> tempfile.SpooledTemporaryFile:
+    """Render the printable HTML transcript for a filter into a spooled file"""
+    query = transcript_query(user.user_id, filters)
+    header = await get_transcript_header(user, filters, query)
+    output = tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_MAX_SIZE)
+    try:
+        content = TRANSCRIPT_HTML_TEMPLATE.generate_async(
+            header=header,
+            entries=iter_transcript_entries(transcript_cursor(query), progress)
+        )
+        async for chunk in content:
+            output.write(chunk.encode("utf-8"))
+    except BaseException:
+        output.close()
+        raise
+    output.seek(0)
+    return output
+
 @api_router.get("/reports/export/pdf")
 async def export_pdf(
-    user: User = Depends(get_current_user),
+    request: Request,
+    user: User = Depends(rate_limited_user("export")),
     year: Optional[int] = None
 ):
     """Export transcript as PDF"""
-    summary = await get_report_summary(user, year)
-    
-    buffer = io.BytesIO()
-    c = canvas.Canvas(buffer, pagesize=letter)
-    width, height = letter
-    
-    # Header
-    c.setFont("Helvetica-Bold", 18)
-    c.drawString(1*inch, height - 1*inch, "CME Transcript")
-    
-    c.setFont("Helvetica", 12)
-    c.drawString(1*inch, height - 1.3*inch, f"Name: {user.name}")
-    c.drawString(1*inch, height - 1.5*inch, f"Year: {summary['year']}")
-    c.drawString(1*inch, height - 1.7*inch, f"Total Credits: {summary['total_credits']}")
-    
-    # Credits by type
-    y = height - 2.2*inch
-    c.setFont("Helvetica-Bold", 14)
-    c.drawString(1*inch, y, "Credits by Type")
-    y -= 0.3*inch
-    
-    c.setFont("Helvetica", 10)
-    for credit_type, data in summary['by_credit_type'].items():
-        c.drawString(1.2*inch, y, f"• {credit_type}: {data['credits']} credits ({data['count']} certificates)")
-        y -= 0.25*inch
-    
-    # Certificates list
-    y -= 0.3*inch
-    c.setFont("Helvetica-Bold", 14)
-    c.drawString(1*inch, y, "Certificates")
-    y -= 0.3*inch
-    
-    c.setFont("Helvetica", 9)
-    for cert in summary['certificates'][:30]:  # Limit to prevent overflow
-        if y < 1*inch:
-            c.showPage()
-            y = height - 1*inch
-            c.setFont("Helvetica", 9)
-        
-        c.drawString(1.2*inch, y, f"• {cert['title'][:50]} - {cert['credits']} credits ({cert['completion_date']})")
-        y -= 0.2*inch
-    
-    c.save()
-    buffer.seek(0)
-    
-    return StreamingResponse(
-        buffer,
-        media_type="application/pdf",
-        headers={"Content-Disposition": f"attachment; filename=cme_transcript_{summary['year']}.pdf"}
+    year = year or datetime.now().year
+    return await cached_export_response(
+        request, user, year, "pdf",
+        lambda: build_pdf_export(user, TranscriptFilter.for_year(year)),
+        "application/pdf",
+        f"cme_transcript_{year}.pdf"
     )
 
 @api_router.get("/reports/export/excel")
 async def export_excel(
-    user: User = Depends(get_current_user),
+    request: Request,
+    user: User = Depends(rate_limited_user("export")),
     year: Optional[int] = None
 ):
     """Export transcript as Excel"""
-    summary = await get_report_summary(user, year)
-    
-    wb = openpyxl.Workbook()
-    ws = wb.active
-    ws.title = "CME Transcript"
-    
-    # Header
-    ws['A1'] = "CME Transcript"
-    ws['A1'].font = Font(bold=True, size=16)
-    ws['A2'] = f"Name: {user.name}"
-    ws['A3'] = f"Year: {summary['year']}"
-    ws['A4'] = f"Total Credits: {summary['total_credits']}"
-    
-    # Headers for certificate table
-    headers = ["Title", "Provider", "Credits", "Credit Type", "Completion Date", "Certificate #"]
-    for col, header in enumerate(headers, 1):
-        cell = ws.cell(row=6, column=col, value=header)
-        cell.font = Font(bold=True)
-        cell.alignment = Alignment(horizontal='center')
-    
-    # Certificate data
-    for row, cert in enumerate(summary['certificates'], 7):
-        ws.cell(row=row, column=1, value=cert.get('title', ''))
-        ws.cell(row=row, column=2, value=cert.get('provider', ''))
-        ws.cell(row=row, column=3, value=cert.get('credits', 0))
-        ws.cell(row=row, column=4, value=cert.get('credit_type', ''))
-        ws.cell(row=row, column=5, value=cert.get('completion_date', ''))
-        ws.cell(row=row, column=6, value=cert.get('certificate_number', ''))
-    
-    # Adjust column widths
-    ws.column_dimensions['A'].width = 40
-    ws.column_dimensions['B'].width = 30
-    ws.column_dimensions['C'].width = 10
-    ws.column_dimensions['D'].width = 20
-    ws.column_dimensions['E'].width = 15
-    ws.column_dimensions['F'].width = 15
-    
-    buffer = io.BytesIO()
-    wb.save(buffer)
-    buffer.seek(0)
-    
-    return StreamingResponse(
-        buffer,
-        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        headers={"Content-Disposition": f"attachment; filename=cme_transcript_{summary['year']}.xlsx"}
+    year = year or datetime.now().year
+    return await cached_export_response(
+        request, user, year, "excel",
+        lambda: build_excel_export(user, TranscriptFilter.for_year(year)),
+        XLSX_MEDIA_TYPE,
+        f"cme_transcript_{year}.xlsx"
     )
 
 @api_router.get("/reports/export/html")
 async def export_html(
-    user: User = Depends(get_current_user),
+    user: User = Depends(rate_limited_user("export")),
     year: Optional[int] = None
 ):
     """Export transcript as printable HTML"""
-    summary = await get_report_summary(user, year)
-    
-    html = f"""
-<!DOCTYPE html>
-<html>
-<head>
-    <title>CME Transcript - {user.name}</title>
-    <style>
-        body {{ font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif; max-width: 800px; margin: 0 auto; padding: 20px; }}
-        h1 {{ color: #4F46E5; border-bottom: 2px solid #4F46E5; padding-bottom: 10px; }}
-        .header {{ margin-bottom: 30px; }}
-        .header p {{ margin: 5px 0; color: #64748b; }}
-        .summary {{ background: #f8fafc; padding: 20px; border-radius: 8px; margin-bottom: 30px; }}
-        .summary h3 {{ margin-top: 0; color: #334155; }}
-        table {{ width: 100%; border-collapse: collapse; margin-top: 20px; }}
-        th {{ background: #4F46E5; color: white; padding: 12px; text-align: left; }}
-        td {{ padding: 10px; border-bottom: 1px solid #e2e8f0; }}
-        tr:hover {{ background: #f8fafc; }}
-        .credit-type {{ display: inline-block; background: #e0e7ff; color: #3730a3; padding: 2px 8px; border-radius: 4px; font-size: 12px; }}
-        @media print {{
-            body {{ print-color-adjust: exact; -webkit-print-color-adjust: exact; }}
-            .no-print {{ display: none; }}
-        }}
-    </style>
-</head>
-<body>
-    <div class="header">
-        <h1>CME Transcript</h1>
-        <p><strong>Name:</strong> {user.name}</p>
-        <p><strong>Email:</strong> {user.email}</p>
-        <p><strong>Year:</strong> {summary['year']}</p>
-        <p><strong>Generated:</strong> {datetime.now().strftime('%B %d, %Y')}</p>
-    </div>
-    
-    <div class="summary">
-        <h3>Summary</h3>
-        <p><strong>Total Certificates:</strong> {summary['total_certificates']}</p>
-        <p><strong>Total Credits:</strong> {summary['total_credits']}</p>
-    </div>
-    
-    <h2>Certificates</h2>
-    <table>
-        <thead>
-            <tr>
-                <th>Title</th>
-                <th>Provider</th>
-                <th>Credits</th>
-                <th>Type</th>
-                <th>Date</th>
-            </tr>
-        </thead>
-        <tbody>
-"""
-    
-    for cert in summary['certificates']:
-        html += f"""
-            <tr>
-                <td>{cert.get('title', '')}</td>
-                <td>{cert.get('provider', '')}</td>
-                <td>{cert.get('credits', 0)}</td>
-                <td><span class="credit-type">{cert.get('credit_type', '')}</span></td>
-                <td>{cert.get('completion_date', '')}</td>
-            </tr>
-"""
-    
-    html += """
-        </tbody>
-    </table>
-    
-    <p class="no-print" style="margin-top: 30px; text-align: center;">
-        <button onclick="window.print()" style="background: #4F46E5; color: white; border: none; padding: 10px 20px; border-radius: 6px; cursor: pointer;">
-            Print Transcript
-        </button>
-    </p>
-</body>
-</html>
-"""
-    
-    return Response(content=html, media_type="text/html")
+    year = year or datetime.now().year
+    filters = TranscriptFilter.for_year(year)
+    query = transcript_query(user.user_id, filters)
+    header = await get_transcript_header(user, filters, query)
+    
+    content = TRANSCRIPT_HTML_TEMPLATE.generate_async(
+        header=header,
+        entries=iter_transcript_entries(transcript_cursor(query))
+    )
+    return StreamingResponse(content, media_type="text/html")
 
 @api_router.get("/reports/export/pars")
 async def export_pars(
-    user: User = Depends(get_current_user),
+    request: Request,
+    user: User = Depends(rate_limited_user("export")),
     year: Optional[int] = None
 ):
     """Export transcript in ACCME PARS format for annual reporting
@@ -2113,108 +5460,454 @@ async def export_pars(
     - Credit types mapped to ACCME standards
     - Provider information with ACCME numbers where available
     """
-    summary = await get_report_summary(user, year)
-    
-    # Create PARS-compliant export workbook
-    wb = openpyxl.Workbook()
-    
-    # Summary Sheet
-    ws_summary = wb.active
-    ws_summary.title = "PARS Summary"
-    
-    # PARS Header Information
-    ws_summary['A1'] = "ACCME PARS Activity Report"
-    ws_summary['A1'].font = Font(bold=True, size=16)
-    ws_summary['A2'] = f"Reporting Year: {summary['year']}"
-    ws_summary['A3'] = f"Generated: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
-    ws_summary['A4'] = f"Physician Name: {user.name}"
-    ws_summary['A5'] = f"NPI Number: {user.npi_number or 'Not Provided'}"
-    
-    # Summary Statistics
-    ws_summary['A7'] = "Summary Statistics"
-    ws_summary['A7'].font = Font(bold=True)
-    ws_summary['A8'] = f"Total CME Activities: {summary['total_certificates']}"
-    ws_summary['A9'] = f"Total Credits: {summary['total_credits']}"
-    
-    # Credits by Type
-    ws_summary['A11'] = "Credits by ACCME Category"
-    ws_summary['A11'].font = Font(bold=True)
-    row = 12
-    for ctype, credits in summary['by_credit_type'].items():
-        ws_summary.cell(row=row, column=1, value=ctype)
-        ws_summary.cell(row=row, column=2, value=credits.get('credits', 0) if isinstance(credits, dict) else credits)
-        row += 1
-    
-    # Activity Details Sheet
-    ws_activities = wb.create_sheet("PARS Activities")
-    
-    # PARS-required columns
-    pars_headers = [
-        "Activity ID",
-        "Activity Title",
-        "Activity Type",
-        "Provider/Joint Provider",
-        "ACCME Provider Number",
-        "Credit Type",
-        "Credits Claimed",
-        "Activity Date",
-        "Completion Date",
-        "Certificate Number",
-        "Subject/Topic",
-        "Delivery Format"
-    ]
-    
-    for col, header in enumerate(pars_headers, 1):
-        cell = ws_activities.cell(row=1, column=col, value=header)
-        cell.font = Font(bold=True)
-        cell.alignment = Alignment(horizontal='center')
+    year = year or datetime.now().year
+    return await cached_export_response(
+        request, user, year, "pars",
+        lambda: build_pars_export(user, TranscriptFilter.for_year(year)),
+        XLSX_MEDIA_TYPE,
+        f"accme_pars_report_{year}.xlsx"
+    )
+
+@api_router.get("/reports/export/csv")
+async def export_csv(
+    user: User = Depends(rate_limited_user("export")),
+    filters: TranscriptFilter = Depends(transcript_filter_params)
+):
+    """Stream certificates and self-reported credits as CSV"""
+    return StreamingResponse(
+        iter_transcript_csv(iter_transcript_rows(user.user_id, filters)),
+        media_type="text/csv",
+        headers={"Content-Disposition": f"attachment; filename=cme_transcript_{filters.start_year}-{filters.end_year}.csv"}
+    )
+
+@api_router.get("/reports/export/ndjson")
+async def export_ndjson(
+    user: User = Depends(rate_limited_user("export")),
+    filters: TranscriptFilter = Depends(transcript_filter_params)
+):
+    """Stream certificates and self-reported credits as newline-delimited JSON"""
+    return StreamingResponse(
+        iter_transcript_ndjson(iter_transcript_rows(user.user_id, filters)),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": f"attachment; filename=cme_transcript_{filters.start_year}-{filters.end_year}.ndjson"}
+    )
+
+# ============ EXPORT JOBS ============
+
+class ExportJobCreate(BaseModel):
+    format: str
+    start_year: Optional[int] = None
+    end_year: Optional[int] = None
+    credit_types: List[str] = []
+    providers: List[str] = []
+    subjects: List[str] = []
+    priority: str = "normal"
+
+class ExportJobCancelled(Exception):
+    """Raised inside a render once its job has been cancelled"""
+
+# Format -> (builder, media type, filename prefix, extension)
+EXPORT_JOB_FORMATS = {
+    "pdf": (build_pdf_export, "application/pdf", "cme_transcript", "pdf"),
+    "excel": (build_excel_export, XLSX_MEDIA_TYPE, "cme_transcript", "xlsx"),
+    "pars": (build_pars_export, XLSX_MEDIA_TYPE, "accme_pars_report", "xlsx"),
+    "html": (build_html_export, "text/html", "cme_transcript", "html"),
+}
+# Lower ranks are claimed first
+EXPORT_JOB_PRIORITIES = {"high": 0, "normal": 1, "low": 2}
+# Priorities a user may ask for; "high" is kept for jobs the server queues itself
+EXPORT_JOB_USER_PRIORITIES = ["normal", "low"]
+# Queued or running jobs one user may have at once, so nobody can flood the shared queue
+EXPORT_JOB_MAX_ACTIVE_PER_USER = int(os.environ.get("EXPORT_JOB_MAX_ACTIVE_PER_USER", "5"))
+EXPORT_JOB_WORKERS = int(os.environ.get("EXPORT_JOB_WORKERS", "2"))
+EXPORT_JOB_POLL_INTERVAL = 2.0
+# A running job without a heartbeat for this long is assumed lost and requeued
+EXPORT_JOB_STALE_AFTER = timedelta(minutes=10)
+# Well inside EXPORT_JOB_STALE_AFTER, so a long render is never mistaken for a lost job
+EXPORT_JOB_HEARTBEAT_INTERVAL = 60
+EXPORT_JOB_RETENTION = timedelta(hours=int(os.environ.get("EXPORT_JOB_RETENTION_HOURS", "24")))
+
+export_job_bucket = AsyncIOMotorGridFSBucket(db, bucket_name="export_files")
+export_job_wakeup = asyncio.Event()
+export_job_workers: List[asyncio.Task] = []
+
+def export_job_view(job: Dict[str, Any]) -> Dict[str, Any]:
+    """Public representation of an export job"""
+    job = {k: v for k, v in job.items() if k not in ("_id", "blob_id", "priority_rank", "heartbeat_at")}
+    if job.get("status") == "completed":
+        job["download_url"] = f"/api/reports/exports/{job['job_id']}/download"
+    return job
+
+async def claim_export_job() -> Optional[Dict[str, Any]]:
+    """Atomically take the highest-priority queued job (or a lost running one)"""
+    now = datetime.now(timezone.utc)
+    return await db.export_jobs.find_one_and_update(
+        {"$or": [
+            {"status": "queued"},
+            {"status": "running", "heartbeat_at": {"$lt": (now - EXPORT_JOB_STALE_AFTER).isoformat()}}
+        ]},
+        {"$set": {"status": "running", "started_at": now.isoformat(), "heartbeat_at": now.isoformat()}},
+        sort=[("priority_rank", 1), ("created_at", 1)],
+        return_document=ReturnDocument.AFTER
+    )
+
+async def finish_export_job(job_id: str, status: str, **fields):
+    await db.export_jobs.update_one(
+        {"job_id": job_id},
+        {"$set": {"status": status, "finished_at": datetime.now(timezone.utc).isoformat(), **fields}}
+    )
+
+async def run_export_job(job: Dict[str, Any]):
+    """Render a claimed job and upload the result to the export file bucket"""
+    job_id = job["job_id"]
+    build, media_type, prefix, extension = EXPORT_JOB_FORMATS[job["format"]]
+    total = job.get("total") or 0
+    
+    async def progress(done: int):
+        # Rows read cover the first 90%; the last 10% is the final render and upload
+        state = await db.export_jobs.find_one_and_update(
+            {"job_id": job_id},
+            {"$set": {
+                "processed": done,
+                "progress": min(done * 90 // total, 90) if total else 90,
+                "heartbeat_at": datetime.now(timezone.utc).isoformat()
+            }},
+            projection={"_id": 0, "cancel_requested": 1}
+        )
+        if not state or state.get("cancel_requested"):
+            raise ExportJobCancelled()
     
-    # Activity data
-    for row, cert in enumerate(summary['certificates'], 2):
-        ws_activities.cell(row=row, column=1, value=cert.get('certificate_id', ''))
-        ws_activities.cell(row=row, column=2, value=cert.get('title', ''))
-        ws_activities.cell(row=row, column=3, value="Course")  # Default activity type
-        ws_activities.cell(row=row, column=4, value=cert.get('provider', ''))
-        ws_activities.cell(row=row, column=5, value=cert.get('accme_provider_number', ''))
+    try:
+        await progress(0)
+        user_doc = await db.users.find_one({"user_id": job["user_id"]}, {"_id": 0})
+        if not user_doc:
+            raise ValueError("User not found")
+        filters = TranscriptFilter(**job["filters"])
         
-        # Map credit types to ACCME categories
-        credit_type = cert.get('credit_type', '')
-        accme_credit = credit_type
-        if credit_type in ['ama_cat1', 'AMA PRA Category 1']:
-            accme_credit = 'AMA PRA Category 1 Credit(s)'
-        elif credit_type in ['ama_cat2', 'AMA PRA Category 2']:
-            accme_credit = 'AMA PRA Category 2 Credit(s)'
+        output = await build(User(**user_doc), filters, progress)
+        try:
+            await progress(total)
+            output.seek(0, io.SEEK_END)
+            size = output.tell()
+            output.seek(0)
+            filename = f"{prefix}_{filters.start_year}-{filters.end_year}.{extension}"
+            blob_id = await export_job_bucket.upload_from_stream(
+                filename,
+                output,
+                metadata={"user_id": job["user_id"], "job_id": job_id}
+            )
+        finally:
+            output.close()
         
-        ws_activities.cell(row=row, column=6, value=accme_credit)
-        ws_activities.cell(row=row, column=7, value=cert.get('credits', 0))
-        ws_activities.cell(row=row, column=8, value=cert.get('completion_date', ''))
-        ws_activities.cell(row=row, column=9, value=cert.get('completion_date', ''))
-        ws_activities.cell(row=row, column=10, value=cert.get('certificate_number', ''))
-        ws_activities.cell(row=row, column=11, value=cert.get('subject', ''))
-        ws_activities.cell(row=row, column=12, value='Live' if cert.get('location') else 'Enduring Material')
-    
-    # Adjust column widths
-    for ws in [ws_summary, ws_activities]:
-        for col in ws.columns:
-            max_length = 0
-            column = col[0].column_letter
-            for cell in col:
-                try:
-                    if len(str(cell.value)) > max_length:
-                        max_length = len(str(cell.value))
-                except:
-                    pass
-            ws.column_dimensions[column].width = min(max_length + 2, 50)
-    
-    buffer = io.BytesIO()
-    wb.save(buffer)
-    buffer.seek(0)
+        result = await db.export_jobs.update_one(
+            {"job_id": job_id, "cancel_requested": {"$ne": True}},
+            {"$set": {
+                "status": "completed",
+                "progress": 100,
+                "blob_id": blob_id,
+                "size": size,
+                "filename": filename,
+                "media_type": media_type,
+                "finished_at": datetime.now(timezone.utc).isoformat()
+            }}
+        )
+        if result.modified_count == 0:
+            # Cancelled while uploading
+            await export_job_bucket.delete(blob_id)
+            raise ExportJobCancelled()
+        await publish_event(job["user_id"], "export.ready", {
+            "job_id": job_id,
+            "format": job["format"],
+            "download_url": f"/api/reports/exports/{job_id}/download"
+        })
+    except ExportJobCancelled:
+        await finish_export_job(job_id, "cancelled")
+    except asyncio.CancelledError:
+        # Server shutting down: hand the job back to the queue
+        await db.export_jobs.update_one({"job_id": job_id}, {"$set": {"status": "queued", "progress": 0}})
+        raise
+    except Exception as e:
+        logger.error(f"Export job {job_id} failed: {e}")
+        await finish_export_job(job_id, "failed", error=str(e))
+        await publish_event(job["user_id"], "export.failed", {"job_id": job_id, "format": job["format"], "error": str(e)})
+
+async def export_job_heartbeat(job_id: str):
+    """Keep a running job's heartbeat fresh on a timer, as progress callbacks stop during the final render"""
+    while True:
+        await asyncio.sleep(EXPORT_JOB_HEARTBEAT_INTERVAL)
+        try:
+            await db.export_jobs.update_one(
+                {"job_id": job_id, "status": "running"},
+                {"$set": {"heartbeat_at": datetime.now(timezone.utc).isoformat()}}
+            )
+        except Exception as e:
+            logger.warning(f"Export job {job_id} heartbeat failed: {e}")
+
+async def export_job_worker():
+    """Claim and run export jobs until cancelled"""
+    while True:
+        try:
+            job = await claim_export_job()
+        except Exception as e:
+            logger.error(f"Failed to claim export job: {e}")
+            job = None
+        if job:
+            heartbeat = asyncio.create_task(export_job_heartbeat(job["job_id"]))
+            try:
+                await run_export_job(job)
+            finally:
+                heartbeat.cancel()
+            continue
+        
+        # Idle: wait for a local enqueue, polling for jobs queued by other instances
+        export_job_wakeup.clear()
+        try:
+            await asyncio.wait_for(export_job_wakeup.wait(), EXPORT_JOB_POLL_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+
+async def purge_expired_export_jobs(user_id: str):
+    """Delete a user's finished jobs, and their files, once past retention"""
+    cutoff = (datetime.now(timezone.utc) - EXPORT_JOB_RETENTION).isoformat()
+    expired = await db.export_jobs.find(
+        {"user_id": user_id, "status": {"$in": ["completed", "failed", "cancelled"]}, "finished_at": {"$lt": cutoff}},
+        {"_id": 0, "job_id": 1, "blob_id": 1}
+    ).to_list(None)
+    for job in expired:
+        if job.get("blob_id"):
+            try:
+                await export_job_bucket.delete(job["blob_id"])
+            except NoFile:
+                pass
+        await db.export_jobs.delete_one({"job_id": job["job_id"]})
+
+@api_router.post("/reports/exports")
+async def create_export_job(data: ExportJobCreate, user: User = Depends(rate_limited_user("export"))):
+    """Queue a transcript export to be rendered in the background"""
+    if data.format not in EXPORT_JOB_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unsupported format. Use one of: {', '.join(EXPORT_JOB_FORMATS)}")
+    if data.priority not in EXPORT_JOB_USER_PRIORITIES:
+        raise HTTPException(status_code=400, detail=f"Unsupported priority. Use one of: {', '.join(EXPORT_JOB_USER_PRIORITIES)}")
+    
+    filters = make_transcript_filter(data.start_year, data.end_year, data.credit_types, data.providers, data.subjects)
+    
+    active = await db.export_jobs.count_documents({"user_id": user.user_id, "status": {"$in": ["queued", "running"]}})
+    if active >= EXPORT_JOB_MAX_ACTIVE_PER_USER:
+        count_limit_hit("rate_limited", "export")
+        raise HTTPException(
+            status_code=429,
+            detail=f"At most {EXPORT_JOB_MAX_ACTIVE_PER_USER} exports can be queued at once. Wait for one to finish.",
+            headers={"Retry-After": str(int(EXPORT_JOB_POLL_INTERVAL * 15))}
+        )
     
-    return StreamingResponse(
-        buffer,
-        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        headers={"Content-Disposition": f"attachment; filename=accme_pars_report_{summary['year']}.xlsx"}
+    await purge_expired_export_jobs(user.user_id)
+    return export_job_view(await queue_export_job(user.user_id, data.format, filters, data.priority))
+
+async def queue_export_job(user_id: str, export_format: str, filters: TranscriptFilter, priority: str = "normal") -> Dict[str, Any]:
+    """Queue an export job and wake a worker; any priority, unlike the user-facing route"""
+    job = {
+        "job_id": f"export_{uuid.uuid4().hex[:12]}",
+        "user_id": user_id,
+        "format": export_format,
+        "filters": filters.model_dump(),
+        "priority": priority,
+        "priority_rank": EXPORT_JOB_PRIORITIES[priority],
+        "status": "queued",
+        "progress": 0,
+        "processed": 0,
+        "total": await db.certificates.count_documents(transcript_query(user_id, filters)),
+        "cancel_requested": False,
+        "created_at": datetime.now(timezone.utc).isoformat()
+    }
+    await db.export_jobs.insert_one(job)
+    export_job_wakeup.set()
+    return job
+
+@api_router.get("/reports/exports")
+async def get_export_jobs(user: User = Depends(get_current_user)):
+    """List the user's recent export jobs"""
+    jobs = await db.export_jobs.find(
+        {"user_id": user.user_id},
+        {"_id": 0}
+    ).sort("created_at", -1).to_list(50)
+    return [export_job_view(job) for job in jobs]
+
+@api_router.get("/reports/exports/{job_id}")
+async def get_export_job(job_id: str, user: User = Depends(get_current_user)):
+    """Get an export job's status and progress"""
+    job = await db.export_jobs.find_one({"job_id": job_id, "user_id": user.user_id}, {"_id": 0})
+    if not job:
+        raise HTTPException(status_code=404, detail="Export job not found")
+    return export_job_view(job)
+
+@api_router.post("/reports/exports/{job_id}/cancel")
+async def cancel_export_job(job_id: str, user: User = Depends(get_current_user)):
+    """Cancel a queued or running export job"""
+    now = datetime.now(timezone.utc).isoformat()
+    # Queued jobs are cancelled outright; running ones stop at their next progress check
+    job = await db.export_jobs.find_one_and_update(
+        {"job_id": job_id, "user_id": user.user_id, "status": "queued"},
+        {"$set": {"status": "cancelled", "cancel_requested": True, "finished_at": now}},
+        return_document=ReturnDocument.AFTER
     )
+    if not job:
+        job = await db.export_jobs.find_one_and_update(
+            {"job_id": job_id, "user_id": user.user_id, "status": "running"},
+            {"$set": {"cancel_requested": True}},
+            return_document=ReturnDocument.AFTER
+        )
+    if not job:
+        existing = await db.export_jobs.find_one({"job_id": job_id, "user_id": user.user_id}, {"_id": 0})
+        if not existing:
+            raise HTTPException(status_code=404, detail="Export job not found")
+        raise HTTPException(status_code=400, detail=f"Export job is already {existing['status']}")
+    return export_job_view(job)
+
+@api_router.get("/reports/exports/{job_id}/download")
+async def download_export_job(job_id: str, request: Request, user: User = Depends(get_current_user)):
+    """Download a completed export job's file"""
+    job = await db.export_jobs.find_one({"job_id": job_id, "user_id": user.user_id}, {"_id": 0})
+    if not job:
+        raise HTTPException(status_code=404, detail="Export job not found")
+    if job["status"] != "completed":
+        raise HTTPException(status_code=400, detail=f"Export job is {job['status']}")
+    try:
+        return await blob_response(
+            request,
+            export_job_bucket,
+            job["blob_id"],
+            job["media_type"],
+            {"Content-Disposition": f"attachment; filename={job['filename']}"}
+        )
+    except NoFile:
+        raise HTTPException(status_code=404, detail="Export file has expired")
+
+# ============ DELTA SYNC ============
+
+# Response key -> (collection, id field). Each is read in (updated_at, id) order from the
+# (user_id, updated_at, id) indexes, so a sync token is one keyset cursor per collection.
+SYNC_RESOURCES = {
+    "certificates": ("certificates", "certificate_id"),
+    "self_reported_credits": ("self_reported_credits", "credit_id"),
+    "events": ("cme_events", "event_id"),
+    "requirements": ("requirements", "requirement_id"),
+}
+SYNC_PAGE_SIZE = 200  # Per collection
+SYNC_PAGE_MAX = 1000
+# Changes this recent are sent again on the next sync, covering writes still in flight
+SYNC_SETTLE = timedelta(seconds=5)
+SYNC_TOMBSTONE_RETENTION = timedelta(days=30)
+SYNC_EPOCH = "1970-01-01T00:00:00+00:00"
+
+def encode_sync_token(cursors: Dict[str, tuple], issued: str) -> str:
+    raw = json.dumps({"c": cursors, "i": issued}, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(zlib.compress(raw, 9)).decode().rstrip("=")
+
+def decode_sync_token(token: str) -> Dict[str, Any]:
+    """Cursors and issue time from a sync token; 400 for anything we did not issue"""
+    try:
+        state = json.loads(zlib.decompress(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))))
+        cursors = {name: (str(ts), str(last_id)) for name, (ts, last_id) in state["c"].items()}
+        return {"cursors": cursors, "issued": str(state["i"])}
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid sync token")
+
+async def record_tombstones(user_id: str, resource: str, ids: List[str]):
+    """Remember deletions so delta sync can tell clients to drop them"""
+    if not ids:
+        return
+    now = datetime.now(timezone.utc)
+    await db.sync_tombstones.insert_many([
+        {
+            "tombstone_id": f"tomb_{uuid.uuid4().hex[:12]}",
+            "user_id": user_id,
+            "resource": resource,
+            "id": deleted_id,
+            "updated_at": now.isoformat(),
+            "expires_at": now + SYNC_TOMBSTONE_RETENTION
+        }
+        for deleted_id in ids
+    ])
+
+async def sync_page(
+    collection: str,
+    id_field: str,
+    user_id: str,
+    cursor: tuple,
+    limit: int,
+    projection: Dict[str, Any]
+) -> tuple:
+    """Documents changed after cursor, oldest first, and whether more remain"""
+    updated_at, last_id = cursor
+    docs = await db[collection].find(
+        {"user_id": user_id, "$or": [
+            {"updated_at": {"$gt": updated_at}},
+            {"updated_at": updated_at, id_field: {"$gt": last_id}}
+        ]},
+        projection
+    ).sort([("updated_at", 1), (id_field, 1)]).limit(limit + 1).to_list(limit + 1)
+    return docs[:limit], len(docs) > limit
+
+def sync_projection(collection: str) -> Dict[str, Any]:
+    if collection not in FIELD_VIEWS:
+        return {"_id": 0}
+    # The summary view leaves out heavy fields such as image_url; clients fetch those on demand
+    return {**build_projection(collection), "updated_at": 1}
+
+@api_router.get("/sync")
+async def delta_sync(
+    since: Optional[str] = None,
+    limit: int = Query(SYNC_PAGE_SIZE, ge=1, le=SYNC_PAGE_MAX),
+    user: User = Depends(get_current_user)
+):
+    """Certificates, self-reported credits, events and requirements changed since a sync token.
+
+    Without a token (or with one older than the tombstone retention, flagged by "reset")
+    everything is sent. Deletions come back in "deleted". Call again with "next" while
+    "has_more" is set; records may repeat across calls, so apply them by id.
+    """
+    now = datetime.now(timezone.utc)
+    settled = ((now - SYNC_SETTLE).isoformat(), "")
+    cursors: Dict[str, tuple] = {}
+    reset = False
+    if since:
+        state = decode_sync_token(since)
+        if state["issued"] < (now - SYNC_TOMBSTONE_RETENTION).isoformat():
+            # Deletions since then may already have been purged
+            reset = True
+        else:
+            cursors = state["cursors"]
+    if not cursors:
+        # A full sync has nothing to delete; only deletions from here on matter
+        cursors = {"deleted": settled}
+    
+    response: Dict[str, Any] = {}
+    next_cursors: Dict[str, tuple] = {}
+    has_more = False
+    pages = [(name, collection, id_field, sync_projection(collection)) for name, (collection, id_field) in SYNC_RESOURCES.items()]
+    pages.append(("deleted", "sync_tombstones", "tombstone_id", {"_id": 0, "tombstone_id": 1, "resource": 1, "id": 1, "updated_at": 1}))
+    for name, collection, id_field, projection in pages:
+        cursor = cursors.get(name, ("", ""))
+        docs, more = await sync_page(collection, id_field, user.user_id, cursor, limit, projection)
+        if docs:
+            cursor = (docs[-1]["updated_at"], docs[-1][id_field])
+        # Once caught up, step back to the settle window so in-flight writes are not skipped
+        next_cursors[name] = cursor if more else min(cursor, settled)
+        has_more = has_more or more
+        response[name] = docs
+    response["deleted"] = [{"resource": doc["resource"], "id": doc["id"]} for doc in response["deleted"]]
+    
+    return {
+        **response,
+        "has_more": has_more,
+        "reset": reset,
+        "next": encode_sync_token(next_cursors, now.isoformat())
+    }
+
+async def backfill_sync_timestamps():
+    """Give documents written before delta sync an updated_at, so a full sync includes them"""
+    for collection, _ in SYNC_RESOURCES.values():
+        await db[collection].update_many({"updated_at": {"$exists": False}}, {"$set": {"updated_at": SYNC_EPOCH}})
 
 # ============ DASHBOARD ROUTES ============
 
@@ -2226,7 +5919,7 @@ async def get_dashboard(user: User = Depends(get_current_user)):
     # Get recent certificates
     recent_certs = await db.certificates.find(
         {"user_id": user.user_id},
-        {"_id": 0}
+        build_projection("certificates", "summary")
     ).sort("created_at", -1).limit(5).to_list(5)
     
     # Get active requirements with progress
@@ -2235,20 +5928,13 @@ async def get_dashboard(user: User = Depends(get_current_user)):
         {"_id": 0}
     ).sort("due_date", 1).to_list(10)
     
-    # Get credits by type for current year
-    pipeline = [
-        {"$match": {"user_id": user.user_id, "completion_date": {"$regex": f"^{current_year}"}}},
-        {"$group": {"_id": "$credit_type", "total": {"$sum": "$credits"}, "count": {"$sum": 1}}}
-    ]
-    credits_by_type = await db.certificates.aggregate(pipeline).to_list(20)
-    
-    # Get total credits this year
-    total_pipeline = [
-        {"$match": {"user_id": user.user_id, "completion_date": {"$regex": f"^{current_year}"}}},
-        {"$group": {"_id": None, "total": {"$sum": "$credits"}}}
-    ]
-    total_result = await db.certificates.aggregate(total_pipeline).to_list(1)
-    total_credits = total_result[0]["total"] if total_result else 0
+    # Get credits by type and total credits for current year
+    breakdown = (await ledger_breakdown({"user_id": user.user_id, "year": current_year})).get(current_year, {})
+    credits_by_type = [
+        {"_id": credit_type, "total": totals["credits"], "count": totals["count"]}
+        for credit_type, totals in breakdown.get("by_credit_type", {}).items()
+    ][:20]
+    total_credits = breakdown.get("total_credits", 0)
     
     # Get upcoming deadlines
     upcoming = [r for r in requirements if r.get("due_date", "") >= datetime.now().strftime("%Y-%m-%d")][:5]
@@ -2263,9 +5949,303 @@ async def get_dashboard(user: User = Depends(get_current_user)):
         "year": current_year
     }
 
+# ============ METRICS ROUTES ============
+
+# Bearer token the metrics scraper sends; without one the endpoint is disabled
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN")
+
+def require_metrics_token(request: Request):
+    if not METRICS_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    auth_header = request.headers.get("Authorization") or ""
+    token = auth_header[len("Bearer "):] if auth_header.startswith("Bearer ") else ""
+    if not secrets.compare_digest(token.encode(), METRICS_TOKEN.encode()):
+        raise HTTPException(status_code=401, detail="Not authenticated")
+
+@api_router.get("/metrics", dependencies=[Depends(require_metrics_token)])
+async def get_metrics():
+    """Rate limit, overload, OCR and upload path counters in the Prometheus text format"""
+    lines = [
+        "# HELP cme_rate_limited_total Requests rejected with 429 by the per-user rate limiter",
+        "# TYPE cme_rate_limited_total counter",
+    ]
+    lines += [
+        f'cme_rate_limited_total{{route_class="{route_class}"}} {limit_metrics.get(("rate_limited", route_class), 0)}'
+        for route_class in RATE_LIMITS
+    ]
+    limiters = [ocr_limiter, render_limiter]
+    lines += [
+        "# HELP cme_overloaded_total Requests rejected with 503 by a concurrency limiter",
+        "# TYPE cme_overloaded_total counter",
+    ]
+    lines += [
+        f'cme_overloaded_total{{pool="{limiter.name}"}} {limit_metrics.get(("overloaded", limiter.name), 0)}'
+        for limiter in limiters
+    ]
+    for gauge, help_text in [("active", "Operations holding a slot"), ("waiting", "Operations queued for a slot")]:
+        lines += [f"# HELP cme_concurrency_{gauge} {help_text}", f"# TYPE cme_concurrency_{gauge} gauge"]
+        lines += [f'cme_concurrency_{gauge}{{pool="{limiter.name}"}} {getattr(limiter, gauge)}' for limiter in limiters]
+    ocr_counters = [
+        ("attempts", "cme_ocr_attempts_total", "counter", "OCR model calls per cascade tier"),
+        ("escalated", "cme_ocr_escalations_total", "counter", "OCR results passed on to a stronger tier"),
+        ("errors", "cme_ocr_errors_total", "counter", "OCR model calls that raised"),
+        ("latency_seconds", "cme_ocr_latency_seconds_total", "counter", "Time spent in OCR model calls"),
+        ("cost", "cme_ocr_cost_usd_total", "counter", "Estimated OCR spend from the configured per-call costs"),
+    ]
+    for key, metric, metric_type, help_text in ocr_counters:
+        lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} {metric_type}"]
+        lines += [
+            f'{metric}{{tier="{tier["name"]}"}} {ocr_tier_metrics.get(tier["name"], {}).get(key, 0)}'
+            for tier in OCR_CASCADE
+        ]
+    lines += [
+        "# HELP cme_ocr_template_total Certificates by provider template outcome (hit, fallback, miss, no_text_layer, learned, refined)",
+        "# TYPE cme_ocr_template_total counter",
+    ]
+    lines += [
+        f'cme_ocr_template_total{{outcome="{outcome}"}} {template_metrics.get(outcome, 0)}'
+        for outcome in ["hit", "fallback", "miss", "no_text_layer", "learned", "refined"]
+    ]
+    lines += [
+        "# HELP cme_certificate_uploads_total Certificate uploads by the path that filled them in",
+        "# TYPE cme_certificate_uploads_total counter",
+    ]
+    lines += [f'cme_certificate_uploads_total{{path="{path}"}} {upload_path_metrics.get(path, 0)}' for path in UPLOAD_PATHS]
+    lines += [
+        "# HELP cme_event_stream_connections Open Server-Sent Event streams on this worker",
+        "# TYPE cme_event_stream_connections gauge",
+        f"cme_event_stream_connections {event_hub.connections}",
+        "# HELP cme_events_dropped_total Events dropped because a stream's buffer was full",
+        "# TYPE cme_events_dropped_total counter",
+        f"cme_events_dropped_total {event_hub.dropped}",
+    ]
+    return PlainTextResponse("\n".join(lines) + "\n", media_type="text/plain; version=0.0.4")
+
+# ============ IDEMPOTENCY ============
+
+IDEMPOTENT_METHODS = {"POST", "PUT", "PATCH", "DELETE"}
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+IDEMPOTENCY_KEY_TTL = timedelta(hours=int(os.environ.get("IDEMPOTENCY_KEY_TTL_HOURS", "24")))
+IDEMPOTENCY_MAX_RESPONSE_BYTES = int(os.environ.get("IDEMPOTENCY_MAX_RESPONSE_BYTES", str(1024 * 1024)))
+IDEMPOTENCY_WAIT_TIMEOUT = 60
+IDEMPOTENCY_POLL_INTERVAL = 0.25
+# An in-progress key older than this belongs to a worker that died mid-request
+IDEMPOTENCY_LOCK_TIMEOUT = timedelta(minutes=10)
+# Responses that say nothing about the outcome of the request itself, so a retry should run it
+IDEMPOTENCY_UNSTORED_STATUSES = {401, 403, 408, 409, 429}
+# Request bodies are spooled while hashed, so uploads stay off the heap past this size
+IDEMPOTENCY_BODY_SPOOL_SIZE = 1024 * 1024
+IDEMPOTENCY_BODY_CHUNK_SIZE = 64 * 1024
+
+async def idempotency_user_id(request: Request) -> Optional[str]:
+    """User the idempotency key is scoped to; None leaves authentication to the route"""
+    session_token = get_session_token(request)
+    if not session_token:
+        return None
+    session = await db.user_sessions.find_one({"session_token": session_token}, {"_id": 0, "user_id": 1})
+    return session["user_id"] if session else None
+
+def idempotent_replay(record: Dict[str, Any]) -> Response:
+    """Rebuild the stored response for a retried request"""
+    response = Response(content=record["body"], status_code=record["status_code"])
+    response.raw_headers.extend(
+        (name.encode("latin-1"), value.encode("latin-1")) for name, value in record["headers"]
+    )
+    response.headers["Idempotent-Replayed"] = "true"
+    return response
+
+async def read_request_body(receive, content_type: str) -> Optional[tuple]:
+    """Spool a request body and hash it, or None when the client went away.
+
+    The multipart boundary is left out of the hash, as clients pick a new one
+    each time they rebuild a form for a retry.
+    """
+    boundary = b""
+    if content_type.startswith("multipart/"):
+        boundary = next((
+            part.split("=", 1)[1].strip().strip('"').encode("latin-1")
+            for part in content_type.split(";")[1:] if part.strip().lower().startswith("boundary=")
+        ), b"")
+    digest = hashlib.sha256()
+    spool = tempfile.SpooledTemporaryFile(max_size=IDEMPOTENCY_BODY_SPOOL_SIZE)
+    pending = b""
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            spool.close()
+            return None
+        chunk = message.get("body", b"")
+        spool.write(chunk)
+        more_body = message.get("more_body", False)
+        data = (pending + chunk).replace(boundary, b"") if boundary else chunk
+        # Hold back a possible boundary split across chunks
+        cut = len(data) - len(boundary) + 1 if boundary and more_body else len(data)
+        digest.update(data[:max(cut, 0)])
+        pending = data[max(cut, 0):]
+        if not more_body:
+            break
+    spool.seek(0)
+    return digest.hexdigest(), spool
+
+def replay_request_body(spool, receive):
+    """An ASGI receive that hands a spooled body to the app, then defers to the client"""
+    done = False
+
+    async def replay():
+        nonlocal done
+        if done:
+            return await receive()
+        chunk = spool.read(IDEMPOTENCY_BODY_CHUNK_SIZE)
+        done = len(chunk) < IDEMPOTENCY_BODY_CHUNK_SIZE
+        return {"type": "http.request", "body": chunk, "more_body": not done}
+    return replay
+
+async def claim_idempotency_key(user_id: str, key: str, method: str, path: str, body_hash: str) -> Optional[Response]:
+    """Claim an idempotency key for this request.
+
+    Returns None when the request should run, or the response to send instead:
+    the stored one when the key has completed, after waiting for it when it is
+    still in flight.
+    """
+    deadline = asyncio.get_running_loop().time() + IDEMPOTENCY_WAIT_TIMEOUT
+    while True:
+        now = datetime.now(timezone.utc)
+        try:
+            await db.idempotency_keys.insert_one({
+                "user_id": user_id,
+                "key": key,
+                "method": method,
+                "path": path,
+                "body_hash": body_hash,
+                "status": "in_progress",
+                "locked_at": now.isoformat(),
+                "created_at": now.isoformat(),
+                # A BSON date, as the TTL index requires
+                "expires_at": now + IDEMPOTENCY_KEY_TTL
+            })
+            return None
+        except DuplicateKeyError:
+            pass
+        
+        record = await db.idempotency_keys.find_one({"user_id": user_id, "key": key}, {"_id": 0})
+        if record is None:
+            continue  # Released by a failed request or expired in between
+        if record["method"] != method or record["path"] != path or record.get("body_hash") != body_hash:
+            return JSONResponse(
+                status_code=422,
+                content={"detail": "Idempotency-Key was already used for a different request"}
+            )
+        if record["status"] == "completed":
+            return idempotent_replay(record)
+        if record["locked_at"] < (now - IDEMPOTENCY_LOCK_TIMEOUT).isoformat():
+            await db.idempotency_keys.delete_one(
+                {"user_id": user_id, "key": key, "status": "in_progress", "locked_at": record["locked_at"]}
+            )
+            continue
+        if asyncio.get_running_loop().time() >= deadline:
+            return JSONResponse(
+                status_code=409,
+                content={"detail": "A request with this Idempotency-Key is still in progress"},
+                headers={"Retry-After": str(int(IDEMPOTENCY_POLL_INTERVAL * 20))}
+            )
+        await asyncio.sleep(IDEMPOTENCY_POLL_INTERVAL)
+
+class IdempotencyMiddleware:
+    """Run each mutating /api request carrying an Idempotency-Key at most once per user.
+
+    The key is bound to the request's method, path and body hash; reusing it
+    for anything else is rejected. The first request with a key runs and its
+    response is stored; retries get the stored response back, waiting for it
+    if the first is still running.
+    Failed requests (5xx, auth and rate-limit responses, exceptions) and
+    responses over IDEMPOTENCY_MAX_RESPONSE_BYTES release the key instead, so
+    a retry runs again.
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if (
+            scope["type"] != "http"
+            or scope["method"] not in IDEMPOTENT_METHODS
+            or not scope["path"].startswith("/api/")
+        ):
+            return await self.app(scope, receive, send)
+        
+        request = Request(scope)
+        key = request.headers.get("Idempotency-Key")
+        if not key:
+            return await self.app(scope, receive, send)
+        if len(key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+            response = JSONResponse(
+                status_code=400,
+                content={"detail": f"Idempotency-Key must be at most {IDEMPOTENCY_KEY_MAX_LENGTH} characters"}
+            )
+            return await response(scope, receive, send)
+        user_id = await idempotency_user_id(request)
+        if not user_id:
+            return await self.app(scope, receive, send)
+        
+        body = await read_request_body(receive, request.headers.get("content-type", ""))
+        if body is None:
+            return
+        body_hash, spool = body
+        try:
+            await self.run_once(scope, replay_request_body(spool, receive), send, user_id, key, body_hash)
+        finally:
+            spool.close()
+
+    async def run_once(self, scope, receive, send, user_id: str, key: str, body_hash: str):
+        response = await claim_idempotency_key(user_id, key, scope["method"], scope["path"], body_hash)
+        if response is not None:
+            return await response(scope, receive, send)
+        
+        captured = {"status": None, "headers": [], "body": bytearray(), "overflow": False}
+        
+        async def capture(message):
+            if message["type"] == "http.response.start":
+                captured["status"] = message["status"]
+                captured["headers"] = [
+                    [name.decode("latin-1"), value.decode("latin-1")]
+                    for name, value in message.get("headers", [])
+                    if name.lower() != b"content-length"
+                ]
+            elif message["type"] == "http.response.body" and not captured["overflow"]:
+                captured["body"] += message.get("body", b"")
+                if len(captured["body"]) > IDEMPOTENCY_MAX_RESPONSE_BYTES:
+                    captured["overflow"] = True
+                    captured["body"] = bytearray()
+            await send(message)
+        
+        record = {"user_id": user_id, "key": key}
+        try:
+            await self.app(scope, receive, capture)
+        except BaseException:
+            await db.idempotency_keys.delete_one(record)
+            raise
+        
+        status = captured["status"]
+        if (
+            status is None
+            or status >= 500
+            or status in IDEMPOTENCY_UNSTORED_STATUSES
+            or captured["overflow"]
+        ):
+            await db.idempotency_keys.delete_one(record)
+            return
+        await db.idempotency_keys.update_one(record, {"$set": {
+            "status": "completed",
+            "status_code": status,
+            "headers": captured["headers"],
+            "body": bytes(captured["body"]),
+            "completed_at": datetime.now(timezone.utc).isoformat()
+        }})
+
 # Include the router in the main app
 app.include_router(api_router)
 
+app.add_middleware(IdempotencyMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
@@ -2274,6 +6254,81 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.on_event("startup")
+async def create_indexes():
+    """Create the indexes the API relies on"""
+    await db.certificates.create_index([("user_id", 1), ("completion_date", -1), ("certificate_id", -1)])
+    await db.self_reported_credits.create_index([("user_id", 1), ("completion_date", -1), ("credit_id", -1)])
+    await db.cme_events.create_index([("user_id", 1), ("start_date", 1), ("event_id", 1)])
+    await db.evaluations.create_index([("user_id", 1), ("created_at", -1), ("evaluation_id", -1)])
+    await db.speaker_disclosures.create_index([("user_id", 1), ("created_at", -1), ("disclosure_id", -1)])
+    await db.course_materials.create_index([("user_id", 1), ("created_at", -1), ("material_id", -1)])
+    await db.requirements.create_index([("user_id", 1), ("due_date", 1), ("requirement_id", 1)])
+    await db.export_cache.create_index([("user_id", 1), ("year", 1), ("format", 1)])
+    await db.export_cache.create_index("last_accessed")
+    await db.export_jobs.create_index([("status", 1), ("priority_rank", 1), ("created_at", 1)])
+    await db.export_jobs.create_index([("user_id", 1), ("created_at", -1)])
+    await db.export_jobs.create_index([("user_id", 1), ("status", 1)])
+    await db.export_jobs.create_index("job_id")
+    await db.credit_ledger.create_index([("source", 1), ("source_id", 1)], unique=True)
+    await db.credit_ledger.create_index([("user_id", 1), ("year", 1), ("credit_types", 1)])
+    await db.certificates.create_index([("user_id", 1), ("credit_types", 1), ("completion_date", -1)])
+    await db.certificates.create_index([("user_id", 1), ("credit_type", 1), ("completion_date", -1), ("certificate_id", -1)])
+    await db.certificates.create_index(
+        "import_key",
+        unique=True,
+        partialFilterExpression={"import_key": {"$type": "string"}}
+    )
+    await db.self_reported_credits.create_index([("user_id", 1), ("credit_types", 1), ("completion_date", -1)])
+    await db.idempotency_keys.create_index([("user_id", 1), ("key", 1)], unique=True)
+    await db.idempotency_keys.create_index("expires_at", expireAfterSeconds=0)
+    await db.rate_limits.create_index("expires_at", expireAfterSeconds=0)
+    await db.certificate_image_hashes.create_index("certificate_id", unique=True)
+    await db.certificate_image_hashes.create_index([("user_id", 1), ("bands", 1)])
+    await db.certificates.create_index([("user_id", 1), ("credits", 1), ("completion_date", 1)])
+    await db.ocr_templates.create_index("template_id", unique=True)
+    await db.ocr_templates.create_index("anchors")
+    await db.certificates.create_index([("user_id", 1), ("updated_at", 1), ("certificate_id", 1)])
+    await db.self_reported_credits.create_index([("user_id", 1), ("updated_at", 1), ("credit_id", 1)])
+    await db.cme_events.create_index([("user_id", 1), ("updated_at", 1), ("event_id", 1)])
+    await db.requirements.create_index([("user_id", 1), ("updated_at", 1), ("requirement_id", 1)])
+    await db.sync_tombstones.create_index([("user_id", 1), ("updated_at", 1), ("tombstone_id", 1)])
+    await db.sync_tombstones.create_index("expires_at", expireAfterSeconds=0)
+
+@app.on_event("startup")
+async def start_data_migrations():
+    """Run data migrations in the background; each resumes if interrupted"""
+    async def migrate():
+        # Independent of each other, so one failing does not hold back the rest
+        for migration in (
+            normalize_credit_types,
+            backfill_credit_ledger,
+            migrate_inline_materials,
+            backfill_certificate_renditions,
+            backfill_image_hashes,
+            backfill_sync_timestamps,
+        ):
+            try:
+                await migration()
+            except Exception as e:
+                logger.error(f"Data migration {migration.__name__} failed: {e}")
+    asyncio.create_task(migrate())
+
+@app.on_event("startup")
+async def start_export_workers():
+    """Start the background export job workers"""
+    for _ in range(EXPORT_JOB_WORKERS):
+        export_job_workers.append(asyncio.create_task(export_job_worker()))
+
+@app.on_event("startup")
+async def start_event_bus():
+    await event_bus.start()
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    await event_bus.stop()
+    for worker in export_job_workers:
+        worker.cancel()
+    await asyncio.gather(*export_job_workers, return_exceptions=True)
+    export_job_workers.clear()
     client.close()
@@ -0,0 +1,1008 @@
+import pytest
+import requests
+import os
+import time
+import json
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', '').rstrip('/')
+SESSION_TOKEN = os.environ.get('TEST_SESSION_TOKEN', 'test_session_1772029888767')
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+
+@pytest.fixture
+def api_client():
+    session = requests.Session()
+    session.headers.update({
+        "Content-Type": "application/json",
+        "Authorization": f"Bearer {SESSION_TOKEN}"
+    })
+    return session
+
+
+def get_metrics():
+    """The metrics endpoint's text, read with the scraper's token"""
+    if not METRICS_TOKEN:
+        pytest.skip("METRICS_TOKEN not set")
+    r = requests.get(f"{BASE_URL}/api/metrics", headers={"Authorization": f"Bearer {METRICS_TOKEN}"})
+    assert r.status_code == 200
+    return r.text
+
+
+# ============ KEYSET PAGINATION ============
+
+class TestPagination:
+    def test_list_without_limit_stays_a_list(self, api_client):
+        """GET /api/certificates without limit/cursor keeps the legacy list response"""
+        r = api_client.get(f"{BASE_URL}/api/certificates")
+        assert r.status_code == 200
+        assert isinstance(r.json(), list)
+
+    def test_page_envelope(self, api_client):
+        """GET /api/certificates?limit=N returns items, has_more and next_cursor"""
+        r = api_client.get(f"{BASE_URL}/api/certificates?limit=2")
+        assert r.status_code == 200
+        data = r.json()
+        assert "items" in data
+        assert "has_more" in data
+        assert "next_cursor" in data
+        assert len(data["items"]) <= 2
+        if data["has_more"]:
+            assert data["next_cursor"]
+
+    def test_pages_do_not_overlap(self, api_client):
+        """Walking every page returns each certificate exactly once"""
+        ts = int(time.time())
+        for i in range(3):
+            payload = {
+                "title": f"TEST_Paginated_{ts}_{i}",
+                "provider": "TEST_Provider",
+                "credits": 1,
+                "credit_type": "ama_cat1",
+                "completion_date": "2025-02-01"
+            }
+            assert api_client.post(f"{BASE_URL}/api/certificates", json=payload).status_code == 200
+
+        all_ids = [c["certificate_id"] for c in api_client.get(f"{BASE_URL}/api/certificates").json()]
+        seen = []
+        cursor = None
+        while True:
+            url = f"{BASE_URL}/api/certificates?limit=2"
+            if cursor:
+                url += f"&cursor={cursor}"
+            data = api_client.get(url).json()
+            seen.extend(c["certificate_id"] for c in data["items"])
+            if not data["has_more"]:
+                break
+            cursor = data["next_cursor"]
+        assert sorted(seen) == sorted(all_ids)
+        assert len(seen) == len(set(seen))
+
+    def test_pagination_with_filters(self, api_client):
+        """Pagination works together with the year and credit_type filters"""
+        r = api_client.get(f"{BASE_URL}/api/certificates?limit=5&year=2025&credit_type=ama_cat1")
+        assert r.status_code == 200
+        for cert in r.json()["items"]:
+            assert cert["completion_date"].startswith("2025")
+
+    def test_invalid_cursor(self, api_client):
+        """A malformed cursor returns 400"""
+        r = api_client.get(f"{BASE_URL}/api/events?cursor=not-a-cursor")
+        assert r.status_code == 400
+
+
+# ============ FIELD PROJECTION ============
+
+class TestFieldProjection:
+    def test_list_default_is_lean(self, api_client):
+        """GET /api/certificates omits image_url and ocr_data by default"""
+        r = api_client.get(f"{BASE_URL}/api/certificates")
+        assert r.status_code == 200
+        for cert in r.json():
+            assert "image_url" not in cert
+            assert "ocr_data" not in cert
+
+    def test_fields_param(self, api_client):
+        """fields= restricts the returned keys"""
+        r = api_client.get(f"{BASE_URL}/api/self-reported?fields=title,credits")
+        assert r.status_code == 200
+        for credit in r.json():
+            assert set(credit) <= {"title", "credits", "completion_date", "credit_id"}
+
+    def test_unknown_view(self, api_client):
+        """An unknown view name returns 400"""
+        r = api_client.get(f"{BASE_URL}/api/materials?view=everything")
+        assert r.status_code == 400
+
+
+# ============ PDF TRANSCRIPT ============
+
+class TestPdfTranscript:
+    def test_pdf_includes_more_than_30_certificates(self, api_client):
+        """GET /api/reports/export/pdf renders without the old 30-certificate cap"""
+        ts = int(time.time())
+        for i in range(31):
+            payload = {
+                "title": f"TEST_PDF_{ts}_{i}",
+                "provider": "TEST_Provider",
+                "credits": 1,
+                "credit_types": ["ama_cat1"],
+                "completion_date": "2019-03-01"
+            }
+            assert api_client.post(f"{BASE_URL}/api/certificates", json=payload).status_code == 200
+
+        r = api_client.get(f"{BASE_URL}/api/reports/export/pdf?year=2019")
+        assert r.status_code == 200
+        assert r.headers["content-type"] == "application/pdf"
+        assert r.content.startswith(b"%PDF")
+
+
+# ============ HTML TRANSCRIPT ============
+
+class TestHtmlTranscript:
+    def test_html_escapes_user_content(self, api_client):
+        """GET /api/reports/export/html escapes certificate titles and providers"""
+        payload = {
+            "title": "TEST_<b>Escaped</b>",
+            "provider": "TEST_A&B",
+            "credits": 1,
+            "credit_types": ["ama_cat1"],
+            "completion_date": "2018-05-01"
+        }
+        assert api_client.post(f"{BASE_URL}/api/certificates", json=payload).status_code == 200
+
+        r = api_client.get(f"{BASE_URL}/api/reports/export/html?year=2018")
+        assert r.status_code == 200
+        assert "text/html" in r.headers["content-type"]
+        assert "TEST_&lt;b&gt;Escaped&lt;/b&gt;" in r.text
+        assert "TEST_A&amp;B" in r.text
+        assert "<b>Escaped</b>" not in r.text
+
+
+# ============ EXPORT CACHE ============
+
+class TestExportCache:
+    def test_repeat_download_is_identical(self, api_client):
+        """A repeat PDF download returns the same bytes with Content-Length"""
+        first = api_client.get(f"{BASE_URL}/api/reports/export/pdf?year=2024")
+        second = api_client.get(f"{BASE_URL}/api/reports/export/pdf?year=2024")
+        assert first.status_code == 200
+        assert second.status_code == 200
+        assert second.content == first.content
+        assert int(second.headers["content-length"]) == len(second.content)
+
+    def test_range_request(self, api_client):
+        """A cached export honours a byte Range"""
+        full = api_client.get(f"{BASE_URL}/api/reports/export/excel?year=2024")
+        assert full.status_code == 200
+        r = api_client.get(f"{BASE_URL}/api/reports/export/excel?year=2024", headers={"Range": "bytes=0-9"})
+        assert r.status_code == 206
+        assert r.content == full.content[:10]
+        assert r.headers["content-range"].startswith("bytes 0-9/")
+
+    def test_cache_invalidated_by_new_certificate(self, api_client):
+        """Adding a certificate changes the next export"""
+        before = api_client.get(f"{BASE_URL}/api/reports/export/pdf?year=2024")
+        assert before.status_code == 200
+        payload = {
+            "title": f"TEST_Cache_{int(time.time())}",
+            "provider": "TEST_Provider",
+            "credits": 1,
+            "credit_types": ["ama_cat1"],
+            "completion_date": "2024-07-01"
+        }
+        assert api_client.post(f"{BASE_URL}/api/certificates", json=payload).status_code == 200
+        after = api_client.get(f"{BASE_URL}/api/reports/export/pdf?year=2024")
+        assert after.status_code == 200
+        assert after.content != before.content
+
+
+# ============ STREAMING CSV / NDJSON ============
+
+class TestStreamingExports:
+    def test_csv_multi_year(self, api_client):
+        """GET /api/reports/export/csv streams a header and rows within the year range"""
+        r = api_client.get(f"{BASE_URL}/api/reports/export/csv?start_year=2023&end_year=2025")
+        assert r.status_code == 200
+        assert r.headers["content-type"].startswith("text/csv")
+        lines = r.text.splitlines()
+        assert lines[0].startswith("Source,ID,Title")
+        for line in lines[1:]:
+            assert any(f",{year}-" in line for year in (2023, 2024, 2025))
+
+    def test_ndjson_merges_sources_newest_first(self, api_client):
+        """NDJSON rows from certificates and self-reported credits come back in date order"""
+        r = api_client.get(f"{BASE_URL}/api/reports/export/ndjson?start_year=1990&end_year=2030")
+        assert r.status_code == 200
+        rows = [json.loads(line) for line in r.text.splitlines()]
+        dates = [row["completion_date"] for row in rows]
+        assert dates == sorted(dates, reverse=True)
+        assert {row["source"] for row in rows} <= {"certificate", "self_reported"}
+
+    def test_credit_type_filter(self, api_client):
+        """credit_types narrows both sources"""
+        r = api_client.get(f"{BASE_URL}/api/reports/export/ndjson?start_year=1990&end_year=2030&credit_types=ama_cat1")
+        assert r.status_code == 200
+        for line in r.text.splitlines():
+            assert "ama_cat1" in json.loads(line)["credit_types"]
+
+    def test_inverted_year_range(self, api_client):
+        r = api_client.get(f"{BASE_URL}/api/reports/export/csv?start_year=2025&end_year=2020")
+        assert r.status_code == 400
+
+
+# ============ EXPORT JOBS ============
+
+def wait_for_export_job(api_client, job_id, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = api_client.get(f"{BASE_URL}/api/reports/exports/{job_id}").json()
+        if job["status"] in ("completed", "failed", "cancelled"):
+            return job
+        time.sleep(0.5)
+    raise AssertionError(f"Export job {job_id} did not finish")
+
+
+class TestExportJobs:
+    def test_multi_year_job_completes(self, api_client):
+        """POST /api/reports/exports renders a multi-year PDF in the background"""
+        r = api_client.post(f"{BASE_URL}/api/reports/exports", json={
+            "format": "pdf",
+            "start_year": 2022,
+            "end_year": 2024
+        })
+        assert r.status_code == 200
+        job = r.json()
+        assert job["status"] == "queued"
+        assert job["filters"]["start_year"] == 2022
+
+        job = wait_for_export_job(api_client, job["job_id"])
+        assert job["status"] == "completed"
+        assert job["progress"] == 100
+        download = api_client.get(f"{BASE_URL}{job['download_url']}")
+        assert download.status_code == 200
+        assert download.content.startswith(b"%PDF")
+        assert int(download.headers["content-length"]) == job["size"]
+
+    def test_filtered_job_counts_matching_certificates(self, api_client):
+        """Credit type filters narrow the rows an export job covers"""
+        everything = api_client.post(f"{BASE_URL}/api/reports/exports", json={
+            "format": "excel", "start_year": 1990, "end_year": 2030
+        }).json()
+        filtered = api_client.post(f"{BASE_URL}/api/reports/exports", json={
+            "format": "excel", "start_year": 1990, "end_year": 2030, "credit_types": ["TEST_no_such_type"]
+        }).json()
+        assert filtered["total"] == 0
+        assert everything["total"] >= filtered["total"]
+
+    def test_cancel_job(self, api_client):
+        """A cancelled job never becomes downloadable"""
+        job = api_client.post(f"{BASE_URL}/api/reports/exports", json={
+            "format": "pars", "start_year": 1990, "end_year": 2030, "priority": "low"
+        }).json()
+        r = api_client.post(f"{BASE_URL}/api/reports/exports/{job['job_id']}/cancel")
+        if r.status_code == 400:
+            pytest.skip("Job finished before it could be cancelled")
+        assert r.status_code == 200
+        job = wait_for_export_job(api_client, job["job_id"])
+        assert job["status"] == "cancelled"
+        r = api_client.get(f"{BASE_URL}/api/reports/exports/{job['job_id']}/download")
+        assert r.status_code == 400
+
+    def test_invalid_requests(self, api_client):
+        """Unknown formats and inverted year ranges are rejected"""
+        r = api_client.post(f"{BASE_URL}/api/reports/exports", json={"format": "docx"})
+        assert r.status_code == 400
+        r = api_client.post(f"{BASE_URL}/api/reports/exports", json={"format": "pdf", "start_year": 2025, "end_year": 2020})
+        assert r.status_code == 400
+        r = api_client.get(f"{BASE_URL}/api/reports/exports/export_missing")
+        assert r.status_code == 404
+
+    def test_users_cannot_jump_the_queue(self, api_client):
+        """High priority is reserved for jobs the server queues itself"""
+        r = api_client.post(f"{BASE_URL}/api/reports/exports", json={"format": "pdf", "priority": "high"})
+        assert r.status_code == 400
+
+
+# ============ CREDIT LEDGER ============
+
+class TestCreditLedger:
+    def test_summary_includes_self_reported_credits(self, api_client):
+        """Self-reported credits count toward report totals"""
+        before = api_client.get(f"{BASE_URL}/api/reports/summary?year=2024").json()
+        r = api_client.post(f"{BASE_URL}/api/self-reported", json={
+            "activity_type": "journal_club",
+            "title": f"TEST_Ledger_{int(time.time())}",
+            "credits": 1.5,
+            "credit_types": ["ama_cat2"],
+            "completion_date": "2024-08-01"
+        })
+        assert r.status_code == 200
+        credit_id = r.json()["credit_id"]
+
+        after = api_client.get(f"{BASE_URL}/api/reports/summary?year=2024").json()
+        assert after["total_self_reported"] == before["total_self_reported"] + 1
+        assert abs(after["total_credits"] - before["total_credits"] - 1.5) < 1e-9
+        assert "ama_cat2" in after["by_credit_type"]
+
+        yoy = api_client.get(f"{BASE_URL}/api/reports/year-over-year?start_year=2024&end_year=2024").json()
+        assert yoy["years"][0]["total_credits"] == after["total_credits"]
+
+        api_client.delete(f"{BASE_URL}/api/self-reported/{credit_id}")
+        restored = api_client.get(f"{BASE_URL}/api/reports/summary?year=2024").json()
+        assert restored["total_self_reported"] == before["total_self_reported"]
+
+    def test_requirement_counts_both_sources(self, api_client):
+        """Requirement progress sums certificates and self-reported credits"""
+        r = api_client.post(f"{BASE_URL}/api/requirements", json={
+            "name": "TEST_Ledger_Requirement",
+            "requirement_type": "personal",
+            "credit_types": ["ama_cat1", "ama_cat2"],
+            "credits_required": 50,
+            "due_date": "2030-12-31"
+        })
+        assert r.status_code == 200
+        req = r.json()
+        assert req["credits_earned"] >= 0
+        assert "matching_certificates" in req
+        assert "matching_self_reported" in req
+        api_client.delete(f"{BASE_URL}/api/requirements/{req['requirement_id']}")
+
+
+# ============ CREDIT TYPES ============
+
+class TestCreditTypes:
+    def test_legacy_credit_type_is_normalized(self, api_client):
+        """A certificate created with only credit_type is stored with credit_types and found by filter"""
+        r = api_client.post(f"{BASE_URL}/api/certificates", json={
+            "title": f"TEST_Legacy_Type_{int(time.time())}",
+            "provider": "TEST_Provider",
+            "credits": 1,
+            "credit_type": "ethics",
+            "completion_date": "2024-03-01"
+        })
+        assert r.status_code == 200
+        cert = r.json()
+        assert cert["credit_types"] == ["ethics"]
+        assert cert["credit_type"] == "ethics"
+
+        r = api_client.get(f"{BASE_URL}/api/certificates?credit_type=ethics")
+        assert r.status_code == 200
+        assert cert["certificate_id"] in [c["certificate_id"] for c in r.json()]
+        api_client.delete(f"{BASE_URL}/api/certificates/{cert['certificate_id']}")
+
+    def test_certificate_without_type_gets_placeholder(self, api_client):
+        r = api_client.post(f"{BASE_URL}/api/certificates", json={
+            "title": f"TEST_No_Type_{int(time.time())}",
+            "provider": "TEST_Provider",
+            "credits": 1,
+            "completion_date": "2024-03-01"
+        })
+        assert r.status_code == 200
+        assert r.json()["credit_types"] == ["unknown"]
+        api_client.delete(f"{BASE_URL}/api/certificates/{r.json()['certificate_id']}")
+
+
+# ============ BULK IMPORT ============
+
+class TestBulkImport:
+    def test_reimport_is_deduplicated(self, api_client):
+        """Importing the same rows twice only creates the certificates once"""
+        ts = int(time.time())
+        rows = [
+            {"title": f"TEST_Dedup_{ts}_{i}", "provider": "TEST_Provider", "credits": "1.5",
+             "credit_types": "ama_cat1, moc", "completion_date": "2024-05-01", "certificate_number": i}
+            for i in range(3)
+        ]
+        first = api_client.post(f"{BASE_URL}/api/certificates/bulk-import", json={"certificates": rows}).json()
+        assert first["imported_count"] == 3
+        assert first["imported"][0]["credit_types"] == ["ama_cat1", "moc"]
+
+        second = api_client.post(f"{BASE_URL}/api/certificates/bulk-import", json={"certificates": rows}).json()
+        assert second["imported_count"] == 0
+        assert second["duplicate_count"] == 3
+        assert all(e["error"] == "Duplicate certificate" for e in second["errors"])
+
+        for cert in first["imported"]:
+            api_client.delete(f"{BASE_URL}/api/certificates/{cert['certificate_id']}")
+
+    def test_row_errors_are_numbered(self, api_client):
+        rows = [
+            {"title": "TEST_Row_Error", "provider": "TEST_Provider", "completion_date": "2024-01-01", "credits": "abc"},
+            {"provider": "TEST_Provider", "completion_date": "2024-01-01"},
+        ]
+        r = api_client.post(f"{BASE_URL}/api/certificates/bulk-import", json={"certificates": rows})
+        assert r.status_code == 200
+        errors = r.json()["errors"]
+        assert [e["row"] for e in errors] == [1, 2]
+        assert errors[1]["error"] == "Missing title"
+
+
+# ============ FILE IMPORT ============
+
+class TestFileImport:
+    def test_csv_file_import_streams_progress(self):
+        """POST /api/certificates/import-file reports progress and totals as NDJSON"""
+        ts = int(time.time())
+        csv_data = "title,provider,credits,credit_types,completion_date\n"
+        csv_data += f"TEST_File_{ts},TEST_Provider,1.5,ama_cat1;moc,2024-02-01\n"
+        csv_data += ",TEST_Provider,1,ama_cat1,2024-02-01\n"
+        r = requests.post(
+            f"{BASE_URL}/api/certificates/import-file",
+            headers={"Authorization": f"Bearer {SESSION_TOKEN}"},
+            files={"file": ("import.csv", csv_data.encode(), "text/csv")}
+        )
+        assert r.status_code == 200
+        events = [json.loads(line) for line in r.text.splitlines()]
+        assert events[0]["type"] == "progress"
+        assert events[0]["errors"] == [{"row": 3, "error": "Missing title"}]
+        assert events[-1]["type"] == "complete"
+        assert events[-1]["imported_count"] == 1
+        assert events[-1]["error_count"] == 1
+
+    def test_unsupported_file_type(self):
+        r = requests.post(
+            f"{BASE_URL}/api/certificates/import-file",
+            headers={"Authorization": f"Bearer {SESSION_TOKEN}"},
+            files={"file": ("import.txt", b"hello", "text/plain")}
+        )
+        assert r.status_code == 400
+
+
+# ============ EEDS BATCH IMPORT ============
+
+class TestEEDSBatchImport:
+    def test_batch_parses_and_dedupes(self, api_client):
+        """One request imports every distinct scanned code, whatever its payload format"""
+        ts = int(time.time())
+        codes = [
+            json.dumps({"activity": f"TEST_EEDS_Json_{ts}", "organization": "TEST_EEDS", "credit_hours": "2.5",
+                        "date": "06/15/2025", "id": f"EJ-{ts}"}),
+            f"https://www.eeds.com/verify/EU-{ts}?title=TEST_EEDS_Url_{ts}&hours=1.0",
+            f"title=TEST_EEDS_Query_{ts}&provider=TEST_EEDS&cert=EQ-{ts}&date=20250102",
+            f"Title: TEST_EEDS_Pipe_{ts} | Provider: TEST_EEDS | Credits: 3 AMA PRA | Cert #: EP-{ts}",
+            json.dumps({"title": "scanned twice", "id": f"EJ-{ts}"}),
+        ]
+        r = api_client.post(f"{BASE_URL}/api/certificates/eeds-import-batch", json={"qr_codes": codes})
+        assert r.status_code == 200
+        data = r.json()
+        assert data["imported_count"] == 4
+        assert data["duplicates"] == [{"row": 5, "certificate_number": f"EJ-{ts}"}]
+
+        by_number = {cert["certificate_number"]: cert for cert in data["imported"]}
+        assert by_number[f"EJ-{ts}"]["credits"] == 2.5
+        assert by_number[f"EJ-{ts}"]["completion_date"] == "2025-06-15"
+        assert by_number[f"EU-{ts}"]["title"] == f"TEST_EEDS_Url_{ts}"
+        assert by_number[f"EQ-{ts}"]["completion_date"] == "2025-01-02"
+        assert by_number[f"EP-{ts}"]["credits"] == 3.0
+        assert all(cert["eeds_imported"] for cert in data["imported"])
+
+        again = api_client.post(f"{BASE_URL}/api/certificates/eeds-import-batch", json={"qr_codes": codes}).json()
+        assert again["imported_count"] == 0
+        assert again["duplicate_count"] == 5
+
+        for cert in data["imported"]:
+            api_client.delete(f"{BASE_URL}/api/certificates/{cert['certificate_id']}")
+
+    def test_single_import_parses_qr_data(self, api_client):
+        ts = int(time.time())
+        qr = f"title=TEST_EEDS_Single_{ts}&provider=TEST_EEDS&credits=1.5&cert=ES-{ts}"
+        r = api_client.post(f"{BASE_URL}/api/certificates/eeds-import", json={"qr_data": qr})
+        assert r.status_code == 200
+        cert = r.json()
+        assert cert["title"] == f"TEST_EEDS_Single_{ts}"
+        assert cert["credits"] == 1.5
+        assert cert["certificate_number"] == f"ES-{ts}"
+        api_client.delete(f"{BASE_URL}/api/certificates/{cert['certificate_id']}")
+
+    def test_empty_batch_rejected(self, api_client):
+        r = api_client.post(f"{BASE_URL}/api/certificates/eeds-import-batch", json={"qr_codes": []})
+        assert r.status_code == 400
+
+    def test_batch_rejects_codes_that_are_not_certificates(self, api_client):
+        ts = int(time.time())
+        codes = [
+            "Dr. Smith: great course",
+            f"title=TEST_EEDS_BadDate_{ts}&credits=1&date=2025-13-45",
+            f"https://www.eeds.com/cert?title=TEST_EEDS_Route_{ts}&credits=2.5",
+        ]
+        r = api_client.post(f"{BASE_URL}/api/certificates/eeds-import-batch", json={"qr_codes": codes})
+        assert r.status_code == 200
+        data = r.json()
+        assert [error["row"] for error in data["errors"]] == [1, 2]
+        assert data["imported_count"] == 1
+        assert data["imported"][0]["certificate_number"] is None
+        api_client.delete(f"{BASE_URL}/api/certificates/{data['imported'][0]['certificate_id']}")
+
+    def test_single_import_rejects_free_text(self, api_client):
+        r = api_client.post(f"{BASE_URL}/api/certificates/eeds-import", json={"qr_data": "Dr. Smith: great course"})
+        assert r.status_code == 400
+
+
+# ============ IDEMPOTENCY KEYS ============
+
+class TestIdempotencyKeys:
+    def test_retry_replays_stored_response(self, api_client):
+        """A retried request with the same Idempotency-Key does not create a second certificate"""
+        ts = int(time.time())
+        key = f"TEST_idem_{ts}"
+        payload = {"qr_data": f"cert=EI-{ts}", "title": f"TEST_Idempotent_{ts}", "provider": "TEST_Provider"}
+        headers = {"Idempotency-Key": key}
+        first = api_client.post(f"{BASE_URL}/api/certificates/eeds-import", json=payload, headers=headers)
+        retry = api_client.post(f"{BASE_URL}/api/certificates/eeds-import", json=payload, headers=headers)
+        assert first.status_code == retry.status_code == 200
+        assert retry.headers.get("Idempotent-Replayed") == "true"
+        assert retry.json()["certificate_id"] == first.json()["certificate_id"]
+        api_client.delete(f"{BASE_URL}/api/certificates/{first.json()['certificate_id']}")
+
+    def test_key_reused_for_different_route(self, api_client):
+        key = f"TEST_idem_reuse_{int(time.time())}"
+        r = api_client.post(f"{BASE_URL}/api/certificates/bulk-import", json={"certificates": []},
+                            headers={"Idempotency-Key": key})
+        assert r.status_code == 400
+        r = api_client.post(f"{BASE_URL}/api/certificates/eeds-import-batch", json={"qr_codes": []},
+                            headers={"Idempotency-Key": key})
+        assert r.status_code == 422
+
+    def test_key_reused_with_different_body(self, api_client):
+        ts = int(time.time())
+        headers = {"Idempotency-Key": f"TEST_idem_body_{ts}"}
+        first = api_client.post(f"{BASE_URL}/api/certificates/eeds-import", headers=headers,
+                                json={"qr_data": f"cert=EB-{ts}", "title": f"TEST_Idempotent_A_{ts}"})
+        assert first.status_code == 200
+        other = api_client.post(f"{BASE_URL}/api/certificates/eeds-import", headers=headers,
+                                json={"qr_data": f"cert=EB-{ts}", "title": f"TEST_Idempotent_B_{ts}"})
+        assert other.status_code == 422
+        api_client.delete(f"{BASE_URL}/api/certificates/{first.json()['certificate_id']}")
+
+
+# ============ RATE LIMITING ============
+
+class TestRateLimiting:
+    def test_npi_validation_is_rate_limited(self, api_client):
+        """Hammering NPI validation is eventually rejected with 429 and Retry-After"""
+        for _ in range(50):
+            r = api_client.post(f"{BASE_URL}/api/users/npi/validate", json={"npi": ""})
+            if r.status_code == 429:
+                break
+            assert r.status_code == 400
+        assert r.status_code == 429
+        assert int(r.headers["Retry-After"]) >= 1
+
+        metrics = get_metrics()
+        assert 'cme_rate_limited_total{route_class="npi"}' in metrics
+        assert 'cme_concurrency_active{pool="ocr"}' in metrics
+
+    def test_metrics_require_scraper_token(self, api_client):
+        assert requests.get(f"{BASE_URL}/api/metrics").status_code in (401, 404)
+        assert api_client.get(f"{BASE_URL}/api/metrics").status_code in (401, 404)
+
+
+# ============ COURSE MATERIAL FILES ============
+
+class TestMaterialContent:
+    def test_upload_and_range_download(self, api_client):
+        """Materials are stored out of line and served with Range and ETag support"""
+        data = bytes(range(256)) * 4096
+        r = requests.post(
+            f"{BASE_URL}/api/materials",
+            params={"title": "TEST_Lecture", "material_type": "video"},
+            headers={"Authorization": f"Bearer {SESSION_TOKEN}"},
+            files={"file": ("TEST_lecture.mp4", data, "video/mp4")}
+        )
+        assert r.status_code == 200
+        material = r.json()
+        assert material["file_size"] == len(data)
+        assert material["file_url"] == f"/api/materials/{material['material_id']}/content"
+        content_url = f"{BASE_URL}{material['file_url']}"
+
+        full = api_client.get(content_url)
+        assert full.status_code == 200
+        assert full.content == data
+        etag = full.headers["ETag"]
+
+        partial = api_client.get(content_url, headers={"Range": "bytes=1000-1999"})
+        assert partial.status_code == 206
+        assert partial.content == data[1000:2000]
+        assert partial.headers["Content-Range"] == f"bytes 1000-1999/{len(data)}"
+
+        assert api_client.get(content_url, headers={"If-None-Match": etag}).status_code == 304
+
+        api_client.delete(f"{BASE_URL}/api/materials/{material['material_id']}")
+        assert api_client.get(content_url).status_code == 404
+
+
+# ============ CERTIFICATE RENDITIONS ============
+
+class TestCertificateRenditions:
+    def test_upload_creates_webp_previews(self, api_client):
+        """Uploaded certificates get small WebP renditions instead of shipping the original"""
+        from PIL import Image
+        import io
+
+        image = Image.new("RGB", (2400, 1800), (240, 240, 230))
+        original = io.BytesIO()
+        image.save(original, "JPEG", quality=95)
+        r = requests.post(
+            f"{BASE_URL}/api/certificates/upload",
+            headers={"Authorization": f"Bearer {SESSION_TOKEN}"},
+            files={"file": ("TEST_rendition.jpg", original.getvalue(), "image/jpeg")}
+        )
+        assert r.status_code == 200
+        cert = r.json()
+        assert cert["thumbnail_url"].endswith("/renditions/thumbnail")
+
+        # Rendered in the background, or on first request if that has not finished
+        thumbnail = api_client.get(f"{BASE_URL}{cert['thumbnail_url']}")
+        preview = api_client.get(f"{BASE_URL}{cert['preview_url']}")
+        assert thumbnail.status_code == preview.status_code == 200
+        assert thumbnail.headers["Content-Type"] == "image/webp"
+        assert max(Image.open(io.BytesIO(thumbnail.content)).size) <= 160
+        assert len(preview.content) < len(original.getvalue())
+
+        not_modified = api_client.get(f"{BASE_URL}{cert['thumbnail_url']}",
+                                      headers={"If-None-Match": thumbnail.headers["ETag"]})
+        assert not_modified.status_code == 304
+        api_client.delete(f"{BASE_URL}/api/certificates/{cert['certificate_id']}")
+
+    def test_shared_rendition_outlives_one_certificate(self, api_client):
+        """Identical scans share a rendition, which stays until the last certificate using it is deleted"""
+        from PIL import Image
+        import io
+
+        original = io.BytesIO()
+        Image.new("RGB", (800, 600), (200, 220, 240)).save(original, "JPEG")
+        certs = []
+        for _ in range(2):
+            r = requests.post(
+                f"{BASE_URL}/api/certificates/upload?allow_duplicate=true",
+                headers={"Authorization": f"Bearer {SESSION_TOKEN}"},
+                files={"file": ("TEST_shared_rendition.jpg", original.getvalue(), "image/jpeg")}
+            )
+            assert r.status_code == 200
+            certs.append(r.json())
+        first, second = [api_client.get(f"{BASE_URL}{cert['thumbnail_url']}") for cert in certs]
+        assert first.headers["ETag"] == second.headers["ETag"]
+
+        api_client.delete(f"{BASE_URL}/api/certificates/{certs[0]['certificate_id']}")
+        assert api_client.get(f"{BASE_URL}{certs[1]['thumbnail_url']}").content == second.content
+        api_client.delete(f"{BASE_URL}/api/certificates/{certs[1]['certificate_id']}")
+
+
+# ============ IMAGE DUPLICATE DETECTION ============
+
+def certificate_scan(size, seed):
+    """A synthetic certificate image; the same seed gives the same content"""
+    from PIL import Image, ImageDraw
+    import io
+    import random
+
+    rng = random.Random(seed)
+    image = Image.new("RGB", (1600, 1200), (250, 248, 240))
+    draw = ImageDraw.Draw(image)
+    draw.rectangle([40, 40, 1560, 1160], outline=(20, 20, 120), width=12)
+    for i in range(8):
+        x = rng.randint(100, 600)
+        draw.rectangle([x, 150 + i * 110, x + rng.randint(300, 800), 190 + i * 110], fill=(30, 30, 30))
+    output = io.BytesIO()
+    image.resize(size).save(output, "JPEG", quality=70)
+    return output.getvalue()
+
+
+class TestImageDuplicates:
+    def upload(self, data, **params):
+        return requests.post(
+            f"{BASE_URL}/api/certificates/upload",
+            params=params,
+            headers={"Authorization": f"Bearer {SESSION_TOKEN}"},
+            files={"file": ("TEST_scan.jpg", data, "image/jpeg")}
+        )
+
+    def test_rescan_is_flagged_before_ocr(self, api_client):
+        seed = int(time.time())
+        first = self.upload(certificate_scan((1600, 1200), seed))
+        assert first.status_code == 200
+        cert_id = first.json()["certificate_id"]
+
+        rescan = self.upload(certificate_scan((1200, 900), seed))
+        assert rescan.status_code == 409
+        duplicates = rescan.json()["detail"]["duplicates"]
+        assert duplicates[0]["certificate_id"] == cert_id
+
+        forced = self.upload(certificate_scan((1200, 900), seed), allow_duplicate="true")
+        assert forced.status_code == 200
+        groups = api_client.get(f"{BASE_URL}/api/certificates/duplicates/images").json()["groups"]
+        assert any(
+            {cert_id, forced.json()["certificate_id"]} <= {c["certificate_id"] for c in group["certificates"]}
+            for group in groups
+        )
+
+        for response in (first, forced):
+            api_client.delete(f"{BASE_URL}/api/certificates/{response.json()['certificate_id']}")
+
+
+# ============ METADATA DUPLICATES ============
+
+class TestMetadataDuplicates:
+    def test_find_and_merge_duplicates(self, api_client):
+        """The same activity entered twice with different wording is grouped and can be merged"""
+        ts = int(time.time())
+        first = api_client.post(f"{BASE_URL}/api/certificates", json={
+            "title": f"TEST Cardiology Grand Rounds Heart Failure {ts}", "provider": "TEST Mayo Clinic",
+            "credits": 1.75, "credit_types": ["ama_cat1"], "completion_date": "2016-03-10"
+        }).json()
+        second = api_client.post(f"{BASE_URL}/api/certificates", json={
+            "title": f"Heart Failure - TEST Cardiology Grand Rounds {ts}", "provider": "TEST Mayo Clinic CPD",
+            "credits": 1.75, "credit_types": ["ama_cat1"], "completion_date": "2016-03-11", "subject": "Cardiology"
+        }).json()
+        ids = {first["certificate_id"], second["certificate_id"]}
+
+        r = api_client.get(f"{BASE_URL}/api/certificates/duplicates")
+        assert r.status_code == 200
+        group = next(g for g in r.json()["groups"] if ids <= {c["certificate_id"] for c in g["certificates"]})
+        assert group["score"] >= 0.8
+
+        r = api_client.post(f"{BASE_URL}/api/certificates/merge", json={
+            "keep_id": first["certificate_id"], "merge_ids": [second["certificate_id"]]
+        })
+        assert r.status_code == 200
+        assert r.json()["subject"] == "Cardiology"
+        assert api_client.get(f"{BASE_URL}/api/certificates/{second['certificate_id']}").status_code == 404
+
+        api_client.delete(f"{BASE_URL}/api/certificates/{first['certificate_id']}")
+
+    def test_merge_rejects_keeping_a_merged_id(self, api_client):
+        r = api_client.post(f"{BASE_URL}/api/certificates/merge", json={"keep_id": "cert_x", "merge_ids": ["cert_x"]})
+        assert r.status_code == 400
+
+
+# ============ CREDIT TYPE MATCHING ============
+
+CREDIT_TYPE_CORPUS = os.path.join(os.path.dirname(__file__), "credit_type_corpus.json")
+
+
+class TestCreditTypeMatching:
+    def test_labeled_corpus(self, api_client):
+        """Every labeled certificate wording maps to exactly its expected credit types"""
+        with open(CREDIT_TYPE_CORPUS) as f:
+            corpus = json.load(f)
+        failures = []
+        for case in corpus:
+            r = api_client.get(f"{BASE_URL}/api/cme-types/match", params={"text": case["text"]})
+            assert r.status_code == 200
+            if r.json()["credit_types"] != case["expected"]:
+                failures.append((case["text"], r.json()["credit_types"], case["expected"]))
+        assert not failures, failures
+
+    def test_longest_phrase_wins(self, api_client):
+        r = api_client.get(f"{BASE_URL}/api/cme-types/match", params={"text": "AAPA Category 1 CME"})
+        match = r.json()["matches"][0]
+        assert match["credit_type_id"] == "aapa_cat1"
+        assert match["confidence"] == 1.0
+
+    def test_custom_types_are_matched(self, api_client):
+        name = f"TEST Tumor Board {int(time.time())}"
+        custom = api_client.post(f"{BASE_URL}/api/cme-types/custom", json={"name": name}).json()
+        r = api_client.get(f"{BASE_URL}/api/cme-types/match", params={"text": f"1 hour {name} attendance"})
+        assert r.json()["credit_types"] == [custom["credit_type_id"]]
+        api_client.delete(f"{BASE_URL}/api/cme-types/custom/{custom['credit_type_id']}")
+
+
+# ============ OCR MODEL CASCADE ============
+
+class TestOcrCascadeMetrics:
+    def test_metrics_report_every_cascade_tier(self):
+        metrics = get_metrics()
+        for metric in ["cme_ocr_attempts_total", "cme_ocr_escalations_total", "cme_ocr_latency_seconds_total", "cme_ocr_cost_usd_total"]:
+            tiers = [line for line in metrics.splitlines() if line.startswith(metric + "{")]
+            assert tiers, metric
+            assert all('tier="' in line for line in tiers)
+
+
+
+# ============ PROVIDER TEMPLATES ============
+
+class TestOcrTemplateMetrics:
+    def test_metrics_report_template_outcomes(self):
+        outcomes = [line.split('"')[1] for line in get_metrics().splitlines() if line.startswith("cme_ocr_template_total{")]
+        assert {"hit", "fallback", "miss", "no_text_layer"} <= set(outcomes)
+
+
+def template_page(learner, title, credits, date, number):
+    return "\n".join([
+        "ACME Medical Education",
+        "Certificate of Completion",
+        f"This certifies that {learner} completed on {date}",
+        f"the activity {title}",
+        f"and is awarded {credits} AMA PRA Category 1 Credit(s)",
+        f"Certificate No. {number}",
+        "Accredited by the ACCME",
+        "Program Director",
+        "Continuing Medical Education Department",
+    ])
+
+
+class TestOcrTemplateLearning:
+    """Layout rules learned from one learner's certificate, applied to another's.
+
+    Imports the backend, so it runs where the server's environment is configured.
+    """
+    first = template_page("Jane Q. Doe", "Sepsis Update", "1.5", "March 5, 2025", "A-1001")
+    second = template_page("Robert Roe", "Stroke Care Essentials", "2.25", "April 12, 2025", "B-2040")
+    first_data = {"title": "Sepsis Update", "provider": "ACME Medical Education", "credits": 1.5,
+                  "credit_type": "AMA PRA Category 1 Credit(s)", "completion_date": "2025-03-05", "certificate_number": "A-1001"}
+
+    def test_template_keeps_no_page_text(self):
+        import server
+        layout = server.learn_template_layout(server.template_units(self.first), self.first_data)
+        stored = json.dumps(layout["fields"])
+        for text in ["Jane", "Doe", "Sepsis", "certifies", "completed", "awarded", "Certificate"]:
+            assert text not in stored
+
+    def test_template_applies_to_another_learner(self):
+        import server
+        layout = server.learn_template_layout(server.template_units(self.first), self.first_data)
+        data = server.apply_template(layout, server.template_units(self.second))
+        assert data["title"] == "Stroke Care Essentials"
+        assert data["credits"] == 2.25
+        assert data["completion_date"] == "2025-04-12"
+        assert data["certificate_number"] == "B-2040"
+        assert data["credit_type"] == "AMA PRA Category 1 Credit(s)"
+        assert data["provider"] == "ACME Medical Education"
+
+
+# ============ CERTIFICATE CODE DETECTION ============
+
+def certificate_with_qr(payload):
+    """A certificate photo with an EEDS QR code printed in the corner"""
+    cv2 = pytest.importorskip("cv2")
+    from PIL import Image, ImageDraw
+    import io
+
+    image = Image.new("RGB", (1600, 1200), (250, 248, 240))
+    draw = ImageDraw.Draw(image)
+    draw.rectangle([40, 40, 1560, 1160], outline=(20, 20, 120), width=12)
+    qr = Image.fromarray(cv2.QRCodeEncoder.create().encode(payload))
+    image.paste(qr.resize((qr.width * 8, qr.height * 8), Image.NEAREST), (1150, 750))
+    output = io.BytesIO()
+    image.save(output, "JPEG", quality=85)
+    return output.getvalue()
+
+
+class TestUploadQrDetection:
+    def upload(self, data):
+        return requests.post(
+            f"{BASE_URL}/api/certificates/upload",
+            headers={"Authorization": f"Bearer {SESSION_TOKEN}"},
+            files={"file": ("TEST_qr.jpg", data, "image/jpeg")}
+        )
+
+    def test_eeds_qr_upload_skips_ocr(self, api_client):
+        number = f"TEST-QR-{int(time.time())}"
+        payload = f"title=TEST QR Sepsis Update|provider=EEDS|credits=1.5|date=03/05/2025|cert={number}"
+        r = self.upload(certificate_with_qr(payload))
+        assert r.status_code == 200
+        cert = r.json()
+        assert cert["title"] == "TEST QR Sepsis Update"
+        assert cert["credits"] == 1.5
+        assert cert["completion_date"] == "2025-03-05"
+        assert cert["certificate_number"] == number
+        assert cert["eeds_imported"] is True
+        assert cert["ocr_data"]["ocr_model"] == "eeds_qr"
+
+        metrics = get_metrics()
+        assert 'cme_certificate_uploads_total{path="eeds_qr"}' in metrics
+        api_client.delete(f"{BASE_URL}/api/certificates/{cert['certificate_id']}")
+
+
+# ============ EVENT STREAM ============
+
+class TestEventStream:
+    def test_stream_requires_auth(self):
+        r = requests.get(f"{BASE_URL}/api/events/stream", timeout=10)
+        assert r.status_code == 401
+
+    def test_stream_opens_as_sse(self):
+        with requests.get(
+            f"{BASE_URL}/api/events/stream",
+            headers={"Authorization": f"Bearer {SESSION_TOKEN}"},
+            stream=True,
+            timeout=10
+        ) as r:
+            assert r.status_code == 200
+            assert r.headers["Content-Type"].startswith("text/event-stream")
+            first = next(r.iter_lines(decode_unicode=True))
+            assert first.startswith("retry:")
+
+    def test_requirement_progress_is_pushed(self, api_client):
+        """Adding a certificate pushes the new progress of a matching requirement"""
+        req = api_client.post(f"{BASE_URL}/api/requirements", json={
+            "name": "TEST SSE requirement",
+            "requirement_type": "personal",
+            "credit_types": ["ama_cat1"],
+            "credits_required": 50,
+            "due_date": "2030-12-31"
+        }).json()
+        with requests.get(
+            f"{BASE_URL}/api/events/stream",
+            headers={"Authorization": f"Bearer {SESSION_TOKEN}"},
+            stream=True,
+            timeout=20
+        ) as r:
+            lines = r.iter_lines(decode_unicode=True)
+            next(lines)
+            cert = api_client.post(f"{BASE_URL}/api/certificates", json={
+                "title": "TEST SSE certificate",
+                "provider": "TEST",
+                "credits": 2,
+                "credit_types": ["ama_cat1"],
+                "completion_date": time.strftime("%Y-%m-%d")
+            }).json()
+            event = None
+            for line in lines:
+                if line.startswith("event: requirement.progress"):
+                    event = json.loads(next(lines)[len("data: "):])
+                    if event["requirement_id"] == req["requirement_id"]:
+                        break
+            assert event["requirement_id"] == req["requirement_id"]
+        api_client.delete(f"{BASE_URL}/api/certificates/{cert['certificate_id']}")
+        api_client.delete(f"{BASE_URL}/api/requirements/{req['requirement_id']}")
+
+
+# ============ DELTA SYNC ============
+
+class TestDeltaSync:
+    def drain(self, api_client, since=None, limit=200):
+        """Follow a sync to the end, returning everything it sent and the final token"""
+        changes = {"certificates": {}, "deleted": []}
+        while True:
+            params = {"limit": limit, **({"since": since} if since else {})}
+            r = api_client.get(f"{BASE_URL}/api/sync", params=params)
+            assert r.status_code == 200
+            body = r.json()
+            changes["certificates"].update({c["certificate_id"]: c for c in body["certificates"]})
+            changes["deleted"] += body["deleted"]
+            since = body["next"]
+            if not body["has_more"]:
+                return changes, since
+
+    def test_full_then_delta_sync(self, api_client):
+        _, token = self.drain(api_client)
+        created = api_client.post(f"{BASE_URL}/api/certificates", json={
+            "title": "TEST sync certificate",
+            "provider": "TEST",
+            "credits": 1,
+            "credit_types": ["ama_cat1"],
+            "completion_date": "2025-01-15"
+        }).json()
+
+        changes, token = self.drain(api_client, token)
+        assert created["certificate_id"] in changes["certificates"]
+        assert "image_url" not in changes["certificates"][created["certificate_id"]]
+
+        api_client.delete(f"{BASE_URL}/api/certificates/{created['certificate_id']}")
+        changes, _ = self.drain(api_client, token)
+        assert {"resource": "certificates", "id": created["certificate_id"]} in changes["deleted"]
+
+    def test_large_delta_is_paged(self, api_client):
+        _, token = self.drain(api_client)
+        ids = [
+            api_client.post(f"{BASE_URL}/api/certificates", json={
+                "title": f"TEST sync page {i}",
+                "provider": "TEST",
+                "credits": 1,
+                "credit_types": ["ama_cat1"],
+                "completion_date": "2025-01-15"
+            }).json()["certificate_id"]
+            for i in range(5)
+        ]
+        first = api_client.get(f"{BASE_URL}/api/sync", params={"since": token, "limit": 2}).json()
+        assert first["has_more"] is True
+        assert len(first["certificates"]) == 2
+        changes, _ = self.drain(api_client, token, limit=2)
+        assert set(ids) <= set(changes["certificates"])
+        for cert_id in ids:
+            api_client.delete(f"{BASE_URL}/api/certificates/{cert_id}")
+
+    def test_invalid_token(self, api_client):
+        r = api_client.get(f"{BASE_URL}/api/sync", params={"since": "not-a-token"})
+        assert r.status_code == 400
@@ -70,6 +70,8 @@ const Certificates = () => {
   const [selectedCert, setSelectedCert] = useState(null);
   const [importData, setImportData] = useState("");
   const [importLoading, setImportLoading] = useState(false);
+  const [importFile, setImportFile] = useState(null);
+  const [importProgress, setImportProgress] = useState(null);
   const [newCustomType, setNewCustomType] = useState({ name: "", description: "" });
   
   // Generate years from current year back to 1990
@@ -101,6 +103,15 @@ const Certificates = () => {
     fetchData();
   }, []);
 
+  // OCR results pushed by the server, so finished uploads show up without polling
+  useEffect(() => {
+    const events = new EventSource(`${api.defaults.baseURL}/events/stream`, { withCredentials: true });
+    events.addEventListener("certificate.ocr", (event) => {
+      if (JSON.parse(event.data).ocr_status !== "processing") fetchData();
+    });
+    return () => events.close();
+  }, []);
+
   const fetchData = async () => {
     try {
       const [certsRes, typesRes] = await Promise.all([
@@ -124,10 +135,25 @@ const Certificates = () => {
     const formData = new FormData();
     formData.append("file", file);
 
-    try {
-      const response = await api.post("/certificates/upload", formData, {
-        headers: { "Content-Type": "multipart/form-data" }
+    const upload = (allowDuplicate) =>
+      api.post("/certificates/upload", formData, {
+        headers: { "Content-Type": "multipart/form-data" },
+        params: allowDuplicate ? { allow_duplicate: true } : undefined
       });
+
+    try {
+      let response;
+      try {
+        response = await upload(false);
+      } catch (error) {
+        // The server recognised a rescan of a certificate already on file
+        const existing = error.response?.status === 409 && error.response.data.detail?.duplicates?.[0];
+        if (!existing) throw error;
+        if (!window.confirm(`This looks like "${existing.title}" (${existing.completion_date}), which you already uploaded. Upload it anyway?`)) {
+          return;
+        }
+        response = await upload(true);
+      }
       
       const ocrStatus = response.data.ocr_status;
       const ocrError = response.data.ocr_error;
@@ -222,8 +248,41 @@ const Certificates = () => {
     }
   };
 
+  // List rows use the lean summary view; fetch the full certificate (image, OCR data) on demand
+  const loadCertificateDetail = async (cert) => {
+    if ("image_url" in cert) return;
+    try {
+      const response = await api.get(`/certificates/${cert.certificate_id}`);
+      setSelectedCert(response.data);
+    } catch (error) {
+      // The summary is still usable without the preview image
+    }
+  };
+
+  // Show the server-rendered WebP preview rather than the full-resolution original
+  const certificateImageSrc = (cert) =>
+    cert.preview_url ? `${api.defaults.baseURL}${cert.preview_url.replace(/^\/api/, "")}` : cert.image_url;
+
+  // No preview could be rendered (e.g. an unreadable PDF): fall back to the original
+  const handlePreviewError = async () => {
+    if (!selectedCert?.preview_url) return;
+    try {
+      const response = await api.get(`/certificates/${selectedCert.certificate_id}`);
+      setSelectedCert({ ...response.data, preview_url: null });
+    } catch (error) {
+      setSelectedCert((cert) => ({ ...cert, preview_url: null }));
+    }
+  };
+
+  const openViewDialog = (cert) => {
+    setSelectedCert(cert);
+    setShowViewDialog(true);
+    if (!cert.preview_url) loadCertificateDetail(cert);
+  };
+
   const openEditDialog = (cert) => {
     setSelectedCert(cert);
+    if (!cert.preview_url) loadCertificateDetail(cert);
     const creditTypes = cert.credit_types || (cert.credit_type ? [cert.credit_type] : []);
     setEditData({
       title: cert.title || "",
@@ -267,9 +326,63 @@ const Certificates = () => {
     }
   };
 
+  // Last complete line of the NDJSON progress stream
+  const lastImportEvent = (text) => {
+    const lines = text.split("\n");
+    lines.pop();
+    return lines.length ? JSON.parse(lines[lines.length - 1]) : null;
+  };
+
+  const handleFileImport = async () => {
+    setImportLoading(true);
+    const formData = new FormData();
+    formData.append("file", importFile);
+
+    try {
+      const response = await api.post("/certificates/import-file", formData, {
+        headers: { "Content-Type": "multipart/form-data" },
+        responseType: "text",
+        onDownloadProgress: (e) => {
+          const text = e.event?.target?.responseText;
+          if (text) setImportProgress(lastImportEvent(text));
+        }
+      });
+      const events = response.data.split("\n").filter(Boolean).map((line) => JSON.parse(line));
+      const failure = events.find((event) => event.type === "error");
+      const summary = events[events.length - 1];
+
+      if (failure) {
+        // Keep the dialog open so the file can be fixed and imported again
+        toast.error(failure.detail);
+        if (summary.imported_count > 0) {
+          toast.warning(`${summary.imported_count} certificates were imported before the error`);
+          fetchData();
+        }
+        return;
+      }
+      toast.success(`Imported ${summary.imported_count} certificates`);
+      if (summary.error_count > 0) {
+        toast.warning(`${summary.error_count} rows had errors`);
+      }
+
+      setShowImportDialog(false);
+      setImportFile(null);
+      fetchData();
+    } catch (error) {
+      toast.error(error.response?.data?.detail || "Failed to import file");
+      console.error("Import error:", error);
+    } finally {
+      setImportLoading(false);
+      setImportProgress(null);
+    }
+  };
+
   const handleBulkImport = async () => {
+    if (importFile) {
+      return handleFileImport();
+    }
     if (!importData.trim()) {
-      toast.error("Please paste CSV data");
+      toast.error("Please paste CSV data or choose a file");
       return;
     }
 
@@ -559,7 +672,7 @@ const Certificates = () => {
                               <Button
                                 variant="ghost"
                                 size="icon"
-                                onClick={() => { setSelectedCert(cert); setShowViewDialog(true); }}
+                                onClick={() => openViewDialog(cert)}
                                 data-testid={`view-cert-${cert.certificate_id}`}
                               >
                                 <Eye className="w-4 h-4" />
@@ -726,12 +839,13 @@ const Certificates = () => {
             </DialogHeader>
             {selectedCert && (
               <div className="space-y-4">
-                {selectedCert.image_url && (
+                {certificateImageSrc(selectedCert) && (
                   <div className="rounded-lg overflow-hidden border border-slate-200 bg-slate-50">
                     <img
-                      src={selectedCert.image_url}
+                      src={certificateImageSrc(selectedCert)}
                       alt="Certificate"
                       className="w-full h-auto max-h-[300px] object-contain"
+                      onError={handlePreviewError}
                     />
                   </div>
                 )}
@@ -790,12 +904,13 @@ const Certificates = () => {
             </DialogHeader>
             {selectedCert && (
               <form onSubmit={handleEditSubmit} className="space-y-4">
-                {selectedCert.image_url && (
+                {certificateImageSrc(selectedCert) && (
                   <div className="rounded-lg overflow-hidden border border-slate-200 bg-slate-50">
                     <img
-                      src={selectedCert.image_url}
+                      src={certificateImageSrc(selectedCert)}
                       alt="Certificate"
                       className="w-full h-auto max-h-[200px] object-contain"
+                      onError={handlePreviewError}
                     />
                   </div>
                 )}
@@ -923,7 +1038,22 @@ const Certificates = () => {
                 </p>
               </div>
               <div>
-                <Label htmlFor="csv_data">Paste CSV Data</Label>
+                <Label htmlFor="import_file">Upload a CSV or Excel file</Label>
+                <Input
+                  id="import_file"
+                  type="file"
+                  accept=".csv,.xlsx"
+                  onChange={(e) => setImportFile(e.target.files[0] || null)}
+                  data-testid="import-file-input"
+                />
+                {importLoading && importProgress && (
+                  <p className="text-xs text-slate-500 mt-2">
+                    {importProgress.rows_read} rows processed, {importProgress.imported_count} imported
+                  </p>
+                )}
+              </div>
+              <div>
+                <Label htmlFor="csv_data">Or paste CSV Data</Label>
                 <Textarea
                   id="csv_data"
                   value={importData}